@@ -1,31 +1,66 @@
 import os, time
+from contextlib import nullcontext
+from datetime import datetime
 from pathlib import Path
 
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, send_file
 from flask_cors import CORS
 from flask_socketio import SocketIO
 
 from utils import search_file
 from decorators import logger
-from module.ext_module import extract_pid, extract_pid_multi_files_single_call
-from module.agent_module import run_hazop_agent
+from module.ext_module import extract_pid, extract_pid_multi_files_single_call, extract_pid_tiled
+from module.agent_module import run_hazop_agent, plan_hazop_run
+from module.graph_module import build_pid_graph, partition_study_nodes
+from module.diff_module import diff_pid, load_pid_document
+from module.preprocess_module import preprocess_options_from_form
+from module.tile_module import parse_grid
+from module.progress_module import ProgressPublisher
+from module.llm_module import DEFAULT_CHAT_MODEL, HedgePolicy
+from module.routing_module import ModelRouter, summarize_model_usage
+from module.runs_module import finish_run, merge_runs, run_paths, start_run
+from module.estimate_module import estimate_run
+from module.profile_module import Profiler, list_profiles, profile_ids, profile_mode, resolve_profile
+from module.trace_module import TRACE_FILE, Tracer, record_span, span
+from module.results_module import ensure_results_index, query_results
+from module.retrieval_module import EmbeddingIndex, ProcessRetriever, get_embedder
 from utils import save_pid_json
 
 app = Flask(__name__, static_folder="static")
 CORS(app)
 socketio = SocketIO(app, cors_allowed_origins="*")
 DATA_DIR = Path(app.root_path) / "static" / "data"
+STATIC_DIR = "static"
 
 @app.before_request
 def log_request():
     logger.info(
         f" {request.method} {request.path} | args={dict(request.args)} | form={dict(request.form)}"
     )
+
+def attach_study_nodes(result: dict) -> dict:
+    # node grouping shown in the selection UI; same partition run_hazop_agent uses
+    data = result.get("data")
+    if result.get("ok") and isinstance(data, dict):
+        try:
+            result["study_nodes"] = partition_study_nodes(build_pid_graph(data))
+        except Exception as e:
+            logger.warning(f"Study node partition failed: {e}")
+    return result
+
 # ---------- Extract agent via Socket.IO -----------------
 @app.route("/api/full", methods=["POST"])
 def api_full():
     name = request.form.get("name", "").strip()
     description = request.form.get("description", "").strip()
+    # "tiled" = per page/region parallel extraction; grid like "2x2" splits each page
+    mode = request.form.get("mode", "").strip().lower()
+    # preprocess=1 (+ dpi, grayscale, threshold, crop, ...) cleans drawings before upload
+    try:
+        grid = parse_grid(request.form.get("grid", "1x1"))
+        preprocess = preprocess_options_from_form(request.form)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
 
     logger.info("🟦 /api/full received")
     logger.info(f"name: {name}")
@@ -45,37 +80,47 @@ def api_full():
     if not files:
         return jsonify({"ok": False, "error": "No file received"}), 400
 
-    upload_dir = Path("static") / "uploads"
-    upload_dir.mkdir(parents=True, exist_ok=True)
-
-    saved_paths = []
-    for f in files:
-        if not f.filename:
-            continue
+    # werkzeug keeps each part in memory or a spooled temp file; hand the
+    # streams straight to the provider instead of saving a copy first
+    sources = [(f.filename, f.stream) for f in files if f.filename]
+    for filename, _ in sources:
+        logger.info(f"file received: {filename}")
 
-        save_path = upload_dir / f.filename
-        f.save(save_path)
-        saved_paths.append(str(save_path))
-
-        logger.info(f"file saved to: {save_path}")
-
-    if not saved_paths:
+    if not sources:
         return jsonify({"ok": False, "error": "No valid file received"}), 400
 
     # ----------------------------
     # 2) RUN EXTRACTOR
     # ----------------------------
+    # opt-in: X-Profile header or profile= field ("1" cProfile, "sample" all threads)
+    mode_profile = profile_mode(request.headers.get("X-Profile"), request.form.get("profile"), request.args.get("profile"))
+    profiler = Profiler(str(DATA_DIR), f"full-{name or 'upload'}", mode_profile).start() if mode_profile else None
+    # opt-in: X-Trace header or trace=1 -> upload / extract / LLM spans in static/data/traces/
+    tracer = None
+    if (request.headers.get("X-Trace") or request.form.get("trace") or "").strip().lower() in ("1", "true", "yes", "on"):
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")[:-3]
+        tracer = Tracer(str(DATA_DIR / "traces" / f"full-{stamp}.jsonl"), name=name)
     try:
-        if len(saved_paths) == 1:
-            pid_data, usage_meta = extract_pid(
-                saved_paths[0],
-                process_description=description,
-            )
-        else:
-            pid_data, usage_meta = extract_pid_multi_files_single_call(
-                saved_paths,
-                process_description=description,
-            )
+        with tracer.activate() if tracer else nullcontext(), span("api_full", mode=mode or "single", files=len(sources)):
+            if mode == "tiled":
+                pid_data, usage_meta = extract_pid_tiled(
+                    sources,
+                    process_description=description,
+                    grid=grid,
+                    preprocess=preprocess,
+                )
+            elif len(sources) == 1:
+                pid_data, usage_meta = extract_pid(
+                    sources[0],
+                    process_description=description,
+                    preprocess=preprocess,
+                )
+            else:
+                pid_data, usage_meta = extract_pid_multi_files_single_call(
+                    sources,
+                    process_description=description,
+                    preprocess=preprocess,
+                )
 
         # ----------------------------
         # 3) SAVE JSON USING NAME
@@ -83,7 +128,7 @@ def api_full():
         json_path = save_pid_json(
             pid_data=pid_data,
             metadata=usage_meta,
-            image_path=saved_paths[0],
+            image_path=Path(sources[0][0]).name,
             out_dir="static/data",
             name=name or None,
         )
@@ -92,7 +137,7 @@ def api_full():
         # 4) RELOAD JSON → same format as /api/search
         # ----------------------------
         base_name = name or Path(json_path).stem
-        result = search_file(base_name, Path("static/data"))
+        result = attach_study_nodes(search_file(base_name, Path("static/data")))
 
     except Exception as e:
         logger.exception("Full extract failed")
@@ -104,27 +149,17 @@ def api_full():
         })
 
         return jsonify({"ok": False, "error": str(e)}), 500
+    finally:
+        if tracer:
+            tracer.close()
+        if profiler:
+            profiler.stop()
 
-    # ----------------------------
-    # 5) CLEANUP ALL UPLOADED FILES
-    # ----------------------------
-    for path in saved_paths:
-        try:
-            Path(path).unlink(missing_ok=True)
-            logger.info(f"cleaned file: {path}")
-        except Exception as cleanup_err:
-            logger.warning(f"Failed to remove {path}: {cleanup_err}")
-
-    # (Optional extra cleanup: remove the folder if empty)
-    try:
-        if not any(upload_dir.iterdir()):
-            upload_dir.rmdir()
-            logger.info("removed empty uploads folder")
-    except:
-        pass
+    if profiler:
+        result["profile"] = profile_ids(STATIC_DIR, profiler.files)
 
     # ----------------------------
-    # 6) EMIT RESULT TO FRONTEND
+    # 5) EMIT RESULT TO FRONTEND
     # ----------------------------
     time.sleep(2)
     socketio.emit("file_status", {
@@ -151,7 +186,7 @@ def api_search():
         },
     )
 
-    result = search_file(name, DATA_DIR)
+    result = attach_study_nodes(search_file(name, DATA_DIR))
 
     status_code = 200
     if not result.get("ok", False):
@@ -171,12 +206,136 @@ def api_search():
     logger.info(f"SocketIO emit: {result}")
     return jsonify(result), status_code
 
+@app.route("/api/diff", methods=["GET"])
+def api_diff():
+    old_name = request.args.get("old", "").strip()
+    new_name = request.args.get("new", "").strip()
+
+    logger.info(f"🟨 /api/diff received: {old_name} → {new_name}")
+
+    if not old_name or not new_name:
+        return jsonify({"ok": False, "error": "Both 'old' and 'new' are required"}), 400
+
+    try:
+        diff = diff_pid(load_pid_document(old_name, DATA_DIR), load_pid_document(new_name, DATA_DIR))
+    except FileNotFoundError as e:
+        return jsonify({"ok": False, "error": str(e)}), 404
+
+    return jsonify({"ok": True, "old": old_name, "new": new_name, "diff": diff}), 200
+
+@app.route("/api/profiles", methods=["GET"])
+def api_profiles():
+    return jsonify({"ok": True, "profiles": list_profiles(STATIC_DIR)}), 200
+
+@app.route("/api/profiles/<path:profile_id>", methods=["GET"])
+def api_profile_download(profile_id: str):
+    try:
+        path = resolve_profile(STATIC_DIR, profile_id)
+    except FileNotFoundError as e:
+        return jsonify({"ok": False, "error": str(e)}), 404
+    return send_file(os.path.abspath(path), as_attachment=True)
+
+@app.route("/api/estimate", methods=["POST"])
+def api_estimate():
+    # expected tokens / cost / wall-clock for a proposed selection, from past token logs
+    data = request.get_json(silent=True) or {}
+    selections = data.get("selections") or []
+    if not data.get("pid_data") or not selections:
+        return jsonify({"ok": False, "error": "pid_data and selections are required"}), 400
+    try:
+        concurrency = max(1, int(data.get("concurrency", 1)))
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "error": "concurrency must be an integer"}), 400
+
+    plan = plan_hazop_run(
+        data["pid_data"],
+        selections,
+        group_study_nodes=bool(data.get("group_study_nodes", False)),
+        concurrency=concurrency,
+    )
+    estimate = estimate_run(plan, concurrency=concurrency, model=(data.get("model") or DEFAULT_CHAT_MODEL).strip())
+    return jsonify({
+        "ok": True,
+        "duplicates": plan["duplicates"],
+        "skipped": plan["skipped"],
+        **estimate,
+    }), 200
+
+@app.route("/api/results/<folder>", methods=["GET"])
+def api_results(folder):
+    # one page of a folder's merged HAZOP rows: ?line=&parameter=Flow,Pressure&guide_word=
+    # &risk=High&unmitigated_risk=&sort=-rr&limit=50&cursor=<next_cursor>
+    hazop_root = os.path.realpath(os.path.join(STATIC_DIR, "hazop"))
+    base_dir = os.path.realpath(os.path.join(hazop_root, folder))
+    if os.path.dirname(base_dir) != hazop_root or not os.path.isdir(base_dir):
+        return jsonify({"ok": False, "error": f"Unknown output folder: {folder}"}), 404
+
+    def multi(key):
+        return [v.strip() for v in request.args.get(key, "").split(",") if v.strip()]
+
+    filters = {
+        "line": request.args.get("line", "").strip(),
+        "parameter": multi("parameter"),
+        "guide_word": multi("guide_word"),
+        "risk": multi("risk"),
+        "unmitigated_risk": multi("unmitigated_risk"),
+    }
+    try:
+        page = query_results(
+            base_dir,
+            filters,
+            sort=request.args.get("sort", "-rr").strip(),
+            limit=int(request.args.get("limit", 50)),
+            cursor=request.args.get("cursor") or None,
+        )
+    except FileNotFoundError as e:
+        return jsonify({"ok": False, "error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    return jsonify({"ok": True, "folder": folder, **page}), 200
+
 # ---------- HAZOP analysis agent via Socket.IO ----------
 @socketio.on("hazop_start")
 def handle_hazop_start(data):
+    handler_wall, handler_t0 = time.time(), time.perf_counter()
     logger.info(f"hazop_start received: {len(data.get('selections', []))} selections")
     pid_data = data.get("pid_data", {})
     selections = data.get("selections", [])
+    group_study_nodes = bool(data.get("group_study_nodes", False))
+    engine = (data.get("engine") or "sdk").strip()
+    output_mode = (data.get("output_mode") or "csv").strip()
+    risk_mode = (data.get("risk_mode") or "correct").strip()
+    streaming = bool(data.get("streaming", False))
+    # duplicate deviation calls slower than the recent p90 (capped at 10% of calls)
+    hedge = HedgePolicy() if data.get("hedge") else None
+    # per-deviation model choice (DEFAULT_ROUTE_RULES), escalation on failed validation
+    router = ModelRouter() if data.get("routing") else None
+    mode_profile = profile_mode(data.get("profile"))
+    # retrieval_top_k > 0: inject only that many relevant process / reference chunks per deviation
+    try:
+        retrieval_top_k = max(0, int(data.get("retrieval_top_k") or 0))
+    except (TypeError, ValueError):
+        retrieval_top_k = 0
+    embedder_kind = (data.get("embedder") or "openai").strip()
+    # whole-process "Others" pass, run alongside the line deviations
+    process_others = bool(data.get("process_others", False))
+    reference_documents = [d for d in data.get("reference_documents") or [] if (d or {}).get("text")]
+    try:
+        progress_interval_s = max(0.05, float(data.get("progress_interval_s", 0.5)))
+    except (TypeError, ValueError):
+        progress_interval_s = 0.5
+
+    # incremental re-analysis against an earlier revision + its output folder
+    previous_file = (data.get("previous_file") or "").strip()
+    previous_folder = (data.get("previous_output_folder") or "").strip()
+    previous_pid_data = None
+    previous_output_folder = None
+    if previous_file and previous_folder:
+        try:
+            previous_pid_data = load_pid_document(previous_file, DATA_DIR)
+            previous_output_folder = os.path.join("static", "hazop", previous_folder)
+        except FileNotFoundError as e:
+            logger.warning(f"Incremental mode disabled: {e}")
 
     raw_name = (data.get("file_name") or "").strip()
     if not raw_name:
@@ -193,45 +352,100 @@ def handle_hazop_start(data):
         output_folder = "default"
 
     base_dir = os.path.join("static", "hazop", output_folder)
-    os.makedirs(base_dir, exist_ok=True)
 
+    # every run writes to its own runs/<run_id>/ folder; the folder-level
+    # files are rebuilt from finished runs by merge_runs under a folder lock,
+    # so sessions sharing an output folder cannot clobber each other
+    run = start_run(base_dir, file_name)
+    paths = run_paths(run)
     excel_path = os.path.join(base_dir, file_name)
-    token_log_path = os.path.join(base_dir, "token_log.csv")
-    error_log_path = os.path.join(base_dir, "error_log.csv")
-    llm_response_log_path = os.path.join(base_dir, "llm_response_log.csv")
-    parsed_excel_path = os.path.join(base_dir, "parsed_rows.xlsx")
+    token_log_path = paths["token_log_path"]
 
-    logger.info(f"HAZOP start: {excel_path}")
+    logger.info(f"HAZOP start: {excel_path} (run {run['run_id']})")
     logger.info(f"Selections count: {len(selections)}")
 
     sid = request.sid
+    # spans of this run (queue wait, prompt, LLM, parse, writes, emits) -> runs/<run_id>/trace.jsonl
+    tracer = Tracer(os.path.join(run["dir"], TRACE_FILE), sid=sid, run_id=run["run_id"])
 
     def background_task():
+        with tracer.activate(), span("hazop_run", file_name=file_name, streaming=streaming):
+            record_span("hazop_start_handler", handler_wall, handler_s)
+            record_span("job_queue", handler_wall + handler_s, time.perf_counter() - handler_t0 - handler_s)
+            run_job()
+        tracer.close()
+
+    def run_job():
+        # profile lands in the run folder: runs/<run_id>/profiles/
+        profiler = Profiler(run["dir"], "hazop", mode_profile).start() if mode_profile else None
         try:
+            plan = plan_hazop_run(pid_data, selections, group_study_nodes=group_study_nodes)
+            # one progress update per planned deviation, plus the process-level Others pass
+            total = len(plan["items"]) + int(process_others)
+            socketio.emit(
+                "hazop_plan",
+                {
+                    "total": total,
+                    "duplicates": plan["duplicates"],
+                    "skipped": plan["skipped"],
+                    "estimated_total_tokens": plan["estimated_total_tokens"],
+                    "estimated_seconds": plan["estimated_seconds"],
+                },
+                room=sid,
+            )
+
+            retriever = None
+            if retrieval_top_k:
+                retriever = ProcessRetriever(EmbeddingIndex(get_embedder(embedder_kind)), top_k=retrieval_top_k)
+                for doc in reference_documents:
+                    retriever.add("reference", doc["text"])
+
+            # coalesced, rate-limited, ack-gated progress for this client
+            progress = ProgressPublisher(
+                lambda event, payload, callback: socketio.emit(event, payload, to=sid, callback=callback),
+                total=total,
+                interval_s=progress_interval_s,
+            )
+
             for key, tokens_used in run_hazop_agent(
                 pid_data=pid_data,
-                excel_path=excel_path,
-                token_log_path=token_log_path,
-                error_log_path=error_log_path,
-                llm_response_log_path=llm_response_log_path,
-                parsed_excel_path=parsed_excel_path,
+                **paths,
                 selections=selections,
+                group_study_nodes=group_study_nodes,
+                previous_pid_data=previous_pid_data,
+                previous_output_folder=previous_output_folder,
+                plan=plan,
+                engine=engine,
+                output_mode=output_mode,
+                risk_mode=risk_mode,
+                streaming=streaming,
+                hedge=hedge,
+                router=router,
+                retriever=retriever,
+                process_others=process_others,
             ):
                 try:
                     line_id, param, guide_word = key.split(":")
                 except ValueError:
                     line_id, param, guide_word = key, "", ""
 
-                socketio.emit(
-                    "hazop_progress",
-                    {
-                        "line_id": line_id,
-                        "parameter": param,
-                        "guide_word": guide_word,
-                        "tokens_used": tokens_used,
-                    },
-                    room=sid,
-                )
+                with span("emit", line_id=line_id, parameter=param, guide_word=guide_word):
+                    progress.update(
+                        {
+                            "line_id": line_id,
+                            "parameter": param,
+                            "guide_word": guide_word,
+                            "tokens_used": tokens_used,
+                        },
+                        tokens_used,
+                    )
+
+            with span("emit", flush=True):
+                progress.flush()
+            finish_run(run, "complete")
+            merged = merge_runs(base_dir)
+            if profiler:
+                profiler.stop()
 
             socketio.emit(
                 "hazop_complete",
@@ -239,12 +453,27 @@ def handle_hazop_start(data):
                     "ok": True,
                     "folder": base_dir,
                     "file_name": os.path.basename(excel_path),
+                    "run_id": run["run_id"],
+                    "merged_runs": len(merged["runs"]),
+                    "hedge": hedge.stats() if hedge else None,
+                    "models": summarize_model_usage(token_log_path) if router else None,
+                    "profile": profile_ids(STATIC_DIR, profiler.files) if profiler else None,
+                    "trace": os.path.relpath(tracer.path, STATIC_DIR).replace(os.sep, "/"),
                 },
                 room=sid,
             )
+            # build the /api/results index now, so the first page does not pay for it
+            ensure_results_index(base_dir)
 
         except Exception as e:
             logger.exception(f"HAZOP background task error: {e}")
+            # rows written before the failure are kept and still merged
+            try:
+                if run["status"] == "running":
+                    finish_run(run, "failed")
+                merge_runs(base_dir)
+            except Exception as merge_err:
+                logger.error(f"Merge after failed run {run['run_id']} failed: {merge_err}")
             socketio.emit(
                 "hazop_complete",
                 {
@@ -255,7 +484,13 @@ def handle_hazop_start(data):
                 },
                 room=sid,
             )
+        finally:
+            if hedge:
+                hedge.close()
+            if profiler and not profiler.files:
+                profiler.stop()
 
+    handler_s = time.perf_counter() - handler_t0
     socketio.start_background_task(background_task)
 
 if __name__ == "__main__":
@@ -0,0 +1,144 @@
+"""
+Completion size and latency of the compact wire format vs. the 22-column CSV rows.
+
+Two modes:
+
+    --live N     measured: sends the first N deviations of --pid through both
+                 prompts (call_chat_completion) and reports the provider's
+                 completion_tokens and wall latency. Every call is appended to
+                 --record (JSONL) so the numbers can be re-reported later.
+    --recorded   re-reports a JSONL file written by --live, no API calls.
+
+Without either flag the benchmark only PROJECTS the saving: it re-encodes the
+deviations in static/hazop/*/parsed_rows.xlsx both ways, counts tokens with
+estimate_tokens and scales decode time by the logged gpt-4.1 per-token rate
+(DEFAULT_SECONDS_PER_CALL over DEFAULT_COMPLETION_TOKENS). Those numbers are
+an estimate, not a measurement. Local expansion cost is measured in all modes.
+
+Run from backend/:
+    python -m benchmarks.bench_compact_output
+    python -m benchmarks.bench_compact_output --live 5 --record compact_calls.jsonl
+    python -m benchmarks.bench_compact_output --recorded compact_calls.jsonl
+"""
+import argparse, glob, json, os, statistics, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from module.compact_module import encode_compact_rows, expand_compact_rows
+from module.fewshot_module import estimate_tokens
+from module.plan_module import DEFAULT_COMPLETION_TOKENS, DEFAULT_SECONDS_PER_CALL
+from module.schema_json import HAZOP_HEADERS
+
+FORMATS = ("csv", "compact")
+
+def _load_deviations(pattern: str):
+    for path in sorted(glob.glob(pattern)):
+        df = pd.read_excel(path).iloc[:, :len(HAZOP_HEADERS)]
+        df.columns = HAZOP_HEADERS
+        df = df.astype(object).where(df.notna(), "N/A")
+        for _, group in df.groupby(["Node", "Guide Word", "Parameter"], sort=False):
+            rows = [[int(v) if isinstance(v, float) and v.is_integer() else v for v in r] for r in group.values.tolist()]
+            yield rows
+
+# ------------- PROJECTED (no API calls) ----------------------
+def projected(pattern: str) -> None:
+    seconds_per_token = DEFAULT_SECONDS_PER_CALL / DEFAULT_COMPLETION_TOKENS
+    csv_tokens, compact_tokens, expand_ms = [], [], []
+
+    for rows in _load_deviations(pattern):
+        csv_text = "\n".join(",".join(str(v) for v in r) for r in rows)
+        compact_text = encode_compact_rows(rows)
+        csv_tokens.append(estimate_tokens(csv_text))
+        compact_tokens.append(estimate_tokens(compact_text))
+
+        node, guide_word, parameter = rows[0][0], rows[0][1], rows[0][2]
+        start = time.perf_counter()
+        expand_compact_rows(compact_text, node=node, guide_word=guide_word, parameter=parameter)
+        expand_ms.append((time.perf_counter() - start) * 1000)
+
+    if not csv_tokens:
+        print(f"no parsed_rows.xlsx under {pattern}")
+        return
+
+    csv_mean, compact_mean = statistics.mean(csv_tokens), statistics.mean(compact_tokens)
+    print("PROJECTED from re-encoded results (estimated tokens, not measured calls)")
+    print(f"deviations: {len(csv_tokens)}")
+    print(f"est. completion tokens / deviation   csv {csv_mean:8.0f}   compact {compact_mean:8.0f}   "
+          f"-{100 * (1 - compact_mean / csv_mean):.1f}%")
+    print(f"projected decode s / deviation       csv {csv_mean * seconds_per_token:8.1f}   "
+          f"compact {compact_mean * seconds_per_token:8.1f}")
+    print(f"local expansion ms / deviation       p50 {statistics.median(expand_ms):.3f}   max {max(expand_ms):.3f}")
+
+# ------------- MEASURED (live or recorded calls) -------------
+def live(pid_path: str, n: int, record_path: str) -> list:
+    from module.agent_module import get_hazop_fewshot_prompt, list_all_connections
+    from module.graph_module import unwrap_pid_data
+    from module.llm_module import call_chat_completion
+
+    with open(pid_path, encoding="utf-8") as f:
+        infos = list_all_connections(unwrap_pid_data(json.load(f)))
+    prompts = {fmt: get_hazop_fewshot_prompt(output_format=fmt) for fmt in FORMATS}
+    calls = []
+    with open(record_path, "a", encoding="utf-8") as out:
+        for info in infos[:n]:
+            inputs = {
+                "line_id": info["line_id"], "node": info["node"],
+                "valves": ", ".join(info["valves"]), "instruments": ", ".join(info["instruments"]),
+                "context": info["context"], "neighborhood": info["neighborhood"],
+                "process_description": info["process_description"],
+                "parameter": "Flow", "guide_word": "No",
+            }
+            for fmt in FORMATS:
+                result = call_chat_completion(prompts[fmt].format(**inputs), context=f"bench-{fmt}")
+                start = time.perf_counter()
+                if fmt == "compact":
+                    rows = expand_compact_rows(result["text"], node=info["node"], guide_word="No", parameter="Flow")
+                else:
+                    rows = [r for r in result["text"].splitlines() if r.strip()]
+                call = {
+                    "format": fmt, "line_id": info["line_id"], "model": result["model"],
+                    "prompt_tokens": result["prompt_tokens"], "completion_tokens": result["completion_tokens"],
+                    "latency_s": result["latency_s"], "rows": len(rows),
+                    "expand_ms": (time.perf_counter() - start) * 1000,
+                }
+                out.write(json.dumps(call) + "\n")
+                out.flush()
+                calls.append(call)
+    return calls
+
+def report_measured(calls: list, source: str) -> None:
+    by_format = {fmt: [c for c in calls if c["format"] == fmt] for fmt in FORMATS}
+    if not all(by_format.values()):
+        print(f"need calls in both formats, got {[(f, len(c)) for f, c in by_format.items()]}")
+        return
+    print(f"MEASURED ({source})")
+    means = {}
+    for fmt, rows in by_format.items():
+        means[fmt] = {k: statistics.mean(c[k] for c in rows) for k in ("prompt_tokens", "completion_tokens", "latency_s", "rows")}
+        m = means[fmt]
+        print(f"{fmt:<8} calls {len(rows):3d}   prompt {m['prompt_tokens']:7.0f}   completion {m['completion_tokens']:7.0f}   "
+              f"latency {m['latency_s']:6.1f}s   rows {m['rows']:5.1f}")
+    for key in ("completion_tokens", "latency_s"):
+        print(f"compact vs csv {key:<18} {100 * (means['compact'][key] / means['csv'][key] - 1):+.1f}%")
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pattern", default="static/hazop/*/parsed_rows.xlsx")
+    ap.add_argument("--live", type=int, default=0, metavar="N", help="measure N deviations per format against the API")
+    ap.add_argument("--pid", default="static/data/c4-009.json")
+    ap.add_argument("--record", default="compact_calls.jsonl")
+    ap.add_argument("--recorded", help="report a JSONL file written by --live")
+    args = ap.parse_args()
+
+    if args.recorded:
+        with open(args.recorded, encoding="utf-8") as f:
+            report_measured([json.loads(line) for line in f if line.strip()], f"recorded: {args.recorded}")
+    elif args.live:
+        report_measured(live(args.pid, args.live, args.record), f"live, recorded to {args.record}")
+    else:
+        projected(args.pattern)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Per-call overhead of the deviation engines, network excluded.
+
+Both paths talk to the same in-process httpx mock transport that returns a
+canned 50-row completion, so the difference is pure client-side cost:
+prompt render, LangChain chain/callback machinery vs. the direct SDK call.
+
+Run from backend/:
+    python -m benchmarks.bench_deviation_engine --calls 200
+"""
+import argparse, json, os, statistics, subprocess, sys, time
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from openai import OpenAI
+
+from module.agent_module import get_hazop_fewshot_prompt, list_all_connections
+from module.fewshot_module import RelevantHazopExampleSelector, build_example_index
+from module.llm_module import DEFAULT_CHAT_MODEL, call_chat_completion
+
+SAMPLE_ROWS = open("static/file/sample_50_row_hazop_example.txt", encoding="utf-8").read()
+
+def _completion_handler(request: httpx.Request) -> httpx.Response:
+    body = {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": DEFAULT_CHAT_MODEL,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": SAMPLE_ROWS},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 3000, "completion_tokens": 4300, "total_tokens": 7300},
+    }
+    return httpx.Response(200, json=body)
+
+def _mock_http() -> httpx.Client:
+    return httpx.Client(transport=httpx.MockTransport(_completion_handler))
+
+def _inputs(pid_file: str) -> dict:
+    pid = json.load(open(pid_file, encoding="utf-8"))
+    info = list_all_connections(pid)[0]
+    return {
+        "line_id": info["line_id"],
+        "node": info["node"],
+        "valves": ", ".join(info["valves"]),
+        "instruments": ", ".join(info["instruments"]),
+        "context": info["context"],
+        "neighborhood": info["neighborhood"],
+        "process_description": info["process_description"],
+        "parameter": "Flow",
+        "guide_word": "No",
+    }
+
+def bench_sdk(prompt, input_data: dict, calls: int) -> list[float]:
+    client = OpenAI(api_key="sk-bench", http_client=_mock_http(), max_retries=0)
+    times = []
+    for _ in range(calls):
+        t = time.perf_counter()
+        call_chat_completion(prompt.format(**input_data), client=client, context="bench")
+        times.append(time.perf_counter() - t)
+    return times
+
+def bench_langchain(prompt, input_data: dict, calls: int) -> list[float]:
+    from langchain.chains import LLMChain
+    from langchain.callbacks import get_openai_callback
+    from langchain_community.chat_models import ChatOpenAI
+
+    sdk = OpenAI(api_key="sk-bench", http_client=_mock_http(), max_retries=0)
+    llm = ChatOpenAI(model=DEFAULT_CHAT_MODEL, temperature=1, api_key="sk-bench", client=sdk.chat.completions)
+    chain = LLMChain(llm=llm, prompt=prompt)
+    times = []
+    for _ in range(calls):
+        t = time.perf_counter()
+        with get_openai_callback():
+            chain.run(**input_data)
+        times.append(time.perf_counter() - t)
+    return times
+
+def import_time(module: str) -> float:
+    cmd = [sys.executable, "-c", f"import time; t=time.perf_counter(); import {module}; print(time.perf_counter()-t)"]
+    return float(subprocess.check_output(cmd, text=True).strip())
+
+def _report(name: str, times: list[float]) -> None:
+    times_ms = sorted(t * 1000 for t in times)
+    print(
+        f"{name:<10} n={len(times_ms):<5} mean={statistics.mean(times_ms):7.3f}ms "
+        f"p50={times_ms[len(times_ms) // 2]:7.3f}ms p95={times_ms[int(len(times_ms) * 0.95) - 1]:7.3f}ms"
+    )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--pid", default="static/data/c4-009.json")
+    args = parser.parse_args()
+
+    prompt = get_hazop_fewshot_prompt(RelevantHazopExampleSelector(build_example_index()))
+    input_data = _inputs(args.pid)
+
+    # warm-up both paths once (client construction, lazy imports)
+    bench_sdk(prompt, input_data, 3)
+    bench_langchain(prompt, input_data, 3)
+
+    _report("sdk", bench_sdk(prompt, input_data, args.calls))
+    _report("langchain", bench_langchain(prompt, input_data, args.calls))
+    print(f"import openai           {import_time('openai') * 1000:8.1f}ms")
+    print(f"import langchain.chains {import_time('langchain.chains') * 1000:8.1f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Serial-run latency with and without HedgePolicy on a simulated deviation call.
+
+Latencies are drawn from a log-normal body plus a slow tail (default 8% of
+calls take 2-3x the median), scaled down so a run takes seconds; no API calls
+are made. Both modes replay the same primary latencies; a hedge duplicate
+draws its own.
+
+Run from backend/:
+    python -m benchmarks.bench_hedging --calls 200 --scale 0.05 --tail-mult 2 3
+"""
+import argparse, os, random, statistics, sys, time
+from types import SimpleNamespace
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from module.llm_module import HedgePolicy
+
+def _latency(rng: random.Random, median_s: float, tail_p: float, tail_mult) -> float:
+    base = rng.lognormvariate(0, 0.15) * median_s
+    return base * rng.uniform(*tail_mult) if rng.random() < tail_p else base
+
+def _fake_call(first_s: float, rng: random.Random, median_s: float, tail_p: float, tail_mult):
+    attempts = []
+    def call():
+        attempts.append(1)
+        time.sleep(first_s if len(attempts) == 1 else _latency(rng, median_s, tail_p, tail_mult))
+        return SimpleNamespace(usage=SimpleNamespace(total_tokens=4000))
+    return call
+
+def _run(calls: int, median_s: float, tail_p: float, tail_mult, hedge: HedgePolicy | None, seed: int):
+    rng = random.Random(seed)
+    hedge_rng = random.Random(seed + 1)
+    primaries = [_latency(rng, median_s, tail_p, tail_mult) for _ in range(calls)]
+    lat = []
+    start = time.perf_counter()
+    for first_s in primaries:
+        call = _fake_call(first_s, hedge_rng, median_s, tail_p, tail_mult)
+        t = time.perf_counter()
+        hedge.run(call, "bench") if hedge else call()
+        lat.append(time.perf_counter() - t)
+    total = time.perf_counter() - start
+    lat.sort()
+    return total, statistics.median(lat), lat[int(0.95 * len(lat))], lat[-1]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=200)
+    ap.add_argument("--scale", type=float, default=0.05, help="median call latency in seconds")
+    ap.add_argument("--tail", type=float, default=0.08)
+    ap.add_argument("--tail-mult", type=float, nargs=2, default=[2.0, 3.0])
+    ap.add_argument("--budget", type=float, default=0.1)
+    args = ap.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)
+
+    print(f"{'mode':>8} {'total s':>8} {'p50 s':>7} {'p95 s':>7} {'max s':>7}")
+    total, p50, p95, mx = _run(args.calls, args.scale, args.tail, args.tail_mult, None, seed=1)
+    print(f"{'off':>8} {total:8.2f} {p50:7.3f} {p95:7.3f} {mx:7.3f}")
+
+    policy = HedgePolicy(min_delay_s=0.0, max_hedge_ratio=args.budget)
+    total, p50, p95, mx = _run(args.calls, args.scale, args.tail, args.tail_mult, policy, seed=1)
+    time.sleep(args.tail_mult[1] * 2 * args.scale)  # let abandoned calls settle into the stats
+    print(f"{'hedged':>8} {total:8.2f} {p50:7.3f} {p95:7.3f} {mx:7.3f}")
+    print(policy.stats())
+    policy.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Upload size and estimated vision tokens of a drawing before/after the
+preprocessing stage, for a few settings. No API calls are made.
+
+Run from backend/:
+    python -m benchmarks.bench_preprocess --file static/image/h2o2.pdf
+"""
+import argparse, os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from module.preprocess_module import preprocess_sources
+
+# each setting is applied over DEFAULT_PREPROCESS, so every key that differs is spelled out
+SETTINGS = {
+    "default": {},
+    "raster 200dpi rgb": {"dpi": 200, "grayscale": False, "threshold": 0, "crop": False},
+    "raster 150dpi gray": {"dpi": 150, "threshold": 0, "crop": False},
+    "150dpi gray crop": {"dpi": 150, "threshold": 0},
+    "150dpi threshold crop": {"dpi": 150, "threshold": 200},
+    "100dpi threshold crop": {"dpi": 100, "threshold": 200},
+    "150dpi gray crop jpeg": {"dpi": 150, "threshold": 0, "format": "jpeg"},
+    "150dpi threshold 1024px": {"dpi": 150, "threshold": 200, "max_side": 1024},
+}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--file", default="static/image/h2o2.pdf")
+    args = ap.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)
+
+    print(f"{'setting':>24} {'bytes before':>13} {'bytes after':>12} {'est tok before':>15} {'est tok after':>14} {'seconds':>8}  steps")
+    for label, opts in SETTINGS.items():
+        _, rep = preprocess_sources([args.file], opts)
+        print(
+            f"{label:>24} {rep['bytes_before']:>13} {rep['bytes_after']:>12} "
+            f"{rep['est_image_tokens_before']:>15} {rep['est_image_tokens_after']:>14} {rep['latency_s']:>8.2f}  {', '.join(rep['files'][0]['steps'])}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Local risk-matrix derivation over a whole study.
+
+Replicates the logged worksheets in static/hazop/*/parsed_rows.xlsx up to
+--rows and times derive_risk_columns (flag and correct) on the full table.
+
+Run from backend/:
+    python -m benchmarks.bench_risk_matrix --rows 10000
+"""
+import argparse, glob, os, statistics, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from module.risk_module import derive_risk_columns
+from module.schema_json import HAZOP_HEADERS
+
+def _load(pattern: str) -> pd.DataFrame:
+    frames = []
+    for path in sorted(glob.glob(pattern)):
+        df = pd.read_excel(path).iloc[:, :len(HAZOP_HEADERS)]
+        df.columns = HAZOP_HEADERS
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=HAZOP_HEADERS)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pattern", default="static/hazop/*/parsed_rows.xlsx")
+    ap.add_argument("--rows", type=int, default=10000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    base = _load(args.pattern)
+    if base.empty:
+        print(f"no parsed_rows.xlsx under {args.pattern}")
+        return
+    df = pd.concat([base] * (args.rows // len(base) + 1), ignore_index=True).iloc[:args.rows]
+
+    for correct in (False, True):
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            _, report, _ = derive_risk_columns(df, correct=correct)
+            times.append((time.perf_counter() - start) * 1000)
+        print(f"{'correct' if correct else 'flag':8s} {len(df)} rows   p50 {statistics.median(times):7.1f} ms")
+
+    print(f"flagged rows: {report['flagged_rows']}/{report['rows']}")
+    print(f"RR mismatches: {report['rr_mismatch']}")
+    print(f"category mismatches: {report['category_mismatch']}")
+    print(f"unusable S/L: {report['invalid_sl']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Peak memory and wall time of run_hazop_agent vs. selection count, in-memory
+sink vs. streaming sink.
+
+The LLM is replaced by an in-process stub that returns a logged 50-row
+response, so only the agent's own bookkeeping (parsing, tables, file writes)
+is measured. Each run is a fresh subprocess; "peak growth" is its max RSS
+after the run minus max RSS before it (imports, indexes and pid data excluded).
+
+Run from backend/:
+    python -m benchmarks.bench_streaming_memory --counts 10 40 80 160
+"""
+import argparse, glob, json, os, resource, shutil, subprocess, sys, tempfile, time
+from itertools import islice, product
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+import module.agent_module as agent_module
+from module.graph_module import unwrap_pid_data
+from module.plan_module import HAZOP_GUIDE_WORDS, HAZOP_PARAMETERS
+
+def _canned_response() -> str:
+    for path in sorted(glob.glob("static/hazop/*/llm_response_log.csv")):
+        df = pd.read_csv(path)
+        if len(df):
+            return str(df["RawOutput"].iloc[0])
+    return open("static/file/sample_50_row_hazop_example.txt", encoding="utf-8").read()
+
+def _stub_call(text: str):
+    def call(prompt: str, **kwargs):
+        return {
+            "text": text, "model": "stub", "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(text) // 4, "total_tokens": (len(prompt) + len(text)) // 4, "latency_s": 0.0,
+        }
+    return call
+
+def _selections(pid_data: dict, n: int):
+    lines = [c["line_id"] for c in unwrap_pid_data(pid_data)["connections"]]
+    combos = product(lines, HAZOP_PARAMETERS, HAZOP_GUIDE_WORDS)
+    return [{"line_id": l, "parameter": p, "guide_word": g} for l, p, g in islice(combos, n)]
+
+def _run(pid_data: dict, n: int, streaming: bool) -> tuple[float, float]:
+    out = tempfile.mkdtemp(prefix="bench_stream_")
+    try:
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        for _ in agent_module.run_hazop_agent(
+            pid_data=pid_data,
+            excel_path=os.path.join(out, "hazop.xlsx"),
+            token_log_path=os.path.join(out, "token_log.csv"),
+            error_log_path=os.path.join(out, "error_log.csv"),
+            llm_response_log_path=os.path.join(out, "llm_response_log.csv"),
+            parsed_excel_path=os.path.join(out, "parsed_rows.xlsx"),
+            selections=_selections(pid_data, n),
+            max_repair_rounds=0,
+            streaming=streaming,
+        ):
+            pass
+        elapsed = time.perf_counter() - start
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return (after - before) / 1024, elapsed
+    finally:
+        shutil.rmtree(out, ignore_errors=True)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pid", default="static/data/c4-009.json")
+    ap.add_argument("--counts", type=int, nargs="+", default=[10, 40, 80, 160])
+    ap.add_argument("--one", nargs=2, metavar=("N", "MODE"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.one:
+        import logging
+        logging.disable(logging.INFO)
+        agent_module.call_chat_completion = _stub_call(_canned_response())
+        pid_data = json.load(open(args.pid, encoding="utf-8"))
+        # warm the example index / prompt caches outside the measured window
+        _run(pid_data, 1, True)
+        peak, elapsed = _run(pid_data, int(args.one[0]), args.one[1] == "streaming")
+        print(json.dumps({"peak_mib": peak, "seconds": elapsed}))
+        return
+
+    print(f"{'selections':>10} {'mode':>10} {'peak growth MiB':>16} {'seconds':>8}")
+    for n in args.counts:
+        for mode in ("in-memory", "streaming"):
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_streaming_memory", "--pid", args.pid, "--one", str(n), mode],
+                capture_output=True, text=True, check=True,
+            ).stdout.strip().splitlines()[-1]
+            res = json.loads(out)
+            print(f"{n:>10} {mode:>10} {res['peak_mib']:16.1f} {res['seconds']:8.1f}", flush=True)
+
+if __name__ == "__main__":
+    main()
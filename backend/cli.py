@@ -0,0 +1,281 @@
+"""
+Headless batch runner: P&ID extraction + HAZOP over a folder, no Flask server.
+
+Run from backend/:
+    python cli.py ../drawings --output-folder batch-2026-10 --concurrency 3
+
+Inputs per drawing (matched by file stem):
+    <stem>.pdf|.png|.jpg|.jpeg   drawing, extracted with extract_pid
+    <stem>.json                  already extracted P&ID (file or bare shape), no extraction
+    <stem>.txt                   optional process description for extraction
+    <stem>.selections.json       optional selection preset, else --selections, else DEFAULT_PRESET
+
+A preset is either a list of {"line_id", "parameter", "guide_word"} or
+{"parameters": [...], "guide_words": [...], "lines": [...]} expanded over the
+drawing's lines (all lines when "lines" is missing).
+
+Re-running the same command resumes: drawings with a completed run are
+skipped, extracted JSON in static/data is reused, and an interrupted run's
+finished deviations are carried over instead of being sent again.
+"""
+import argparse, json, os, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, TypedDict
+
+import pandas as pd
+
+from decorators import logger
+from utils import pid_json_path, save_pid_json
+from module.ext_module import extract_pid, extract_pid_tiled
+from module.agent_module import list_all_connections, list_all_study_nodes, plan_hazop_run, run_hazop_agent
+from module.graph_module import unwrap_pid_data
+from module.llm_module import HedgePolicy
+from module.preprocess_module import DEFAULT_PREPROCESS
+from module.tile_module import parse_grid
+from module.routing_module import ModelRouter
+from module.runs_module import finish_run, list_runs, merge_runs, run_paths, start_run, supersede_resumed
+from module.sink_module import atomic_replace
+from module.trace_module import TRACE_FILE, Tracer, span
+
+BACKEND_DIR = Path(__file__).resolve().parent
+DRAWING_SUFFIXES = (".pdf", ".png", ".jpg", ".jpeg")
+DATA_DIR = Path("static") / "data"
+SUMMARY_FILE = "batch_summary.csv"
+
+DEFAULT_PRESET = {
+    "parameters": ["Flow", "Pressure", "Temperature", "Level"],
+    "guide_words": ["No", "More", "Less"],
+}
+
+class DrawingReport(TypedDict):
+    drawing: str
+    status: str              # complete | skipped | failed
+    run_id: str | None
+    extract_s: float
+    extract_tokens: int
+    deviations: int
+    carried_over: int
+    hazop_tokens: int
+    hazop_s: float
+    rows: int
+    error: str
+
+# ------------- INPUTS ----------------------------------------
+def discover_drawings(input_dir: Path) -> Dict[str, Path]:
+    """stem -> drawing, or its already extracted P&ID JSON when both are present."""
+    found: Dict[str, Path] = {}
+    for path in sorted(input_dir.iterdir()):
+        name = path.name.lower()
+        if name.endswith(".selections.json") or not path.is_file():
+            continue
+        if name.endswith(".json"):
+            found[path.stem] = path
+        elif name.endswith(DRAWING_SUFFIXES):
+            found.setdefault(path.stem, path)
+    return found
+
+def expand_preset(preset, pid_data: dict, *, group_study_nodes: bool = False) -> List[Dict[str, str]]:
+    if isinstance(preset, list):
+        return preset
+    infos = (list_all_study_nodes if group_study_nodes else list_all_connections)(pid_data)
+    lines = preset.get("lines") or [i["line_id"] for i in infos]
+    return [
+        {"line_id": line_id, "parameter": p, "guide_word": g}
+        for line_id in lines
+        for p in preset.get("parameters", [])
+        for g in preset.get("guide_words", [])
+    ]
+
+def load_preset(drawing: Path, default_path: Path | None):
+    for candidate in (drawing.with_name(f"{drawing.stem}.selections.json"), default_path):
+        if candidate and candidate.exists():
+            return json.loads(candidate.read_text(encoding="utf-8"))
+    return DEFAULT_PRESET
+
+# ------------- ONE DRAWING -----------------------------------
+def _extract(drawing: Path, args) -> tuple[dict, float, int]:
+    """P&ID for a drawing, reusing the static/data JSON saved by an earlier pass."""
+    if drawing.suffix.lower() == ".json":
+        return json.loads(drawing.read_text(encoding="utf-8")), 0.0, 0
+
+    # same (slugified) path save_pid_json writes below
+    json_path = pid_json_path(drawing, str(DATA_DIR), name=drawing.stem)
+    if json_path.exists() and not args.re_extract:
+        logger.info(f"[Batch] {drawing.stem}: reusing {json_path}")
+        return json.loads(json_path.read_text(encoding="utf-8")), 0.0, 0
+
+    description_path = drawing.with_suffix(".txt")
+    description = description_path.read_text(encoding="utf-8") if description_path.exists() else ""
+    preprocess = DEFAULT_PREPROCESS if args.preprocess else None
+    start = time.perf_counter()
+    if args.grid:
+        pid, meta = extract_pid_tiled([drawing], process_description=description, grid=args.grid, preprocess=preprocess)
+    else:
+        pid, meta = extract_pid(drawing, process_description=description, preprocess=preprocess)
+    elapsed = time.perf_counter() - start
+    saved = save_pid_json(pid_data=pid, metadata=meta, image_path=drawing, out_dir=str(DATA_DIR), name=drawing.stem)
+    return json.loads(saved.read_text(encoding="utf-8")), elapsed, int((meta.get("tokens") or {}).get("total") or 0)
+
+def _resume_source(base_dir: str) -> List[dict]:
+    """
+    Unfinished runs of this drawing, the one with the most logged responses
+    first. A run already resumed by a later one is left out: its rows live on
+    in that run.
+    """
+    def responses(run) -> int:
+        path = run_paths(run)["llm_response_log_path"]
+        return len(pd.read_csv(path)) if os.path.exists(path) and os.path.getsize(path) else 0
+    runs = list_runs(base_dir)
+    resumed = {r.get("resumed_from") for r in runs}
+    unfinished = [r for r in runs if r["status"] in ("running", "failed") and r["run_id"] not in resumed]
+    return sorted(unfinished, key=responses, reverse=True)
+
+def run_drawing(stem: str, drawing: Path, args) -> DrawingReport:
+    report: DrawingReport = {
+        "drawing": stem, "status": "failed", "run_id": None, "extract_s": 0.0, "extract_tokens": 0,
+        "deviations": 0, "carried_over": 0, "hazop_tokens": 0, "hazop_s": 0.0, "rows": 0, "error": "",
+    }
+    base_dir = os.path.join("static", "hazop", args.output_folder, stem)
+    file_name = f"hazop-{stem}.xlsx"
+    if any(r["status"] == "complete" for r in list_runs(base_dir)):
+        report["status"] = "skipped"
+        return report
+
+    try:
+        pid_file, report["extract_s"], report["extract_tokens"] = _extract(drawing, args)
+        pid_data = unwrap_pid_data(pid_file)
+        selections = expand_preset(load_preset(drawing, args.selections), pid_data, group_study_nodes=args.group_study_nodes)
+        plan = plan_hazop_run(pid_data, selections, group_study_nodes=args.group_study_nodes)
+        report["deviations"] = len(plan["items"])
+    except Exception as e:
+        logger.exception(f"[Batch] {stem}: preparation failed")
+        report["error"] = str(e)
+        return report
+
+    # interrupted earlier: its finished deviations are carried over (same P&ID, no LLM call)
+    previous = _resume_source(base_dir)
+    run = start_run(base_dir, file_name, resumed_from=previous[0]["run_id"] if previous else None)
+    report["run_id"] = run["run_id"]
+    tracer = Tracer(os.path.join(run["dir"], TRACE_FILE), run_id=run["run_id"], drawing=stem)
+    hedge = HedgePolicy() if args.hedge else None
+    start = time.perf_counter()
+    done = 0
+    try:
+        with tracer.activate(), span("hazop_run", file_name=file_name):
+            for key, tokens_used in run_hazop_agent(
+                pid_data=pid_data,
+                **run_paths(run),
+                selections=selections,
+                group_study_nodes=args.group_study_nodes,
+                previous_pid_data=pid_data if previous else None,
+                previous_output_folder=previous[0]["dir"] if previous else None,
+                plan=plan,
+                engine=args.engine,
+                output_mode=args.output_mode,
+                streaming=args.streaming,
+                hedge=hedge,
+                router=ModelRouter() if args.routing else None,
+                process_others=args.process_others,
+            ):
+                done += 1
+                report["hazop_tokens"] += tokens_used
+                report["carried_over"] += tokens_used == 0
+                if done % args.log_every == 0:
+                    logger.info(f"[Batch] {stem}: {done}/{report['deviations']} deviations, {report['hazop_tokens']} tokens")
+        finish_run(run, "complete")
+        report["status"] = "complete"
+    except Exception as e:
+        logger.exception(f"[Batch] {stem}: HAZOP failed")
+        finish_run(run, "failed")
+        report["error"] = str(e)
+    finally:
+        report["hazop_s"] = round(time.perf_counter() - start, 2)
+        tracer.close()
+        if hedge:
+            hedge.close()
+
+    # the carried-over rows now live in this completed run: supersede the whole
+    # resume chain so merge_runs never counts them twice. Unrelated unfinished
+    # runs keep theirs. Until then merge_runs skips runs resumed by a failed one.
+    if report["status"] == "complete":
+        supersede_resumed(base_dir, run)
+    merged = merge_runs(base_dir)
+    report["rows"] = merged["rows"].get(file_name, 0)
+    return report
+
+# ------------- SUMMARY ---------------------------------------
+def write_summary(path: str, reports: List[DrawingReport]) -> None:
+    with atomic_replace(path) as tmp:
+        pd.DataFrame(reports).to_csv(tmp, index=False)
+
+def format_summary(reports: List[DrawingReport]) -> str:
+    df = pd.DataFrame(reports)
+    total = df[["extract_s", "extract_tokens", "deviations", "carried_over", "hazop_tokens", "hazop_s", "rows"]].sum()
+    df = df.drop(columns=["error"])
+    return (
+        df.to_string(index=False)
+        + f"\n\n{len(df)} drawing(s): "
+        + ", ".join(f"{n} {s}" for s, n in df["status"].value_counts().items())
+        + f" | {int(total['extract_tokens'] + total['hazop_tokens'])} tokens"
+        + f" | extract {total['extract_s']:.0f}s, hazop {total['hazop_s']:.0f}s (summed over drawings)"
+    )
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Batch P&ID extraction + HAZOP over a folder (resumable)")
+    ap.add_argument("input_dir", type=Path)
+    ap.add_argument("--output-folder", default="batch", help="static/hazop/<output-folder>/<drawing>/")
+    ap.add_argument("--selections", type=Path, help="default selection preset (JSON)")
+    ap.add_argument("--concurrency", type=int, default=2, help="drawings processed in parallel")
+    ap.add_argument("--group-study-nodes", action="store_true")
+    ap.add_argument("--engine", default="sdk", choices=["sdk", "langchain"])
+    ap.add_argument("--output-mode", default="csv", choices=["csv", "structured", "compact"])
+    ap.add_argument("--streaming", action="store_true", help="constant-memory sink for large drawings")
+    ap.add_argument("--hedge", action="store_true")
+    ap.add_argument("--routing", action="store_true")
+    ap.add_argument("--process-others", action="store_true")
+    ap.add_argument("--grid", type=parse_grid, help="tiled extraction, e.g. 2x2")
+    ap.add_argument("--preprocess", action="store_true")
+    ap.add_argument("--re-extract", action="store_true", help="ignore P&ID JSON from an earlier pass")
+    ap.add_argument("--log-every", type=int, default=10)
+    args = ap.parse_args(argv)
+
+    # paths in the modules are relative to backend/, like the Flask app
+    input_dir = args.input_dir.resolve()
+    args.selections = args.selections.resolve() if args.selections else None
+    os.chdir(BACKEND_DIR)
+    drawings = discover_drawings(input_dir)
+    if not drawings:
+        logger.error(f"[Batch] no drawings in {input_dir}")
+        return 1
+
+    out_root = os.path.join("static", "hazop", args.output_folder)
+    os.makedirs(out_root, exist_ok=True)
+    summary_path = os.path.join(out_root, SUMMARY_FILE)
+    logger.info(f"[Batch] {len(drawings)} drawing(s) from {input_dir}, concurrency {args.concurrency}")
+
+    # drawings finished by an earlier invocation keep their numbers in the summary
+    earlier: Dict[str, dict] = {}
+    if os.path.exists(summary_path):
+        earlier = {r["drawing"]: r for r in pd.read_csv(summary_path, dtype={"drawing": str}).fillna("").to_dict("records")}
+
+    reports: List[DrawingReport] = []
+    lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency), thread_name_prefix="batch") as pool:
+        futures = {pool.submit(run_drawing, stem, path, args): stem for stem, path in drawings.items()}
+        for future in as_completed(futures):
+            report = future.result()
+            if report["status"] == "skipped" and report["drawing"] in earlier:
+                report = {**earlier[report["drawing"]], "status": "skipped"}
+            logger.info(f"[Batch] {report['drawing']}: {report['status']} ({report['hazop_tokens']} tokens, {report['hazop_s']}s)")
+            with lock:
+                reports.append(report)
+                write_summary(summary_path, sorted(reports, key=lambda r: r["drawing"]))
+
+    reports.sort(key=lambda r: r["drawing"])
+    print(format_summary(reports))
+    print(f"\nSummary: {summary_path}")
+    return 0 if all(r["status"] != "failed" for r in reports) else 2
+
+if __name__ == "__main__":
+    sys.exit(main())
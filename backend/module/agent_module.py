@@ -1,20 +1,39 @@
-import os
+import os, time
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import Generator, Tuple, List, Dict
+from typing import Callable, Generator, Tuple, List, Dict
 import pandas as pd
 
 from langchain.prompts import FewShotPromptTemplate, PromptTemplate
-from typing import Generator, Tuple
-from langchain.chains import LLMChain
-from langchain.callbacks import get_openai_callback
+from langchain_core.example_selectors import BaseExampleSelector
 
 from decorators import logger, timeit_log
-from module.llm_module import get_chat_model
+from module.llm_module import (
+    get_chat_model, call_chat_completion, call_structured_completion, ChatCallResult, DEFAULT_CHAT_MODEL,
+    HedgePolicy, InvalidOutputError,
+)
+from module.schema_json import HAZOP_HEADERS, HazopRowsResponse
+from module.fewshot_module import RelevantHazopExampleSelector, build_example_index, estimate_tokens
+from module.graph_module import PIDGraph, build_pid_graph, partition_study_nodes, unwrap_pid_data
+from module.diff_module import plan_carry_over
+from module.compact_module import COMPACT_OUTPUT_RULES, COMPACT_RISK_RULES, expand_compact_rows, is_compact_output
+from module.risk_module import derive_risk_columns
+from module.sink_module import DataFrameRunSink, StreamingRunSink
+from module.repair_module import build_repair_prompt, format_rows_output, match_causes, merge_repaired_rows
+from module.routing_module import ModelRouter, summarize_model_usage
+from module.trace_module import span, traced_submit
+from module.retrieval_module import ProcessRetriever
+from module.plan_module import (
+    HazopPlan, HAZOP_GUIDE_WORDS, HAZOP_PARAMETERS, format_cause_checklist, index_query_infos, plan_selections,
+)
 import sys
 sys.stdout.reconfigure(encoding="utf-8")
 
 @timeit_log
-def get_hazop_fewshot_prompt():
+def get_hazop_fewshot_prompt(
+    example_selector: BaseExampleSelector | None = None,
+    output_format: str = "csv",
+):
     example_1 = {
         "reasoning": "The line from R-101 to S-101 handles hot vapors. If scrubber is blocked, pressure may rise.",
         "table": "R-101 → S-101,More,Pressure,High Pressure,Blocked scrubber,Overpressure → rupture,High,5,4,20,Critical,PSV + Scrubber Design,Medium,3,2,6,Medium,Install redundant vent line,2,1,2,Engineering"
@@ -85,6 +104,24 @@ def get_hazop_fewshot_prompt():
         input_variables=["reasoning", "table"],
         template="Reasoning:\n{reasoning}\n\nCSV Row:\n{table}"
     )
+    csv_output_rules = """            2. Output format:
+            • Return ONLY valid CSV rows, with **22 comma-separated fields** in this exact order:
+                ```
+                Node, Guide Word, Parameter, Deviation, Cause, Consequence, Unmitigated Risk Category,
+                S Before Safeguards, L Before Safeguards, RR Before Safeguards, Overall Risk,
+                Safeguards, Mitigated Risk Category, S, L, RR, Overall Risk,
+                Recommendations, S After Recommendation, L After Recommendation, RR After Recommendation, Responsibility
+                ```
+            • No Markdown, no code block fences, no headers, no comments.
+"""
+    structured_output_rules = """            2. Output format:
+            • Return one object per Cause in the `rows` array of the response schema.
+            • Fields map 1:1 to the Open-PHA columns (Node, Guide Word, Parameter, Deviation, Cause, Consequence,
+              Unmitigated Risk Category, S/L/RR Before Safeguards, Overall Risk, Safeguards, Mitigated Risk Category,
+              S, L, RR, Overall Risk, Recommendations, S/L/RR After Recommendation, Responsibility).
+            • Multiple consequences, safeguards or recommendations go in one field separated by "; ".
+            • The example rows below are CSV for content only — do not return CSV.
+"""
     role_and_rules_2 = """
             You are a deterministic, regulation-compliant **Process Safety Engineer AI** that strictly follows IEC 61882 and Open-PHA CSV export standards.
 
@@ -144,56 +181,7 @@ def get_hazop_fewshot_prompt():
 
             ───────────────────────────────────────────────────────
             MANDATORY ENGINEERING CAUSE CHECKLIST (MUST appear once each)
-            1.Pressure instrument failure (gauge; transmitter; sensor)
-            2.Temperature instrument failure (thermometer; transmitter; sensor)
-            3.Level instrument failure (indicator; transmitter; sensor)
-            4.Flow instrument failure (meter; sensor; transmitter)
-            5.Incorrect instrument calibration or setpoint
-            6.Control valve malfunction (stuck; leakage; actuator failure)
-            7.Incorrect valve selection or specification
-            8.Proportional/regulating valve malfunction
-            9.Pneumatic valve failure or loss of actuator signal
-            10.Vent valve malfunction (fails closed/open during transfer or discharge)
-            11.Pipeline leakage (joint failure; crack; corrosion; gasket)
-            12.Pipeline blockage or obstruction (fouling; deposits; freezing; solids)
-            13.Incorrect installation or poor layout of piping/equipment
-            14.Vessel leakage or rupture (design or fatigue failure)
-            15.Pump mechanical failure (seal; impeller; shaft; cavitation)
-            16.Compressor or fan mechanical failure (motor; bearing; impeller)
-            17.Vacuum pump failure (cannot achieve required vacuum)
-            18.Refrigerant/utility line rupture or internal leak
-            19.Cylinder rupture or containment breach
-            20.Drain hole blockage or inadequate drainage
-            21.Equipment overheating (heater runaway; thermal stress)
-            22.Abnormal wear/erosion leading to loss of containment
-            23.Abnormal utility supply pressure (too high or too low)
-            24.Abnormal cryogenic source (LN2 evaporation; boil-off; loss of supply)
-            25.Abnormal water supply (insufficient cooling or cleaning water)
-            26.Abnormal gas supply (N₂; compressed air; other utility failure)
-            27.Power failure (loss of electricity to motors; fans; instruments)
-            28.Cooling system failure (no circulation; fouling; exchanger blocked)
-            29.Heating system failure (heater not starting or insufficient duty)
-            30.Heating system uncontrolled (heater operating without cutoff)
-            31.Utility connection leakage (joints; hoses; couplings)
-            32.Pressure regulator malfunction (failure of PRV or regulator valve)
-            33.Upstream overpressure (abnormal feed source pressure)
-            34.Downstream restriction (blockage; closed valve; isolation)
-            35.Reverse flow due to pressure imbalance or check valve failure
-            36.Reaction runaway / abnormal process temperature rise
-            37.Abnormal mixing ratio (incorrect blending; poor agitation)
-            38.Incorrect feed ratio or dosage deviation
-            39.Abnormal circulation imbalance (inlet > outlet; unequal flows)
-            40.Vessel operating empty or insufficient level (dry running)
-            41.Vessel operating overfilled (high level)
-            42.Internal decomposition of process medium (gas release; thermal breakdown)
-            43.Ambient high temperature (external fire; hot weather)
-            44.Ambient low temperature (cold weather; freezing)
-            45.External mechanical impact or vibration
-            46.Abnormal source contamination (impurities; off-spec feed)
-            47.Human error in operation (wrong valve; wrong sequence)
-            48.Incorrect operating sequence (early or late action)
-            49.Insufficient operating time (too short cycle; premature termination)
-            50.Excessive operating time (too long cycle, delayed termination) 
+            <<CAUSE_CHECKLIST>>
 
             ───────────────────────────────────────────────────────
             DO NOT continue if data is not between tags:
@@ -204,6 +192,7 @@ def get_hazop_fewshot_prompt():
             Valves: {valves}
             Instruments: {instruments}
             Context: {context}
+            Neighborhood: {neighborhood}
             Process Description: {process_description}
             Guide Word: {guide_word}
             Parameter: {parameter}
@@ -227,6 +216,7 @@ def get_hazop_fewshot_prompt():
         Valves: {valves}
         Instruments: {instruments}
         Context: {context}
+        Neighborhood: {neighborhood}
         Process Description:
         {process_description}
         Parameter: {parameter}
@@ -236,13 +226,97 @@ def get_hazop_fewshot_prompt():
         Think step-by-step before generating the CSV.
         Return only valid CSV rows in UTF-8 format (no markdown, no commentary).
         """
+    structured_suffix = """
+        Analyze the line below using HAZOP methodology.
+
+        Line ID: {line_id}
+        Node: {node}
+        Valves: {valves}
+        Instruments: {instruments}
+        Context: {context}
+        Neighborhood: {neighborhood}
+        Process Description:
+        {process_description}
+        Parameter: {parameter}
+        Guide Word: {guide_word}
+
+        Remember: You must return exactly 50 rows. If any field is not applicable, use "N/A". Never skip a Cause. Never leave fields blank.
+        Think step-by-step before filling the rows.
+        """
+    compact_suffix = """
+        Analyze the line below using HAZOP methodology.
+
+        Line ID: {line_id}
+        Node: {node}
+        Valves: {valves}
+        Instruments: {instruments}
+        Context: {context}
+        Neighborhood: {neighborhood}
+        Process Description:
+        {process_description}
+        Parameter: {parameter}
+        Guide Word: {guide_word}
+
+        Remember: one D| line, then exactly 50 cause lines of 11 pipe-separated fields. The example rows are CSV for content only — write the compact format.
+        If any field is not applicable, use "N/A". Never skip a Cause. Never leave fields blank.
+        """
+
+    # relevance-selected rows per deviation when a selector is supplied,
+    # otherwise the full static 50-row example
+    example_source = (
+        {"example_selector": example_selector}
+        if example_selector is not None
+        else {"examples": [example_3]}
+    )
+
+    role_and_rules_2 = role_and_rules_2.replace(
+        "<<CAUSE_CHECKLIST>>", format_cause_checklist(indent=" " * 12).lstrip()
+    )
+
+    if output_format == "structured":
+        # rows come back schema-validated (HazopRowsResponse), so the CSV
+        # formatting rules are swapped for field-level ones
+        role_and_rules_2 = role_and_rules_2.replace(csv_output_rules, structured_output_rules).replace(
+            "in strict **UTF-8 comma-separated CSV** format — compatible with Open-PHA —",
+            "with Open-PHA compatible fields",
+        )
+        role_and_rules_2 = role_and_rules_2.replace(
+            "silently count CSV lines", "silently count rows"
+        ).replace(
+            "Return 50 CSV rows only. Nothing else. Begin output below:",
+            "Return 50 rows in the `rows` array only.",
+        )
+        cot_suffix = structured_suffix
+    elif output_format == "compact":
+        # pipe-separated, cause by checklist number; expanded locally by compact_module
+        role_and_rules_2 = role_and_rules_2.replace(csv_output_rules, COMPACT_OUTPUT_RULES).replace(
+            "in strict **UTF-8 comma-separated CSV** format — compatible with Open-PHA —",
+            "in a compact line format that is expanded to Open-PHA CSV",
+        )
+        role_and_rules_2 = role_and_rules_2.replace(
+            "silently count CSV lines", "silently count cause lines"
+        ).replace(
+            "Return 50 CSV rows only. Nothing else. Begin output below:",
+            "Return the D| line and 50 cause lines only. Nothing else. Begin output below:",
+        ).replace(
+            "Assign **Unmitigated** and **Mitigated Risk**:",
+            "Assign **Severity** and **Likelihood**:",
+        )
+        # RR and risk categories are derived locally (risk_module): keep the
+        # S / L scales, drop the matrix and category rules up to rule 5
+        risk_start = role_and_rules_2.index("Risk Matrix RL(S,L):")
+        risk_end = role_and_rules_2.index("\n            5. Responsibility field") + 1
+        role_and_rules_2 = role_and_rules_2[:risk_start] + COMPACT_RISK_RULES.lstrip() + role_and_rules_2[risk_end:]
+        cot_suffix = compact_suffix
+    elif output_format != "csv":
+        raise ValueError(f"Unknown output format '{output_format}' (expected 'csv', 'structured' or 'compact')")
 
     few_shot_prompt = FewShotPromptTemplate(
         prefix=role_and_rules_2.strip(),
         suffix=cot_suffix.strip(),
-        examples=[example_3],
         example_prompt=example_prompt,
-        input_variables=["line_id", "node", "valves", "instruments", "context", "process_description"]
+        input_variables=["line_id", "node", "valves", "instruments", "context", "neighborhood", "process_description"],
+        **example_source,
     )
 
     return few_shot_prompt
@@ -259,10 +333,10 @@ def get_hazop_other_prompt():
         "table": (
             "Process,Other,Process,Others,"
             "Pipeline corrosion,Pipeline rupture/leakage,"
-            "High,4,3,12,Critical,"
+            "Medium,4,3,4,Medium,"
             "Corrosion protection coating and periodic inspection,"
-            "Medium,4,2,8,Medium,"
-            "Replace gaskets and schedule regular maintenance,3,2,6,Maintenance Engineer"
+            "Medium,4,2,3,Medium,"
+            "Replace gaskets and schedule regular maintenance,3,2,3,Maintenance Engineer"
         )
     }
 
@@ -291,7 +365,7 @@ def get_hazop_other_prompt():
         2. Encode strictly in UTF-8; use a literal comma (,) as the sole delimiter.
         3. Populate **exactly 21 columns in this order**:  
         Node, Guide Word, Parameter, Deviation, Cause, Consequence, Unmitigated Risk Category, S Before Safeguards, L Before Safeguards, RR Before Safeguards, Overall Risk, Safeguards, Mitigated Risk Category, S, L, RR, Overall Risk, Recommendations, S After Recommendation, L After Recommendation, RR After Recommendation, Responsibility
-        4. Compute Risk Rank (RR) as **Severity * Likelihood**; map to Category: *Low 1-4*, *Medium 5-12*, *High 13-25*.
+        4. Read the Risk Level (RL) of each S/L pair from the Risk Matrix below and write it in every RR field (RL 1-5 only, never S*L); map to Category: *Low RL1-2*, *Medium RL3-4*, *High RL5*.
         5. **Mandatory Engineering Cause Checklist** (appear verbatim, once per Deviation, exactly this order): -- Must using all Cause Checklist***
         5.1. Pipeline corrosion  
         5.2. Power outage.  
@@ -323,8 +397,8 @@ def get_hazop_other_prompt():
         • Propose one actionable Recommendation that directly mitigates this Cause.
 
         **Step 5 - Risk Evaluation**  
-        • Assign pre-safeguard Severity (S 1-5) and Likelihood (L 1-5); compute RR and Category.  
-        • After Recommendation, reassess S and/or L; recompute RR and Category.
+        • Assign pre-safeguard Severity (S 1-5) and Likelihood (L 1-5); look up RR (RL) and Category.  
+        • After Recommendation, reassess S and/or L; look up RR (RL) and Category again.
 
         **Step 6 - CSV Assembly**  
         • Populate each of the 21 columns per Rule 3 with validated data.
@@ -337,8 +411,7 @@ def get_hazop_other_prompt():
 
         ────────────────────────────────────────────────────────
         RISK MATRIX (5 * 5)  
-        Severity (1-5) * Likelihood (1-5) → RR  
-        1-4 = Low | 5-12 = Medium | 13-25 = High  
+        Severity S: S5 fatality/off-site env loss>300M/dt>6mo; S4 permanent disability/neighbor env loss30-300M/dt1-6mo; S3 treatable injury/area env loss3-30M/dt1-4wk; S2 minor injury/unit loss0.015-3M/dt4h-1wk; S1 negligible/equip loss<0.015M/dt<4h. Likelihood L: L5 often p≥1e-1; L4 likely 1e-1>p≥1e-2; L3 unlikely 1e-2>p≥1e-3; L2 very unlikely 1e-3>p≥1e-4; L1 extremely unlikely p<1e-4. Risk Matrix RL(S,L): S5:5,5,4,3,2; S4:5,4,4,3,2; S3:4,4,3,3,2; S2:3,3,3,2,1; S1:2,2,2,1,1. Risk Category: RL1-2 Low; RL3-4 Medium; RL5 High. RR fields return RL 1-5 only.  
 
         ────────────────────────────────────────────────────────
         Take a deep breath and work on this problem step-by-step.
@@ -365,11 +438,13 @@ def get_hazop_other_prompt():
 
     return few_shot_other
 
+PROCESS_NODE = "Process"
+
 def list_all_process(pid_data: dict):
-    parsed = pid_data["choices"][0]["message"]["parsed"]
+    parsed = unwrap_pid_data(pid_data)
 
-    system_input = parsed.get("system_inputs", [])
-    system_output = parsed.get("system_outputs", [])
+    system_input = "; ".join(map(str, parsed.get("system_inputs", []))) or "N/A"
+    system_output = "; ".join(map(str, parsed.get("system_outputs", []))) or "N/A"
     process_description = parsed.get("process_description", "")
 
     query_infos = []
@@ -380,43 +455,180 @@ def list_all_process(pid_data: dict):
     })
     return query_infos
 
-def list_all_connections(pid_data: dict):
-    # --- Detect shape ---
-    if "choices" in pid_data:
-        # old style: OpenAI chat completion wrapper
-        parsed = pid_data["choices"][0]["message"]["parsed"]
-    elif "pid_data" in pid_data and isinstance(pid_data["pid_data"], dict):
-        # new style: your file wrapper with metadata
-        parsed = pid_data["pid_data"]
-    else:
-        # already the bare P&ID JSON
-        parsed = pid_data
-
-    connections = parsed.get("connections", [])
-    process_description = parsed.get("process_description", "")
+def list_all_connections(pid_data: dict, graph: PIDGraph | None = None):
+    graph = graph or build_pid_graph(pid_data)
 
     query_infos = []
-    for conn in connections:
-        line_id = conn.get("line_id")
-        from_id = conn.get("from_id")
-        to_id = conn.get("to_id")
-        node = f"{from_id} → {to_id}" if from_id and to_id else (from_id or to_id or "")
-        context = conn.get("context", "")
-        valves = conn.get("valves", [])
-        instruments = conn.get("instruments", [])
-
+    for line_id, conn in graph.lines.items():
         query_infos.append(
             {
                 "line_id": line_id,
-                "node": node,
-                "valves": valves,
-                "instruments": instruments,
-                "context": context,
-                "process_description": process_description,
+                "node": graph.node_label(line_id),
+                "valves": conn.get("valves", []),
+                "instruments": conn.get("instruments", []),
+                "context": conn.get("context", ""),
+                "neighborhood": graph.describe_neighborhood(line_id),
+                "process_description": graph.process_description,
+            }
+        )
+    return query_infos
+
+def list_all_study_nodes(pid_data: dict, graph: PIDGraph | None = None):
+    graph = graph or build_pid_graph(pid_data)
+
+    query_infos = []
+    for study_node in partition_study_nodes(graph):
+        line_ids = study_node["line_ids"]
+        query_infos.append(
+            {
+                "line_id": study_node["node_id"],
+                "line_ids": line_ids,
+                "line_label": f"{study_node['node_id']} ({', '.join(line_ids)})",
+                "node": study_node["node"],
+                "valves": study_node["valves"],
+                "instruments": study_node["instruments"],
+                "context": study_node["context"],
+                "neighborhood": " || ".join(
+                    f"{l}: {graph.describe_neighborhood(l)}" for l in line_ids
+                ),
+                "process_description": graph.process_description,
             }
         )
     return query_infos
 
+DeviationCaller = Callable[..., ChatCallResult]
+
+def build_deviation_caller(
+    prompt: FewShotPromptTemplate,
+    *,
+    engine: str = "sdk",
+    output_mode: str = "csv",
+    model_name: str = DEFAULT_CHAT_MODEL,
+    temperature: float = 1,
+    timeout_s: float = 180.0,
+    hedge: HedgePolicy | None = None,
+) -> DeviationCaller:
+    """
+    engine="sdk": render the prompt locally and call the OpenAI SDK directly
+    (explicit timeout, shared retry policy, usage from the response).
+    engine="langchain": the original LLMChain + get_openai_callback path.
+    output_mode="structured" (sdk only): rows are returned through the
+    HazopRowsResponse schema; "text" holds the validated JSON.
+    output_mode="compact": plain text in the compact_module wire format.
+    hedge (sdk only): duplicate slow calls per the HedgePolicy.
+    The returned caller takes model= to override model_name per call (routing).
+    """
+    if output_mode not in ("csv", "structured", "compact"):
+        raise ValueError(f"Unknown output mode '{output_mode}' (expected 'csv', 'structured' or 'compact')")
+    if output_mode == "structured" and engine != "sdk":
+        raise ValueError("Structured output mode requires engine='sdk'")
+
+    if engine == "langchain":
+        # deprecated chain API, imported only when this engine is requested
+        from langchain.chains import LLMChain
+        from langchain.callbacks import get_openai_callback
+
+        chains: Dict[str, LLMChain] = {}
+
+        def call_langchain(input_data: dict, context: str = "", model: str | None = None) -> ChatCallResult:
+            name = model or model_name
+            if name not in chains:
+                llm, _ = get_chat_model(name, temperature)
+                chains[name] = LLMChain(llm=llm, prompt=prompt)
+            start_t = time.perf_counter()
+            with get_openai_callback() as cb:
+                text = chains[name].run(**input_data)
+            return {
+                "text": text,
+                "model": name,
+                "prompt_tokens": cb.prompt_tokens,
+                "completion_tokens": cb.completion_tokens,
+                "total_tokens": cb.total_tokens,
+                "latency_s": round(time.perf_counter() - start_t, 4),
+            }
+        return call_langchain
+
+    if engine != "sdk":
+        raise ValueError(f"Unknown deviation engine '{engine}' (expected 'sdk' or 'langchain')")
+
+    if output_mode == "structured":
+        def call_structured(input_data: dict, context: str = "", model: str | None = None) -> ChatCallResult:
+            with span("prompt_render"):
+                text = prompt.format(**input_data)
+            return call_structured_completion(
+                text,
+                HazopRowsResponse,
+                model=model or model_name,
+                temperature=temperature,
+                timeout_s=timeout_s,
+                context=context,
+                hedge=hedge,
+            )
+        return call_structured
+
+    def call_sdk(input_data: dict, context: str = "", model: str | None = None) -> ChatCallResult:
+        with span("prompt_render"):
+            text = prompt.format(**input_data)
+        return call_chat_completion(
+            text,
+            model=model or model_name,
+            temperature=temperature,
+            timeout_s=timeout_s,
+            context=context,
+            hedge=hedge,
+        )
+    return call_sdk
+
+def build_repair_caller(
+    *,
+    output_mode: str = "csv",
+    model_name: str = DEFAULT_CHAT_MODEL,
+    temperature: float = 1,
+    timeout_s: float = 180.0,
+) -> Callable[..., ChatCallResult]:
+    """Follow-up calls for missing causes take an already rendered prompt (SDK for both engines)."""
+    def call_repair(prompt_text: str, context: str = "", model: str | None = None) -> ChatCallResult:
+        if output_mode == "structured":
+            return call_structured_completion(
+                prompt_text, HazopRowsResponse,
+                model=model or model_name, temperature=temperature, timeout_s=timeout_s, context=context,
+            )
+        return call_chat_completion(
+            prompt_text, model=model or model_name, temperature=temperature, timeout_s=timeout_s, context=context,
+        )
+    return call_repair
+
+def _plan_for_infos(
+    query_infos: List[dict],
+    selections: List[Dict[str, str]],
+    example_token_budget: int | None,
+    concurrency: int = 1,
+) -> HazopPlan:
+    prompt = get_hazop_fewshot_prompt()
+    example_tokens = (
+        example_token_budget
+        if example_token_budget is not None
+        else estimate_tokens(prompt.examples[0]["table"])
+    )
+    return plan_selections(
+        selections,
+        query_infos,
+        base_prompt_tokens=estimate_tokens(prompt.prefix + prompt.suffix),
+        example_tokens=example_tokens,
+        concurrency=concurrency,
+    )
+
+def plan_hazop_run(
+    pid_data: dict,
+    selections: List[Dict[str, str]],
+    *,
+    group_study_nodes: bool = False,
+    example_token_budget: int | None = 600,
+    concurrency: int = 1,
+) -> HazopPlan:
+    list_infos = list_all_study_nodes if group_study_nodes else list_all_connections
+    return _plan_for_infos(list_infos(pid_data), selections, example_token_budget, concurrency)
+
 @timeit_log
 def run_hazop_agent(
     pid_data: dict,
@@ -427,17 +639,26 @@ def run_hazop_agent(
     parsed_excel_path: str,
     selections: List[Dict[str, str]],  # NEW
     token_limit: int = 20000,
+    example_token_budget: int | None = 600,
+    group_study_nodes: bool = False,
+    previous_pid_data: dict | None = None,
+    previous_output_folder: str | None = None,
+    plan: HazopPlan | None = None,
+    engine: str = "sdk",
+    call_timeout_s: float = 180.0,
+    output_mode: str = "csv",
+    max_repair_rounds: int = 1,
+    risk_mode: str = "correct",
+    streaming: bool = False,
+    hedge: HedgePolicy | None = None,
+    router: ModelRouter | None = None,
+    retriever: ProcessRetriever | None = None,
+    process_others: bool = False,
 ) -> Generator[Tuple[str, int], None, None]:
-    valid_guide_ws = [
-        "No", "More", "Less", "As well as", "Part of", "Reverse",
-        "Other than", "Early", "Late", "Before", "After", "No/Low"
-    ]
-
-    valid_params = [
-        "Flow", "Pressure", "Temperature", "Level", "Composition",
-        "Phase", "Utility", "Power", "Instrument", "Human Action",
-        "Maintenance", "Operation Timing", "Concentration"
-    ]
+    valid_guide_ws = HAZOP_GUIDE_WORDS
+    valid_params = HAZOP_PARAMETERS
+    if risk_mode not in ("correct", "flag", "off"):
+        raise ValueError(f"Unknown risk mode '{risk_mode}' (expected 'correct', 'flag' or 'off')")
 
     # --- 1) Your detailed single-line parser (unchanged logic) ---
     @timeit_log
@@ -505,13 +726,28 @@ def run_hazop_agent(
         return [[result[col] for col in headers]]
 
     # --- 2) Wrapper: use parse_llm_result for each line of the LLM output ---
-    def parse_llm_result_to_rows(result_text: str) -> list[list[str]]:
+    def parse_llm_result_to_rows(result_text: str, input_data: dict | None = None) -> list[list[str]]:
         """
         Turns the whole LLM output (possibly multi-line) into list[list[str]]
         by calling parse_llm_result() on each non-empty line.
         """
         rows: list[list[str]] = []
 
+        # structured-mode (and carried-over structured) outputs are schema JSON
+        if str(result_text).lstrip().startswith("{"):
+            try:
+                return [r.to_row() for r in HazopRowsResponse.model_validate_json(result_text).rows]
+            except ValueError:
+                return rows
+
+        if is_compact_output(result_text) and input_data is not None:
+            return expand_compact_rows(
+                result_text,
+                node=input_data["node"],
+                guide_word=input_data["guide_word"],
+                parameter=input_data["parameter"],
+            )
+
         for line in str(result_text).strip().splitlines():
             if not line.strip():
                 continue
@@ -530,92 +766,57 @@ def run_hazop_agent(
 
         return rows
 
-    query_infos = list_all_connections(pid_data)
-    print(query_infos)
+    list_infos = list_all_study_nodes if group_study_nodes else list_all_connections
+    query_infos = list_infos(pid_data)
+    logger.info(f"HAZOP query infos: {len(query_infos)} {'study nodes' if group_study_nodes else 'lines'}")
     valid_risk_categories = ["Low", "Medium", "High", "N/A"]
     
-    headers = [
-        "Node", "Guide Word", "Parameter", "Deviation", "Cause", "Consequence", 
-        "Unmitigated Risk Category", "S Before Safeguards", "L Before Safeguards", 
-        "RR Before Safeguards", "Overall Risk", "Safeguards", "Mitigated Risk Category", 
-        "S", "L", "RR", "Overall Risk", "Recommendations", "S After Recommendation", 
-        "L After Recommendation", "RR After Recommendation", "Responsibility"
-    ]
-    info_by_line: Dict[str, dict] = {info["line_id"]: info for info in query_infos}
-
-    df = pd.read_excel(excel_path) if os.path.exists(excel_path) else pd.DataFrame(columns=headers)
-    token_df = pd.read_csv(token_log_path) if os.path.exists(token_log_path) else pd.DataFrame(columns=[
-        "Timestamp", "LineID", "Parameter", "GuideWord", "Model", "PromptTokens", "CompletionTokens", "TotalTokens"
-    ])
-    error_df = pd.read_csv(error_log_path) if os.path.exists(error_log_path) else pd.DataFrame(columns=[
-        "Timestamp", "LineID", "Parameter", "GuideWord", "RawOutput", "Reason"
-    ])
-    llm_response_df = pd.read_csv(llm_response_log_path) if os.path.exists(llm_response_log_path) else pd.DataFrame(columns=[
-        "Timestamp", "LineID", "Parameter", "GuideWord", "RawOutput"
-    ])
-
-    llm, model_name = get_chat_model()
-    hazop_chain = LLMChain(llm=llm, prompt=get_hazop_fewshot_prompt())
-    
-    for sel in selections:
-        line_id = sel.get("line_id")
-        param = sel.get("parameter")
-        guide_word = sel.get("guide_word")
-
-        if not line_id or not param or not guide_word:
-            continue
-
-        info = info_by_line.get(line_id)
-        if not info:
-            logger.warning(f"[Skip] line_id {line_id} not found in pid_data")
-            continue
-
-        input_data = {
-            "line_id": info["line_id"],
-            "node": info["node"],
-            "valves": ", ".join(info.get("valves", [])),
-            "instruments": ", ".join(info.get("instruments", [])),
-            "context": info.get("context", ""),
-            "process_description": info["process_description"],
-            "parameter": param,
-            "guide_word": guide_word,
-        }
-
-        with get_openai_callback() as cb:
-            try:
-                result = hazop_chain.run(**input_data)
-
-                # ⬇️ per-selection parsing – NO global parsed_rows
-                rows = parse_llm_result_to_rows(result)
-
-                if not rows:
-                    logger.warning(
-                        f"[Warning] No valid rows for {info['line_id']}:{param}:{guide_word} "
-                        f"(LLM output probably malformed CSV)"
-                    )
-                    error_entry = {
-                        "Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "LineID": info["line_id"],
-                        "Parameter": param,
-                        "GuideWord": guide_word,
-                        "RawOutput": result,
-                        "Reason": f"Invalid or no rows parsed (expected {len(headers)} columns per row)"
-                    }
-                    error_df = pd.concat([error_df, pd.DataFrame([error_entry])], ignore_index=True)
-                    error_df.to_csv(error_log_path, index=False)
-                    continue
+    headers = HAZOP_HEADERS
+    info_by_line = index_query_infos(query_infos)
+    # validated, deduplicated and prefix-cache ordered work list
+    if plan is None:
+        plan = _plan_for_infos(query_infos, selections, example_token_budget)
+
+    # incremental mode: reuse previous outputs for deviations whose inputs did not change
+    carry_over: Dict[Tuple[str, str, str], str] = {}
+    if previous_pid_data is not None and previous_output_folder:
+        carry_over = plan_carry_over(list_infos(previous_pid_data), query_infos, previous_output_folder)
+
+    # streaming=True appends every result to disk as it arrives (constant memory);
+    # the default rewrites whole-run tables after each deviation
+    sink_cls = StreamingRunSink if streaming else DataFrameRunSink
+    sink = sink_cls(
+        excel_path=excel_path,
+        parsed_excel_path=parsed_excel_path,
+        token_log_path=token_log_path,
+        error_log_path=error_log_path,
+        llm_response_log_path=llm_response_log_path,
+    )
 
-            except Exception as e:
-                logger.error(f"[Error] {info['line_id']}:{param}:{guide_word} — {e}")
-                continue
+    # example_token_budget=None keeps the full static example in every prompt
+    example_selector = None
+    if example_token_budget is not None:
+        example_selector = RelevantHazopExampleSelector(
+            build_example_index(),
+            token_budget=example_token_budget,
+        )
 
-            if cb.total_tokens > token_limit:
-                logger.warning(f"[Skipped] {line_id}:{param}:{guide_word} — {cb.total_tokens} tokens")
-                continue
+    call_deviation = build_deviation_caller(
+        get_hazop_fewshot_prompt(example_selector, output_format=output_mode),
+        engine=engine,
+        output_mode=output_mode,
+        timeout_s=call_timeout_s,
+        hedge=hedge,
+    )
+    call_repair = build_repair_caller(output_mode=output_mode, timeout_s=call_timeout_s)
 
-            tokens_used = cb.total_tokens
+    # retrieval: the prompt gets only the top-k process chunks for each deviation
+    if retriever:
+        for text in dict.fromkeys(i["process_description"] for i in query_infos if i.get("process_description")):
+            retriever.add("process", text)
 
-        # Log raw LLM output
+    def write_outputs(line_id: str, param: str, guide_word: str, result: str, rows: list, token_fields: dict) -> None:
+        # shared by line deviations and the process-level "Others" job
         response_entry = {
             "Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "LineID": line_id,
@@ -623,27 +824,25 @@ def run_hazop_agent(
             "GuideWord": guide_word,
             "RawOutput": result,
         }
-        llm_response_df = pd.concat([llm_response_df, pd.DataFrame([response_entry])], ignore_index=True)
-        llm_response_df.to_csv(llm_response_log_path, index=False)
+        with span("file_write", target="llm_response_log"):
+            sink.log_response(response_entry)
 
         # Build DataFrame ONLY from current selection's rows
         df_parsed = pd.DataFrame(rows, columns=headers)
 
-        # --- merge into parsed_excel_path ---
-        if os.path.exists(parsed_excel_path):
-            df_existing = pd.read_excel(parsed_excel_path)
-            df_existing = df_existing.loc[:, ~df_existing.columns.duplicated()]
-            df_existing = df_existing.reindex(columns=headers)
-            df_parsed = df_parsed.reindex(columns=headers)
-            df_combined = pd.concat([df_existing, df_parsed], ignore_index=True)
-        else:
-            df_combined = df_parsed.reindex(columns=headers)
-
-        df_combined.to_excel(parsed_excel_path, index=False)
+        # RR / categories / Overall Risk follow from S and L; "correct" rewrites
+        # them from the risk matrix, "flag" only counts inconsistent rows
+        risk_flagged = None
+        if risk_mode in ("correct", "flag"):
+            with span("risk"):
+                df_parsed, risk_report, _ = derive_risk_columns(df_parsed, correct=risk_mode == "correct")
+            risk_flagged = risk_report["flagged_rows"]
+            if risk_flagged:
+                logger.info(f"[Risk] {line_id}:{param}:{guide_word} — {risk_flagged}/{len(rows)} rows inconsistent with S/L")
 
-        # --- main HAZOP output ---
-        df = pd.concat([df, df_parsed], ignore_index=True)
-        df.to_excel(excel_path, index=False)
+        # parsed_excel_path + main HAZOP output
+        with span("file_write", target="rows", rows=len(df_parsed)):
+            sink.add_rows(df_parsed)
 
         # token log
         token_row = {
@@ -651,12 +850,249 @@ def run_hazop_agent(
             "LineID": line_id,
             "Parameter": param,
             "GuideWord": guide_word,
-            "Model": model_name,
-            "PromptTokens": cb.prompt_tokens,
-            "CompletionTokens": cb.completion_tokens,
-            "TotalTokens": cb.total_tokens,
+            "ParsedRows": len(rows),
+            "RiskFlagged": risk_flagged,
+            **token_fields,
         }
-        token_df = pd.concat([token_df, pd.DataFrame([token_row])], ignore_index=True)
-        token_df.to_csv(token_log_path, index=False)
-
-        yield f"{line_id}:{param}:{guide_word}", tokens_used
\ No newline at end of file
+        with span("file_write", target="token_log"):
+            sink.log_tokens(token_row)
+
+    # process-level "Others" pass: its LLM call runs on a worker thread next to
+    # the line deviations; parsing and writes stay on this thread (one writer)
+    others_pool: ThreadPoolExecutor | None = None
+    others_future: Future | None = None
+    others_input: dict = {}
+    if process_others:
+        others_input = list_all_process(pid_data)[0]
+        call_others = build_deviation_caller(get_hazop_other_prompt(), engine=engine, timeout_s=call_timeout_s, hedge=hedge)
+        others_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hazop-others")
+        others_future = traced_submit(others_pool, call_others, others_input, context=f"{PROCESS_NODE}:Process:Others")
+
+    def finish_others() -> Generator[Tuple[str, int], None, None]:
+        nonlocal others_future
+        future, others_future = others_future, None
+        with span("deviation", line_id=PROCESS_NODE, parameter="Process", guide_word="Others"):
+            try:
+                call = future.result()
+            except Exception as e:
+                logger.error(f"[Error] {PROCESS_NODE}:Process:Others — {e}")
+                return
+            with span("parse"):
+                rows = parse_llm_result_to_rows(call["text"])
+            # "Process" / "Others" are outside the line parameter / guide word lists
+            for r in rows:
+                r[0] = r[0] or PROCESS_NODE
+                r[1] = r[1] or "Others"
+                r[2] = r[2] or "Process"
+            if not rows:
+                logger.warning(f"[Warning] No valid rows for {PROCESS_NODE}:Process:Others")
+                sink.log_error({
+                    "Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "LineID": PROCESS_NODE,
+                    "Parameter": "Process",
+                    "GuideWord": "Others",
+                    "RawOutput": call["text"],
+                    "Reason": f"Invalid or no rows parsed (expected {len(headers)} columns per row)",
+                })
+                return
+            write_outputs(PROCESS_NODE, "Process", "Others", call["text"], rows, {
+                "Model": call["model"],
+                "PromptTokens": call["prompt_tokens"],
+                "CompletionTokens": call["completion_tokens"],
+                "TotalTokens": call["total_tokens"],
+                "RepairCalls": 0,
+                "LatencyS": call["latency_s"],
+                "Escalated": False,
+                "EscalationTokens": 0,
+            })
+        yield f"{PROCESS_NODE}:Process:Others", call["total_tokens"]
+
+    run_start = time.perf_counter()
+    try:
+        for item in plan["items"]:
+            if others_future is not None and others_future.done():
+                yield from finish_others()
+
+            line_id = item["line_id"]
+            param = item["parameter"]
+            guide_word = item["guide_word"]
+            info = info_by_line[line_id]
+
+            # spans close before the yield: the consumer's emit time is traced by the caller
+            with span("deviation", line_id=line_id, parameter=param, guide_word=guide_word,
+                      queue_wait_s=round(time.perf_counter() - run_start, 4)) as dev_span:
+                input_data = {
+                    "line_id": info.get("line_label", info["line_id"]),
+                    "node": info["node"],
+                    "valves": ", ".join(info.get("valves", [])),
+                    "instruments": ", ".join(info.get("instruments", [])),
+                    "context": info.get("context", ""),
+                    "neighborhood": info.get("neighborhood", "N/A"),
+                    "process_description": info["process_description"],
+                    "parameter": param,
+                    "guide_word": guide_word,
+                }
+
+                if retriever:
+                    with span("retrieve"):
+                        input_data["process_description"] = retriever.context_for(" ".join([
+                            input_data["node"], param, guide_word, input_data["valves"],
+                            input_data["instruments"], input_data["context"],
+                        ])) or info["process_description"]
+
+                carried = carry_over.get((line_id, param, guide_word))
+                rows = parse_llm_result_to_rows(carried, input_data) if carried is not None else []
+                repair_calls = 0
+                route = router.route(info, param, guide_word) if router else None
+                escalated = False
+                escalation_tokens = 0
+                latency_s = 0.0
+
+                if rows:
+                    # unchanged since the previous revision: reuse its output, no LLM call
+                    result = carried
+                    call_model = "carry-over"
+                    prompt_tokens = completion_tokens = tokens_used = 0
+                else:
+                    try:
+                        call_start = time.perf_counter()
+                        active_model = route["model"] if route else None
+                        call = call_deviation(input_data, context=f"{line_id}:{param}:{guide_word}", model=active_model)
+                        result = call["text"]
+
+                        # ⬇️ per-selection parsing – NO global parsed_rows
+                        with span("parse"):
+                            rows = parse_llm_result_to_rows(result, input_data)
+                        repair_usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+                        # a routed (smaller) model whose output fails validation is
+                        # re-run once on the escalation model; its tokens stay billed
+                        if route and router.can_escalate(route["model"]) and (
+                            not rows or len(match_causes(rows)["missing"]) > router.max_missing_causes
+                        ):
+                            logger.info(
+                                f"[Routing] {line_id}:{param}:{guide_word} — {route['model']} output failed validation "
+                                f"({len(rows)} rows), escalating to {router.escalation_model}"
+                            )
+                            for k in repair_usage:
+                                repair_usage[k] += call[k]
+                            escalation_tokens = call["total_tokens"]
+                            escalated = True
+                            active_model = router.escalation_model
+                            call = call_deviation(input_data, context=f"escalate {line_id}:{param}:{guide_word}", model=active_model)
+                            result = call["text"]
+                            with span("parse", escalated=True):
+                                rows = parse_llm_result_to_rows(result, input_data)
+
+                        # request only the checklist causes that are missing or malformed,
+                        # with the accepted rows as context, instead of dropping them
+                        with span("repair") as repair_span:
+                            still_missing: List[int] = []
+                            for _ in range(max_repair_rounds):
+                                coverage = match_causes(rows)
+                                still_missing = coverage["missing"]
+                                if not still_missing:
+                                    break
+                                logger.info(
+                                    f"[Repair] {line_id}:{param}:{guide_word} — {len(still_missing)} cause(s) missing, "
+                                    f"{coverage['invalid']} invalid row(s)"
+                                )
+                                try:
+                                    fix = call_repair(
+                                        build_repair_prompt(input_data, still_missing, coverage["rows"], output_format=output_mode),
+                                        context=f"repair {line_id}:{param}:{guide_word}",
+                                        model=active_model,
+                                    )
+                                except Exception as e:
+                                    logger.error(f"[Repair] {line_id}:{param}:{guide_word} — {e}")
+                                    break
+                                repair_calls += 1
+                                for k in repair_usage:
+                                    repair_usage[k] += fix[k]
+                                rows = merge_repaired_rows(rows, parse_llm_result_to_rows(fix["text"], input_data))
+                                result = format_rows_output(rows, output_mode)
+                                still_missing = match_causes(rows)["missing"]
+                            repair_span.set(calls=repair_calls, missing=len(still_missing))
+
+                        if repair_calls and still_missing and rows:
+                            error_entry = {
+                                "Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                                "LineID": info["line_id"],
+                                "Parameter": param,
+                                "GuideWord": guide_word,
+                                "RawOutput": result,
+                                "Reason": f"{len(still_missing)} checklist cause(s) still missing after repair: "
+                                          + ", ".join(str(ci + 1) for ci in still_missing),
+                            }
+                            sink.log_error(error_entry)
+
+                        if not rows:
+                            logger.warning(
+                                f"[Warning] No valid rows for {info['line_id']}:{param}:{guide_word} "
+                                f"(LLM output probably malformed CSV)"
+                            )
+                            error_entry = {
+                                "Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                                "LineID": info["line_id"],
+                                "Parameter": param,
+                                "GuideWord": guide_word,
+                                "RawOutput": result,
+                                "Reason": f"Invalid or no rows parsed (expected {len(headers)} columns per row)"
+                            }
+                            sink.log_error(error_entry)
+                            continue
+
+                    except InvalidOutputError as e:
+                        # structured reply still invalid after retries: same error_log
+                        # row as unparseable CSV output
+                        logger.error(f"[Error] {info['line_id']}:{param}:{guide_word} — {e}")
+                        sink.log_error({
+                            "Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                            "LineID": info["line_id"],
+                            "Parameter": param,
+                            "GuideWord": guide_word,
+                            "RawOutput": e.raw,
+                            "Reason": f"Invalid structured output: {e}",
+                        })
+                        continue
+                    except Exception as e:
+                        logger.error(f"[Error] {info['line_id']}:{param}:{guide_word} — {e}")
+                        continue
+
+                    if call["total_tokens"] > token_limit:
+                        logger.warning(f"[Skipped] {line_id}:{param}:{guide_word} — {call['total_tokens']} tokens")
+                        continue
+
+                    latency_s = round(time.perf_counter() - call_start, 4)
+                    call_model = call["model"]
+                    prompt_tokens = call["prompt_tokens"] + repair_usage["prompt_tokens"]
+                    completion_tokens = call["completion_tokens"] + repair_usage["completion_tokens"]
+                    tokens_used = call["total_tokens"] + repair_usage["total_tokens"]
+                dev_span.set(model=call_model, tokens=tokens_used, rows=len(rows), repair_calls=repair_calls, escalated=escalated)
+
+                write_outputs(line_id, param, guide_word, result, rows, {
+                    "Model": call_model,
+                    "PromptTokens": prompt_tokens,
+                    "CompletionTokens": completion_tokens,
+                    "TotalTokens": tokens_used,
+                    "ExampleTokens": example_selector.last_selection["tokens"] if example_selector and call_model != "carry-over" else None,
+                    "RepairCalls": repair_calls,
+                    "LatencyS": latency_s,
+                    "RoutedModel": route["model"] if route and call_model != "carry-over" else None,
+                    "Route": route["rule"] if route and call_model != "carry-over" else None,
+                    "Escalated": escalated,
+                    "EscalationTokens": escalation_tokens,
+                })
+
+            yield f"{line_id}:{param}:{guide_word}", tokens_used
+
+        if others_future is not None:
+            yield from finish_others()
+    finally:
+        if others_pool:
+            others_pool.shutdown(wait=False, cancel_futures=True)
+        sink.close()
+        if hedge:
+            logger.info(f"[Hedge] {hedge.stats()}")
+        if router:
+            summarize_model_usage(token_log_path)
\ No newline at end of file
@@ -0,0 +1,108 @@
+from typing import List
+
+from module.plan_module import HAZOP_CAUSE_CHECKLIST
+from module.risk_module import RISK_STAGES, risk_categories, risk_levels
+from module.schema_json import HAZOP_HEADERS
+
+# ------------- COMPACT WIRE FORMAT ---------------------------
+# The model writes the deviation once and one pipe-separated line per cause;
+# Node / Guide Word / Parameter are known locally and the checklist cause is
+# referenced by number, so none of them are paid for as completion tokens.
+# RR, risk categories and Overall Risk are derived from S/L by risk_module.
+#
+#   D|<Deviation>
+#   <cause no>|<Consequence>|<S>|<L>|<Safeguards>|<S>|<L>|<Recommendations>|<S>|<L>|<Resp>
+COMPACT_FIELDS = 11
+RESPONSIBILITY_CODES = {"E": "Engineering", "M": "Maintenance", "O": "Operations"}
+
+COMPACT_OUTPUT_RULES = """            2. Output format (compact, pipe-separated):
+            • First line, once: D|<Deviation>
+            • Then one line per Cause with **11 pipe-separated fields**:
+                ```
+                Cause No|Consequence|S|L|Safeguards|S|L|Recommendations|S|L|Responsibility
+                ```
+            • Cause No is the checklist number (1-50); do not repeat Node, Guide Word, Parameter or the cause text.
+            • S and L are bare integers 1-5 (before safeguards, after safeguards, after recommendation).
+              Do NOT write RR or risk categories; they are computed from S and L.
+            • Responsibility is coded E=Engineering, M=Maintenance, O=Operations.
+            • Never use "|" inside a field; separate list items with "; ".
+            • No Markdown, no code block fences, no headers, no comments.
+"""
+
+# replaces the RR / risk category instructions of role_and_rules_2 in compact
+# mode, after the Severity / Likelihood scales the model still needs
+COMPACT_RISK_RULES = """Write S and L only, three times per cause (before safeguards, after safeguards, after recommendation).
+
+            4. Use only the S and L scales above.
+
+"""
+
+def is_compact_output(text: str) -> bool:
+    return str(text).lstrip().startswith("D|")
+
+def _int_or_raw(v: str):
+    v = v.strip()
+    return int(v) if v.isdigit() else v
+
+def expand_compact_rows(text: str, *, node: str, guide_word: str, parameter: str) -> List[list]:
+    """Expand compact output back to full HAZOP_HEADERS rows; malformed lines are skipped."""
+    rows: List[list] = []
+    deviation = f"{guide_word} {parameter}"
+
+    for line in str(text).strip().splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("D|"):
+            deviation = line[2:].strip() or deviation
+            continue
+
+        parts = line.split("|")
+        if len(parts) != COMPACT_FIELDS or not parts[0].strip().isdigit():
+            continue
+        cause_no = int(parts[0])
+        if not 1 <= cause_no <= len(HAZOP_CAUSE_CHECKLIST):
+            continue
+
+        (_, consequence, s0, l0, safeguards, s1, l1,
+         recommendations, s2, l2, resp) = (p.strip() for p in parts)
+        s0, l0, s1, l1, s2, l2 = map(_int_or_raw, (s0, l0, s1, l1, s2, l2))
+
+        rows.append([
+            node, guide_word, parameter, deviation, HAZOP_CAUSE_CHECKLIST[cause_no - 1], consequence,
+            "", s0, l0, None, "",
+            safeguards, "", s1, l1, None, "",
+            recommendations, s2, l2, None,
+            RESPONSIBILITY_CODES.get(resp.upper(), resp),
+        ])
+
+    # fill RR / categories for the whole response in one lookup per stage
+    for stage in RISK_STAGES:
+        rl = risk_levels([r[stage["s"]] for r in rows], [r[stage["l"]] for r in rows])
+        cats = risk_categories(rl)
+        cat_cols = [c for c in (stage["category"], stage["overall"]) if c is not None]
+        for r, level, cat in zip(rows, rl, cats):
+            r[stage["rr"]] = int(level) if level else "N/A"
+            for c in cat_cols:
+                r[c] = cat
+    return rows
+
+def encode_compact_rows(rows: List[list]) -> str:
+    """Inverse of expand_compact_rows for rows that use checklist causes (benchmarks, tests)."""
+    cause_no = {c: i + 1 for i, c in enumerate(HAZOP_CAUSE_CHECKLIST)}
+    resp_code = {v: k for k, v in RESPONSIBILITY_CODES.items()}
+    h = {name: i for i, name in enumerate(HAZOP_HEADERS)}
+
+    lines = [f"D|{rows[0][h['Deviation']]}"] if rows else []
+    for r in rows:
+        if r[h["Cause"]] not in cause_no:
+            continue
+        lines.append("|".join(str(v) for v in [
+            cause_no[r[h["Cause"]]], r[h["Consequence"]],
+            r[h["S Before Safeguards"]], r[h["L Before Safeguards"]],
+            r[h["Safeguards"]], r[h["S"]], r[h["L"]],
+            r[h["Recommendations"]],
+            r[h["S After Recommendation"]], r[h["L After Recommendation"]],
+            resp_code.get(r[h["Responsibility"]], "E"),
+        ]))
+    return "\n".join(lines)
@@ -0,0 +1,120 @@
+import json, os
+from pathlib import Path
+from typing import Any, Dict, List, Tuple, TypedDict
+
+import pandas as pd
+
+from module.graph_module import unwrap_pid_data
+from decorators import logger
+
+DeviationKey = Tuple[str, str, str]
+
+class ItemDiff(TypedDict):
+    added: List[str]
+    removed: List[str]
+    modified: Dict[str, List[str]]
+
+class PIDDiff(TypedDict):
+    connections: ItemDiff
+    equipment: ItemDiff
+    valves: ItemDiff
+    instruments: ItemDiff
+    process_description_changed: bool
+
+# ------------- STRUCTURAL DIFF -------------------------------
+def _diff_items(old: List[dict], new: List[dict], key: str) -> ItemDiff:
+    old_by = {o[key]: o for o in old if o.get(key)}
+    new_by = {n[key]: n for n in new if n.get(key)}
+
+    modified: Dict[str, List[str]] = {}
+    for k in old_by.keys() & new_by.keys():
+        a, b = old_by[k], new_by[k]
+        changed = sorted(f for f in a.keys() | b.keys() if a.get(f) != b.get(f))
+        if changed:
+            modified[k] = changed
+
+    return {
+        "added": [k for k in new_by if k not in old_by],
+        "removed": [k for k in old_by if k not in new_by],
+        "modified": dict(sorted(modified.items())),
+    }
+
+def diff_pid(old_pid: Any, new_pid: Any) -> PIDDiff:
+    old, new = unwrap_pid_data(old_pid), unwrap_pid_data(new_pid)
+    return {
+        "connections": _diff_items(old.get("connections", []), new.get("connections", []), "line_id"),
+        "equipment": _diff_items(old.get("equipment", []), new.get("equipment", []), "id"),
+        "valves": _diff_items(old.get("valves", []), new.get("valves", []), "id"),
+        "instruments": _diff_items(old.get("instruments", []), new.get("instruments", []), "id"),
+        "process_description_changed": old.get("process_description") != new.get("process_description"),
+    }
+
+def load_pid_document(name: str, data_dir: str | Path = "static/data") -> dict:
+    path = Path(data_dir) / f"{Path(name).stem}.json"
+    if not path.exists():
+        raise FileNotFoundError(f"P&ID document not found: {path}")
+    return json.loads(path.read_text(encoding="utf-8"))
+
+# ------------- CARRY-OVER PLANNING ---------------------------
+def _input_signature(info: dict) -> str:
+    # everything the deviation prompt sees except the id itself, so a renamed
+    # but otherwise identical line still matches its previous analysis
+    body = {k: v for k, v in info.items() if k not in ("line_id", "line_label")}
+    return json.dumps(body, sort_keys=True, ensure_ascii=False)
+
+def match_unchanged_inputs(old_infos: List[dict], new_infos: List[dict]) -> Dict[str, str]:
+    """Map new line/node id -> previous id for every deviation input that did not change."""
+    old_by_sig: Dict[str, str] = {}
+    for info in old_infos:
+        old_by_sig.setdefault(_input_signature(info), info["line_id"])
+
+    return {
+        info["line_id"]: old_by_sig[sig]
+        for info in new_infos
+        if (sig := _input_signature(info)) in old_by_sig
+    }
+
+def load_previous_responses(output_folder: str | Path) -> Dict[DeviationKey, str]:
+    """Last raw LLM output per (line, parameter, guide word) of an earlier run."""
+    log_path = Path(output_folder) / "llm_response_log.csv"
+    if not log_path.exists():
+        logger.warning(f"[Incremental] no llm_response_log.csv in {output_folder}")
+        return {}
+
+    df = pd.read_csv(log_path, dtype=str).dropna(subset=["LineID", "Parameter", "GuideWord", "RawOutput"])
+    df = df.drop_duplicates(subset=["LineID", "Parameter", "GuideWord"], keep="last")
+    return {
+        (r.LineID, r.Parameter, r.GuideWord): r.RawOutput
+        for r in df.itertuples(index=False)
+    }
+
+def plan_carry_over(
+    old_infos: List[dict],
+    new_infos: List[dict],
+    previous_output_folder: str | Path,
+) -> Dict[DeviationKey, str]:
+    """
+    Raw outputs from the previous folder, keyed by the NEW (line, parameter,
+    guide word), for every deviation whose inputs are unchanged.
+    """
+    if not os.path.isdir(previous_output_folder):
+        logger.warning(f"[Incremental] previous output folder missing: {previous_output_folder}")
+        return {}
+
+    id_map = match_unchanged_inputs(old_infos, new_infos)
+    previous = load_previous_responses(previous_output_folder)
+
+    new_ids_by_old: Dict[str, List[str]] = {}
+    for new_id, old_id in id_map.items():
+        new_ids_by_old.setdefault(old_id, []).append(new_id)
+
+    carry: Dict[DeviationKey, str] = {}
+    for (old_id, param, guide_word), raw in previous.items():
+        for new_id in new_ids_by_old.get(old_id, []):
+            carry[(new_id, param, guide_word)] = raw
+
+    logger.info(
+        f"[Incremental] {len(id_map)}/{len(new_infos)} inputs unchanged, "
+        f"{len(carry)} previous deviations reusable"
+    )
+    return carry
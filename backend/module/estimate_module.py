@@ -0,0 +1,144 @@
+import glob, os
+from functools import lru_cache
+from typing import Dict, Tuple, TypedDict
+
+import numpy as np
+import pandas as pd
+
+from module.llm_module import DEFAULT_CHAT_MODEL
+from module.plan_module import DEFAULT_COMPLETION_TOKENS, DEFAULT_SECONDS_PER_CALL, HazopPlan
+from decorators import logger
+
+HAZOP_OUTPUT_ROOT = os.path.join("static", "hazop")
+
+# USD per 1M tokens (input, output); unknown models fall back to DEFAULT_CHAT_MODEL
+MODEL_PRICES_PER_1M: Dict[str, Tuple[float, float]] = {
+    "gpt-4.1-2025-04-14": (2.00, 8.00),
+    "gpt-4.1-mini-2025-04-14": (0.40, 1.60),
+    "gpt-4.1-nano-2025-04-14": (0.10, 0.40),
+}
+
+# a gap longer than this between two token-log rows is a new session, not a call
+MAX_CALL_GAP_S = 600.0
+
+class RunEstimate(TypedDict):
+    deviations: int
+    concurrency: int
+    model: str
+    expected_prompt_tokens: int
+    expected_completion_tokens: int
+    expected_total_tokens: int
+    expected_cost_usd: float
+    expected_seconds: float
+    history_calls: int
+    basis: Dict[str, int]
+
+# ------------- HISTORY ---------------------------------------
+def _log_signature(root: str) -> Tuple[Tuple[str, float], ...]:
+    paths = sorted(glob.glob(os.path.join(root, "*", "token_log.csv")))
+    return tuple((p, os.path.getmtime(p)) for p in paths)
+
+@lru_cache(maxsize=4)
+def _load_history(signature: Tuple[Tuple[str, float], ...]) -> pd.DataFrame:
+    frames = [pd.read_csv(p).assign(Source=p) for p, _ in signature]
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=["Parameter", "GuideWord", "PromptTokens", "CompletionTokens", "Latency"])
+
+    df = pd.concat(frames, ignore_index=True)
+    df = df[df["Model"].ne("carry-over") & pd.to_numeric(df["TotalTokens"], errors="coerce").gt(0)].copy()
+    df["Timestamp"] = pd.to_datetime(df["Timestamp"], errors="coerce")
+    df = df.sort_values(["Source", "Timestamp"])
+
+    # runs are serial and log one row per finished call, so the gap to the
+    # previous row of the same log is that call's duration; LatencyS wins when logged
+    gap = df.groupby("Source")["Timestamp"].diff().dt.total_seconds()
+    gap = gap.where(gap.between(1.0, MAX_CALL_GAP_S))
+    logged = pd.to_numeric(df["LatencyS"], errors="coerce") if "LatencyS" in df.columns else pd.Series(np.nan, index=df.index)
+    df["Latency"] = logged.where(logged > 0, gap)
+
+    for col in ("PromptTokens", "CompletionTokens"):
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+    return df[["Parameter", "GuideWord", "PromptTokens", "CompletionTokens", "Latency"]].reset_index(drop=True)
+
+def load_token_history(root: str = HAZOP_OUTPUT_ROOT) -> pd.DataFrame:
+    """All successful calls from root/*/token_log.csv, cached until a log changes."""
+    return _load_history(_log_signature(root))
+
+# ------------- ESTIMATE --------------------------------------
+def _level_stats(df: pd.DataFrame, keys: list, min_samples: int, tag: str) -> pd.DataFrame:
+    stats = df.groupby(keys).agg(
+        completion=("CompletionTokens", "mean"),
+        latency=("Latency", "mean"),
+        n=("CompletionTokens", "size"),
+    )
+    stats = stats[stats["n"] >= min_samples].drop(columns="n")
+    return stats.add_suffix(f"_{tag}").reset_index()
+
+def estimate_run(
+    plan: HazopPlan,
+    *,
+    concurrency: int = 1,
+    model: str = DEFAULT_CHAT_MODEL,
+    min_samples: int = 3,
+    root: str = HAZOP_OUTPUT_ROOT,
+) -> RunEstimate:
+    """
+    Expected tokens, cost and wall-clock time of a planned run.
+
+    Prompt tokens come from the plan (they follow the current prompt, not old
+    runs); completion tokens and latency are the historical mean of the same
+    parameter + guide word, falling back to the parameter, then all calls,
+    then the plan defaults when a level has fewer than `min_samples` calls.
+    """
+    hist = load_token_history(root)
+    items = pd.DataFrame(plan["items"], columns=["line_id", "parameter", "guide_word", "prompt_tokens"])
+    items = items.rename(columns={"parameter": "Parameter", "guide_word": "GuideWord"})
+
+    items = items.merge(_level_stats(hist, ["Parameter", "GuideWord"], min_samples, "pair"), on=["Parameter", "GuideWord"], how="left")
+    items = items.merge(_level_stats(hist, ["Parameter"], min_samples, "param"), on="Parameter", how="left")
+
+    enough = len(hist) >= min_samples
+    global_completion = hist["CompletionTokens"].mean() if enough else np.nan
+    global_latency = hist["Latency"].mean() if enough and hist["Latency"].notna().any() else np.nan
+
+    completion = (
+        items["completion_pair"].fillna(items["completion_param"])
+        .fillna(global_completion).fillna(DEFAULT_COMPLETION_TOKENS)
+    )
+    latency = (
+        items["latency_pair"].fillna(items["latency_param"])
+        .fillna(global_latency).fillna(DEFAULT_SECONDS_PER_CALL)
+    )
+    basis = np.select(
+        [items["completion_pair"].notna(), items["completion_param"].notna(), bool(enough)],
+        ["parameter_guide_word", "parameter", "all_calls"],
+        default="default",
+    )
+
+    prompt_total = int(items["prompt_tokens"].sum())
+    completion_total = int(round(completion.sum()))
+    price_in, price_out = MODEL_PRICES_PER_1M.get(model, MODEL_PRICES_PER_1M[DEFAULT_CHAT_MODEL])
+    cost = (prompt_total * price_in + completion_total * price_out) / 1_000_000
+
+    # c workers: the work divides evenly, but never beats the slowest single call
+    concurrency = max(1, int(concurrency))
+    seconds = max(latency.sum() / concurrency, latency.max()) if len(items) else 0.0
+
+    estimate: RunEstimate = {
+        "deviations": len(items),
+        "concurrency": concurrency,
+        "model": model,
+        "expected_prompt_tokens": prompt_total,
+        "expected_completion_tokens": completion_total,
+        "expected_total_tokens": prompt_total + completion_total,
+        "expected_cost_usd": round(cost, 4),
+        "expected_seconds": round(float(seconds), 1),
+        "history_calls": len(hist),
+        "basis": {str(k): int(v) for k, v in pd.Series(basis, dtype=object).value_counts().items()},
+    }
+    logger.info(
+        f"[Estimate] {estimate['deviations']} deviations x{concurrency}: ~{estimate['expected_total_tokens']} tokens, "
+        f"~${estimate['expected_cost_usd']}, ~{estimate['expected_seconds']}s (basis {estimate['basis']})"
+    )
+    return estimate
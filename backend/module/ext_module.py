@@ -1,50 +1,83 @@
-import openai, time
+import openai, time, tempfile, shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 from module.llm_module import get_openai_sdk, build_llm_metadata, LLMUsageMeta
 from module.schema_json import PIDResponse
 from module.prompt.ext_prompt import PID_SYSTEM_PROMPT, build_pid_input
+from module.preprocess_module import PreprocessOptions, PreprocessReport, preprocess_sources
+from module.tile_module import UploadSource, source_name, split_into_tiles, merge_pid_responses
+from module.trace_module import span, traced, traced_submit
 from decorators import logger, timeit_log
 from utils import save_pid_json
 
 @timeit_log
-def _upload_vision_file(path: str | Path) -> str:
+@traced("upload")
+def _upload_vision_file(source: UploadSource) -> str:
     client = get_openai_sdk()
-    path = Path(path)
 
-    with path.open("rb") as f:
+    if isinstance(source, tuple):
+        # request upload streamed straight to the provider, no copy on disk
+        name, stream = source
+        stream.seek(0)
         file_obj = client.files.create(
-            file=f,
-            purpose="user_data",  
+            file=(Path(name).name, stream),
+            purpose="user_data",
         )
-    logger.info("Uploaded file '%s' as id=%s", path, file_obj.id)
+    else:
+        with Path(source).open("rb") as f:
+            file_obj = client.files.create(
+                file=f,
+                purpose="user_data",
+            )
+    logger.info("Uploaded file '%s' as id=%s", source_name(source), file_obj.id)
     return file_obj.id
 
+def upload_vision_files(sources: List[UploadSource], max_workers: int = 4) -> List[str]:
+    """Upload concurrently; file ids come back in input order."""
+    if len(sources) <= 1:
+        return [_upload_vision_file(s) for s in sources]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(sources))) as pool:
+        futures = [traced_submit(pool, _upload_vision_file, s) for s in sources]
+        return [f.result() for f in futures]
+
+def _maybe_preprocess(
+    sources: List[UploadSource], preprocess: PreprocessOptions | None
+) -> tuple[List[UploadSource], PreprocessReport | None]:
+    if not preprocess:
+        return sources, None
+    return preprocess_sources(sources, preprocess)
+
 # single file (PDF or image) using Responses API.
+@traced("extract_pid")
 def extract_pid(
-    file_path: str,
+    file_path: UploadSource,
     *,
     process_description: str,
     model: str = "gpt-5.1-2025-11-13",
     max_retries: int = 3,
     backoff_s: float = 2.0,
+    preprocess: PreprocessOptions | None = None,
 ) -> tuple[PIDResponse, LLMUsageMeta]:
     client = get_openai_sdk()
 
-    file_id = _upload_vision_file(file_path)
-    input_messages = build_pid_input(process_description, [file_id])
+    # a rasterized multi-page PDF becomes several images
+    sources, prep_report = _maybe_preprocess([file_path], preprocess)
+    file_ids = upload_vision_files(sources)
+    input_messages = build_pid_input(process_description, file_ids)
 
     for attempt in range(1, max_retries + 1):
         try:
             start_t = time.perf_counter()
 
-            resp = client.responses.parse(
-                model=model,
-                instructions=PID_SYSTEM_PROMPT,
-                input=input_messages,
-                text_format=PIDResponse,
-            )
+            with span("llm_attempt", model=model, attempt=attempt):
+                resp = client.responses.parse(
+                    model=model,
+                    instructions=PID_SYSTEM_PROMPT,
+                    input=input_messages,
+                    text_format=PIDResponse,
+                )
 
             elapsed = time.perf_counter() - start_t
 
@@ -58,6 +91,8 @@ def extract_pid(
                 total_tokens,
                 meta["latency_s"],
             )
+            if prep_report:
+                meta["preprocess"] = prep_report
 
             return pid_result, meta
 
@@ -87,7 +122,7 @@ def extract_pid(
             time.sleep(backoff_s * attempt)
 
     raise RuntimeError(
-        f"Failed to obtain valid P&ID JSON for {file_path} after {max_retries} attempts."
+        f"Failed to obtain valid P&ID JSON for {source_name(file_path)} after {max_retries} attempts."
     )
 
 # multiple files (e.g. several PDFs + images) in ONE API call.
@@ -96,24 +131,24 @@ def extract_pid(
 # P&ID, PFD, symbol sheets, spec sheets, etc.
 # File order does NOT matter; all context is used together.
 @timeit_log
+@traced("extract_pid_multi")
 def extract_pid_multi_files_single_call(
-    file_paths: List[str],
+    file_paths: List[UploadSource],
     *,
     process_description: str,
     model: str = "gpt-5.1-2025-11-13",
     max_retries: int = 3,
     backoff_s: float = 2.0,
+    preprocess: PreprocessOptions | None = None,
 ) -> tuple[PIDResponse, LLMUsageMeta]:
     client = get_openai_sdk()
 
-    file_ids: List[str] = []
-    for p in file_paths:
-        try:
-            fid = _upload_vision_file(p)
-            file_ids.append(fid)
-        except Exception as e:
-            logger.error("Failed to upload file '%s': %s", p, e)
-            raise
+    sources, prep_report = _maybe_preprocess(file_paths, preprocess)
+    try:
+        file_ids = upload_vision_files(sources)
+    except Exception as e:
+        logger.error("Failed to upload files %s: %s", [source_name(p) for p in file_paths], e)
+        raise
 
     input_messages = build_pid_input(process_description, file_ids)
 
@@ -121,12 +156,13 @@ def extract_pid_multi_files_single_call(
         try:
             start_t = time.perf_counter()
 
-            resp = client.responses.parse(
-                model=model,
-                instructions=PID_SYSTEM_PROMPT,
-                input=input_messages,
-                text_format=PIDResponse,
-            )
+            with span("llm_attempt", model=model, attempt=attempt):
+                resp = client.responses.parse(
+                    model=model,
+                    instructions=PID_SYSTEM_PROMPT,
+                    input=input_messages,
+                    text_format=PIDResponse,
+                )
 
             elapsed = time.perf_counter() - start_t
 
@@ -139,6 +175,8 @@ def extract_pid_multi_files_single_call(
                 meta["tokens"]["total"],
                 meta["latency_s"],
             )
+            if prep_report:
+                meta["preprocess"] = prep_report
 
             return pid_result, meta
 
@@ -168,7 +206,7 @@ def extract_pid_multi_files_single_call(
             time.sleep(backoff_s * attempt)
 
     raise RuntimeError(
-        f"Failed to obtain valid P&ID JSON for files {file_paths} after {max_retries} attempts."
+        f"Failed to obtain valid P&ID JSON for files {[source_name(p) for p in file_paths]} after {max_retries} attempts."
     )
 
 # Run P&ID extraction for multiple files, but with ONE call per file.
@@ -201,3 +239,84 @@ def extract_pid_batch(
             logger.error("Failed to extract P&ID from %s: %s", p, e)
 
     return results
+
+# Split PDFs into page (or page-region) tiles, extract each tile in parallel
+# and merge the partial PIDResponse objects into one document.
+# A failed tile is logged and skipped; the call only fails if every tile fails.
+@timeit_log
+@traced("extract_pid_tiled")
+def extract_pid_tiled(
+    file_paths: List[UploadSource],
+    *,
+    process_description: str,
+    model: str = "gpt-5.1-2025-11-13",
+    grid: Tuple[int, int] = (1, 1),
+    max_workers: int = 4,
+    max_retries: int = 3,
+    backoff_s: float = 2.0,
+    preprocess: PreprocessOptions | None = None,
+) -> tuple[PIDResponse, LLMUsageMeta]:
+    start_t = time.perf_counter()
+    tile_dir = Path(tempfile.mkdtemp(prefix="pid_tiles_"))
+
+    try:
+        sources, prep_report = _maybe_preprocess(file_paths, preprocess)
+        tiles = split_into_tiles(sources, tile_dir, grid=grid)
+
+        parts: Dict[str, PIDResponse] = {}
+        tile_meta: List[Dict[str, object]] = []
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                traced_submit(
+                    pool,
+                    extract_pid,
+                    tile["path"],
+                    process_description=process_description,
+                    model=model,
+                    max_retries=max_retries,
+                    backoff_s=backoff_s,
+                ): tile
+                for tile in tiles
+            }
+            for fut in as_completed(futures):
+                tile = futures[fut]
+                try:
+                    pid_result, meta = fut.result()
+                    parts[tile["tile_id"]] = pid_result
+                    tile_meta.append({"tile_id": tile["tile_id"], "source": tile["source"], "page": tile["page"], **meta})
+                except Exception as e:
+                    logger.error("Tile %s (%s p.%d) failed: %s", tile["tile_id"], tile["source"], tile["page"], e)
+                    tile_meta.append({"tile_id": tile["tile_id"], "source": tile["source"], "page": tile["page"], "error": str(e)})
+    finally:
+        shutil.rmtree(tile_dir, ignore_errors=True)
+
+    if not parts:
+        raise RuntimeError(f"Failed to obtain valid P&ID JSON for any tile of {[source_name(p) for p in file_paths]}.")
+
+    # merge in drawing order so ids keep their first-seen spelling
+    ordered = [(t["tile_id"], parts[t["tile_id"]]) for t in tiles if t["tile_id"] in parts]
+    merged = merge_pid_responses(ordered)
+
+    def _sum(key: str) -> int:
+        return sum(int((m.get("tokens") or {}).get(key) or 0) for m in tile_meta)
+
+    meta: LLMUsageMeta = {
+        "id": None,
+        "created": int(time.time()),
+        "model": model,
+        "tokens": {"prompt": _sum("prompt"), "completion": _sum("completion"), "total": _sum("total")},
+        "response_type": "json_schema_tiled",
+        "latency_s": round(time.perf_counter() - start_t, 4),
+    }
+    meta["tiles"] = sorted(tile_meta, key=lambda m: str(m["tile_id"]))
+    if prep_report:
+        meta["preprocess"] = prep_report
+    logger.info(
+        "LLM tiled usage: model=%s tiles=%d failed=%d total_tokens=%s latency=%.3fs",
+        model,
+        len(tiles),
+        len(tiles) - len(parts),
+        meta["tokens"]["total"],
+        meta["latency_s"],
+    )
+    return merged, meta
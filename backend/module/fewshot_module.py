@@ -0,0 +1,238 @@
+import math, re
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Sequence
+
+import pandas as pd
+from langchain_core.example_selectors import BaseExampleSelector
+
+from decorators import logger, timeit_log
+
+SAMPLE_EXAMPLE_PATH = Path("static/file/sample_50_row_hazop_example.txt")
+HISTORY_GLOB = "static/hazop/*/parsed_rows.xlsx"
+
+# fields of a 22-column HAZOP row that carry the deviation semantics
+_ROW_TEXT_FIELDS = (1, 2, 3, 4, 5)
+# S/L before safeguards, mitigated, after recommendation (HAZOP_HEADERS order)
+_SL_FIELDS = (7, 8, 13, 14, 18, 19)
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English/CSV text, no tokenizer dependency
+    return max(1, math.ceil(len(text) / 4))
+
+def _tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(str(text).lower())
+
+def _format_cell(value: Any) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "N/A"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+# ------------- EXAMPLE SOURCES -------------------------------
+def load_sample_rows(path: str | Path = SAMPLE_EXAMPLE_PATH) -> List[List[str]]:
+    path = Path(path)
+    if not path.exists():
+        logger.warning(f"[FewShot] sample file not found: {path}")
+        return []
+
+    rows: List[List[str]] = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        parts = [p.strip() for p in line.split(",")]
+        if len(parts) >= 22:
+            rows.append(parts)
+    return rows
+
+def is_accepted_row(row: Sequence[str]) -> bool:
+    """
+    Whether a saved worksheet row is good enough to show as an example:
+    integer S/L in 1-5, a known guide word and parameter, and a cause from
+    the checklist. Misparsed rows (a line id in the Cause column) and
+    off-checklist causes are left out.
+    """
+    # plan_module / repair_module import this module
+    from module.plan_module import HAZOP_GUIDE_WORDS, HAZOP_PARAMETERS
+    from module.repair_module import checklist_cause
+
+    if len(row) < 22:
+        return False
+    if any(not str(row[i]).isdigit() or not 1 <= int(row[i]) <= 5 for i in _SL_FIELDS):
+        return False
+    if row[1] not in HAZOP_GUIDE_WORDS or row[2] not in HAZOP_PARAMETERS:
+        return False
+    return checklist_cause(row[4]) is not None
+
+@lru_cache(maxsize=64)
+def _load_history_file(path: str, mtime: float) -> tuple:
+    # mtime is part of the cache key so edited/extended files are re-read
+    df = pd.read_excel(path)
+    df = df.dropna(subset=[df.columns[4]])
+    rows = [tuple(_format_cell(v) for v in record) for record in df.itertuples(index=False, name=None)]
+    accepted = tuple(r for r in rows if is_accepted_row(r))
+    if len(accepted) < len(rows):
+        logger.info(f"[FewShot] {path}: {len(rows) - len(accepted)}/{len(rows)} rows rejected as examples")
+    return accepted
+
+def load_history_rows(pattern: str = HISTORY_GLOB) -> List[List[str]]:
+    rows: List[List[str]] = []
+    for path in sorted(Path(".").glob(pattern)):
+        try:
+            rows.extend(list(r) for r in _load_history_file(str(path), path.stat().st_mtime))
+        except Exception as e:
+            logger.warning(f"[FewShot] skip history file {path}: {e}")
+    return rows
+
+# ------------- BM25 INDEX ------------------------------------
+class HazopExampleIndex:
+    """
+    Okapi BM25 over single HAZOP worksheet rows. Rows are deduplicated by
+    (Guide Word, Parameter, Cause) so the index stays small even when the
+    same study was saved several times.
+    """
+
+    def __init__(self, rows: Iterable[Sequence[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.rows: List[List[str]] = []
+        self.doc_tf: List[Counter] = []
+        self.doc_len: List[int] = []
+        self.df: Counter = Counter()
+
+        seen = set()
+        for row in rows:
+            row = [str(c) for c in row]
+            if len(row) < 22:
+                continue
+            key = (row[1].lower(), row[2].lower(), row[4].lower())
+            if key in seen:
+                continue
+            seen.add(key)
+            self.add_row(row)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def add_row(self, row: Sequence[str]) -> None:
+        terms = []
+        for i in _ROW_TEXT_FIELDS:
+            terms.extend(_tokenize(row[i]))
+        tf = Counter(terms)
+        self.rows.append(list(row))
+        self.doc_tf.append(tf)
+        self.doc_len.append(len(terms))
+        self.df.update(tf.keys())
+
+    def _idf(self, term: str) -> float:
+        n = len(self.rows)
+        df = self.df.get(term, 0)
+        return math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, top_k: int = 20) -> List[tuple[float, int]]:
+        if not self.rows:
+            return []
+
+        q_terms = Counter(_tokenize(query))
+        avgdl = sum(self.doc_len) / len(self.doc_len) or 1.0
+        idf = {t: self._idf(t) for t in q_terms}
+
+        scored: List[tuple[float, int]] = []
+        for idx, tf in enumerate(self.doc_tf):
+            dl_norm = self.k1 * (1 - self.b + self.b * self.doc_len[idx] / avgdl)
+            score = 0.0
+            for term, qf in q_terms.items():
+                f = tf.get(term)
+                if f:
+                    score += qf * idf[term] * f * (self.k1 + 1) / (f + dl_norm)
+            if score > 0:
+                scored.append((score, idx))
+
+        scored.sort(key=lambda x: (-x[0], x[1]))
+        return scored[:top_k]
+
+@timeit_log
+def build_example_index(
+    sample_path: str | Path = SAMPLE_EXAMPLE_PATH,
+    history_pattern: str | None = HISTORY_GLOB,
+) -> HazopExampleIndex:
+    rows = load_sample_rows(sample_path)
+    if history_pattern:
+        rows.extend(load_history_rows(history_pattern))
+    index = HazopExampleIndex(rows)
+    logger.info(f"[FewShot] example index built with {len(index)} rows")
+    return index
+
+# ------------- PROMPT EXAMPLE SELECTOR -----------------------
+class RelevantHazopExampleSelector(BaseExampleSelector):
+    """
+    Picks the few worksheet rows most similar to the current deviation and
+    packs them into a single {reasoning, table} example under a token budget.
+    """
+
+    def __init__(
+        self,
+        index: HazopExampleIndex,
+        *,
+        token_budget: int = 600,
+        max_rows: int = 6,
+    ):
+        self.index = index
+        self.token_budget = token_budget
+        self.max_rows = max_rows
+        self.last_selection: Dict[str, int] = {"rows": 0, "tokens": 0}
+
+    def add_example(self, example: Dict[str, str]) -> None:
+        for line in str(example.get("table", "")).splitlines():
+            parts = [p.strip() for p in line.split(",")]
+            if len(parts) >= 22:
+                self.index.add_row(parts)
+
+    def _query(self, input_variables: Dict[str, str]) -> str:
+        parameter = input_variables.get("parameter", "")
+        guide_word = input_variables.get("guide_word", "")
+        # guide word / parameter dominate; context only breaks ties
+        return " ".join([
+            parameter, parameter, parameter,
+            guide_word, guide_word, guide_word,
+            input_variables.get("context", ""),
+        ])
+
+    def select_examples(self, input_variables: Dict[str, str]) -> List[dict]:
+        hits = self.index.search(self._query(input_variables), top_k=self.max_rows * 5)
+        if not hits:
+            # nothing similar: fall back to the static sample rows, indexed first
+            hits = [(0.0, idx) for idx in range(min(len(self.index), self.max_rows * 5))]
+
+        table_rows: List[str] = []
+        used_tokens = 0
+        seen_causes = set()
+        for _, idx in hits:
+            row = self.index.rows[idx]
+            cause = row[4].lower()
+            if cause in seen_causes:
+                continue
+            line = ",".join(row[:22])
+            cost = estimate_tokens(line)
+            if table_rows and used_tokens + cost > self.token_budget:
+                break
+            seen_causes.add(cause)
+            table_rows.append(line)
+            used_tokens += cost
+            if len(table_rows) >= self.max_rows:
+                break
+
+        self.last_selection = {"rows": len(table_rows), "tokens": used_tokens}
+        if not table_rows:
+            return []
+
+        parameter = input_variables.get("parameter", "")
+        guide_word = input_variables.get("guide_word", "")
+        return [{
+            "reasoning": (
+                f"Reference rows from accepted worksheets closest to a {guide_word} {parameter} deviation. "
+                "They show the expected format and risk scoring only; causes must still follow the checklist."
+            ),
+            "table": "\n".join(table_rows),
+        }]
@@ -0,0 +1,330 @@
+import re
+from collections import defaultdict
+from itertools import islice
+from typing import Any, Dict, Iterable, List, TypedDict
+
+from module.schema_json import PIDResponse
+from decorators import logger, timeit_log
+
+def unwrap_pid_data(pid_data: Any) -> dict:
+    """
+    Accept every P&ID shape used in this repo and return the bare PIDResponse dict:
+    - PIDResponse model
+    - old style OpenAI wrapper {"choices": [{"message": {"parsed": ...}}]}
+    - file wrapper {"pid_data": ..., "metadata": ...}
+    - bare P&ID JSON
+    """
+    if isinstance(pid_data, PIDResponse):
+        return pid_data.model_dump(by_alias=True)
+    if not isinstance(pid_data, dict):
+        return {}
+    if "choices" in pid_data:
+        return pid_data["choices"][0]["message"]["parsed"]
+    if "pid_data" in pid_data and isinstance(pid_data["pid_data"], dict):
+        return pid_data["pid_data"]
+    return pid_data
+
+def _take(items: Iterable[str], cap: int) -> List[str]:
+    # bounded slice so hub nodes (headers, shared analyzers) stay O(cap) per line
+    return list(islice(items, cap))
+
+class LineContext(TypedDict):
+    upstream_lines: List[str]
+    downstream_lines: List[str]
+    parallel_lines: List[str]
+    upstream_equipment: List[str]
+    downstream_equipment: List[str]
+    shared_instruments: Dict[str, List[str]]
+    shared_valves: Dict[str, List[str]]
+
+# ------------- GRAPH INDEX -----------------------------------
+class PIDGraph:
+    """
+    Directed multigraph of a P&ID: nodes are equipment / boundary ids, edges are
+    connections (line_id). All lookups are dict based, so neighbourhood queries
+    are O(1) per line after the one-off build.
+    """
+
+    def __init__(self, pid_data: Any, *, max_neighbors: int = 8):
+        parsed = unwrap_pid_data(pid_data)
+        self.max_neighbors = max_neighbors
+        self.process_description: str = parsed.get("process_description", "")
+
+        self.equipment_by_id: Dict[str, dict] = {e["id"]: e for e in parsed.get("equipment", []) if e.get("id")}
+        self.valves_by_id: Dict[str, dict] = {v["id"]: v for v in parsed.get("valves", []) if v.get("id")}
+        self.instruments_by_id: Dict[str, dict] = {i["id"]: i for i in parsed.get("instruments", []) if i.get("id")}
+
+        self.lines: Dict[str, dict] = {}
+        self.out_lines: Dict[str, List[str]] = defaultdict(list)
+        self.in_lines: Dict[str, List[str]] = defaultdict(list)
+        self.instrument_lines: Dict[str, List[str]] = defaultdict(list)
+        self.valve_lines: Dict[str, List[str]] = defaultdict(list)
+
+        for conn in parsed.get("connections", []):
+            line_id = conn.get("line_id")
+            if not line_id:
+                continue
+            if line_id in self.lines:
+                logger.warning(f"[PIDGraph] duplicate line_id {line_id}, keeping first")
+                continue
+            self.lines[line_id] = conn
+            if conn.get("from_id"):
+                self.out_lines[conn["from_id"]].append(line_id)
+            if conn.get("to_id"):
+                self.in_lines[conn["to_id"]].append(line_id)
+            for inst in conn.get("instruments", []) or []:
+                self.instrument_lines[inst].append(line_id)
+            for valve in conn.get("valves", []) or []:
+                self.valve_lines[valve].append(line_id)
+
+        self._context: Dict[str, LineContext] = {
+            line_id: self._build_line_context(line_id) for line_id in self.lines
+        }
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def __contains__(self, line_id: str) -> bool:
+        return line_id in self.lines
+
+    # --- node / line lookups ---
+    def node_lines(self, node_id: str) -> Dict[str, List[str]]:
+        return {
+            "in": list(self.in_lines.get(node_id, [])),
+            "out": list(self.out_lines.get(node_id, [])),
+        }
+
+    def node_label(self, line_id: str) -> str:
+        conn = self.lines[line_id]
+        from_id, to_id = conn.get("from_id"), conn.get("to_id")
+        return f"{from_id} → {to_id}" if from_id and to_id else (from_id or to_id or "")
+
+    def is_equipment(self, node_id: str | None) -> bool:
+        return bool(node_id) and node_id in self.equipment_by_id
+
+    def upstream(self, line_id: str) -> List[str]:
+        return self._context[line_id]["upstream_lines"]
+
+    def downstream(self, line_id: str) -> List[str]:
+        return self._context[line_id]["downstream_lines"]
+
+    def line_context(self, line_id: str) -> LineContext:
+        return self._context[line_id]
+
+    # --- precompute ---
+    def _build_line_context(self, line_id: str) -> LineContext:
+        conn = self.lines[line_id]
+        from_id, to_id = conn.get("from_id"), conn.get("to_id")
+        cap = self.max_neighbors
+
+        upstream_lines = _take((l for l in self.in_lines.get(from_id, []) if l != line_id), cap)
+        downstream_lines = _take((l for l in self.out_lines.get(to_id, []) if l != line_id), cap)
+        parallel_lines = _take((
+            l for l in self.out_lines.get(from_id, [])
+            if l != line_id and self.lines[l].get("to_id") != to_id
+        ), cap)
+
+        upstream_equipment: List[str] = []
+        if self.is_equipment(from_id):
+            upstream_equipment.append(from_id)
+        for l in upstream_lines:
+            src = self.lines[l].get("from_id")
+            if self.is_equipment(src) and src not in upstream_equipment:
+                upstream_equipment.append(src)
+
+        downstream_equipment: List[str] = []
+        if self.is_equipment(to_id):
+            downstream_equipment.append(to_id)
+        for l in downstream_lines:
+            dst = self.lines[l].get("to_id")
+            if self.is_equipment(dst) and dst not in downstream_equipment:
+                downstream_equipment.append(dst)
+
+        shared_instruments = {
+            inst: _take((l for l in self.instrument_lines[inst] if l != line_id), cap)
+            for inst in conn.get("instruments", []) or []
+            if len(self.instrument_lines[inst]) > 1
+        }
+        shared_valves = {
+            valve: _take((l for l in self.valve_lines[valve] if l != line_id), cap)
+            for valve in conn.get("valves", []) or []
+            if len(self.valve_lines[valve]) > 1
+        }
+
+        return {
+            "upstream_lines": upstream_lines,
+            "downstream_lines": downstream_lines,
+            "parallel_lines": parallel_lines,
+            "upstream_equipment": upstream_equipment[:cap],
+            "downstream_equipment": downstream_equipment[:cap],
+            "shared_instruments": shared_instruments,
+            "shared_valves": shared_valves,
+        }
+
+    # --- prompt rendering ---
+    def _describe_equipment(self, node_id: str) -> str:
+        eq = self.equipment_by_id.get(node_id)
+        return f"{node_id} ({eq.get('type')})" if eq and eq.get("type") else node_id
+
+    def describe_neighborhood(self, line_id: str) -> str:
+        ctx = self._context[line_id]
+        parts: List[str] = []
+
+        if ctx["upstream_lines"]:
+            parts.append("Upstream lines: " + "; ".join(
+                f"{l} ({self.node_label(l)})" for l in ctx["upstream_lines"]
+            ))
+        if ctx["downstream_lines"]:
+            parts.append("Downstream lines: " + "; ".join(
+                f"{l} ({self.node_label(l)})" for l in ctx["downstream_lines"]
+            ))
+        if ctx["parallel_lines"]:
+            parts.append("Lines sharing the same source: " + ", ".join(ctx["parallel_lines"]))
+        if ctx["upstream_equipment"]:
+            parts.append("Upstream equipment: " + ", ".join(
+                self._describe_equipment(e) for e in ctx["upstream_equipment"]
+            ))
+        if ctx["downstream_equipment"]:
+            parts.append("Downstream equipment: " + ", ".join(
+                self._describe_equipment(e) for e in ctx["downstream_equipment"]
+            ))
+        if ctx["shared_instruments"]:
+            parts.append("Shared instruments: " + "; ".join(
+                f"{inst} ({self.instruments_by_id.get(inst, {}).get('function', 'instrument')}; also on {', '.join(lines)})"
+                for inst, lines in ctx["shared_instruments"].items()
+            ))
+        if ctx["shared_valves"]:
+            parts.append("Shared valves: " + "; ".join(
+                f"{valve} (also on {', '.join(lines)})"
+                for valve, lines in ctx["shared_valves"].items()
+            ))
+
+        return " | ".join(parts) if parts else "N/A"
+
+def build_pid_graph(pid_data: Any) -> PIDGraph:
+    graph = PIDGraph(pid_data)
+    logger.info(
+        f"[PIDGraph] {len(graph)} lines, {len(graph.equipment_by_id)} equipment, "
+        f"{len(graph.instruments_by_id)} instruments"
+    )
+    return graph
+
+# ------------- STUDY NODE PARTITION --------------------------
+_PHASE_RE = re.compile(r"\((Phase-\d+)\)", re.IGNORECASE)
+
+class StudyNode(TypedDict):
+    node_id: str
+    line_ids: List[str]
+    node: str
+    phase: str | None
+    valves: List[str]
+    instruments: List[str]
+    context: str
+
+def line_phase(conn: dict) -> str | None:
+    m = _PHASE_RE.search(conn.get("context") or "")
+    return m.group(1).title() if m else None
+
+class _UnionFind:
+    def __init__(self, items: Iterable[str]):
+        self.parent = {i: i for i in items}
+
+    def find(self, x: str) -> str:
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a: str, b: str) -> None:
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[rb] = ra
+
+def _endpoint_kind(graph: PIDGraph, node_id: str | None) -> str:
+    # parallel trains (P-225A / P-225B) share an equipment type; boundaries share a kind
+    eq = graph.equipment_by_id.get(node_id or "")
+    return f"eq:{(eq.get('type') or '').lower()}" if eq else "boundary"
+
+def _components(conn: dict) -> set:
+    return set(conn.get("valves", []) or []) | set(conn.get("instruments", []) or [])
+
+def _merge_bucket(uf: _UnionFind, graph: PIDGraph, line_ids: List[str]) -> None:
+    # union lines of one bucket that share at least one valve or instrument
+    owner: Dict[str, str] = {}
+    for line_id in line_ids:
+        for comp in _components(graph.lines[line_id]):
+            if comp in owner:
+                uf.union(owner[comp], line_id)
+            else:
+                owner[comp] = line_id
+
+@timeit_log
+def partition_study_nodes(graph: PIDGraph, *, max_lines_per_node: int = 6) -> List[StudyNode]:
+    """
+    Group contiguous line segments into HAZOP study nodes. Two lines merge when
+    they are in the same phase, share a valve or instrument and are either
+    - parallel: same source (or same destination) and the other ends are the
+      same kind of equipment, e.g. drum → pump A / drum → pump B, or
+    - in series through a straight-run node (exactly one line in, one out).
+    """
+    uf = _UnionFind(graph.lines)
+
+    # parallel branches, bucketed by (shared endpoint, phase, other-end kind)
+    buckets: Dict[tuple, List[str]] = defaultdict(list)
+    for line_id, conn in graph.lines.items():
+        phase = line_phase(conn)
+        if conn.get("from_id"):
+            buckets[("out", conn["from_id"], phase, _endpoint_kind(graph, conn.get("to_id")))].append(line_id)
+        if conn.get("to_id"):
+            buckets[("in", conn["to_id"], phase, _endpoint_kind(graph, conn.get("from_id")))].append(line_id)
+    for bucket in buckets.values():
+        if len(bucket) > 1:
+            _merge_bucket(uf, graph, bucket)
+
+    # straight runs
+    for node_id, in_ids in graph.in_lines.items():
+        out_ids = graph.out_lines.get(node_id, [])
+        if len(in_ids) == 1 and len(out_ids) == 1:
+            a, b = graph.lines[in_ids[0]], graph.lines[out_ids[0]]
+            if line_phase(a) == line_phase(b) and _components(a) & _components(b):
+                uf.union(in_ids[0], out_ids[0])
+
+    groups: Dict[str, List[str]] = defaultdict(list)
+    for line_id in graph.lines:
+        groups[uf.find(line_id)].append(line_id)
+
+    study_nodes: List[StudyNode] = []
+    for members in groups.values():
+        # keep drawing order; oversized groups are split to bound prompt size
+        for start in range(0, len(members), max_lines_per_node):
+            chunk = members[start:start + max_lines_per_node]
+            study_nodes.append(_build_study_node(graph, f"N{len(study_nodes) + 1}", chunk))
+
+    logger.info(f"[StudyNodes] {len(graph)} lines grouped into {len(study_nodes)} study nodes")
+    return study_nodes
+
+def _unique(items: Iterable[str]) -> List[str]:
+    return list(dict.fromkeys(i for i in items if i))
+
+def _build_study_node(graph: PIDGraph, node_id: str, line_ids: List[str]) -> StudyNode:
+    conns = [graph.lines[l] for l in line_ids]
+
+    if len(conns) == 1:
+        label = graph.node_label(line_ids[0])
+    else:
+        froms = _unique(c.get("from_id") for c in conns)
+        tos = _unique(c.get("to_id") for c in conns)
+        via = [n for n in froms if n in tos]
+        label = f"{' / '.join(n for n in froms if n not in via)} → {' / '.join(n for n in tos if n not in via)}"
+        if via:
+            label += f" (via {', '.join(via)})"
+
+    return {
+        "node_id": node_id,
+        "line_ids": line_ids,
+        "node": label,
+        "phase": line_phase(conns[0]),
+        "valves": _unique(v for c in conns for v in c.get("valves", []) or []),
+        "instruments": _unique(i for c in conns for i in c.get("instruments", []) or []),
+        "context": " | ".join(_unique(f"{c['line_id']}: {c.get('context') or ''}" for c in conns)),
+    }
@@ -1,13 +1,18 @@
-import os, random, time
-from typing import Callable, TypeVar, Tuple, Any, Dict, TypedDict
+import os, random, threading, time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import Callable, TypeVar, Tuple, Any, Dict, List, TypedDict
 
 from dotenv import load_dotenv
 import openai
 from openai import OpenAI
+from pydantic import ValidationError
 from langchain_community.chat_models import ChatOpenAI
 from langchain_community.embeddings import OpenAIEmbeddings
 from langchain.chains import RetrievalQA
 
+from module.trace_module import span
 from decorators import logger, timeit_log
 T = TypeVar("T")
 
@@ -17,12 +22,20 @@ openai_api_key = os.getenv("OPENAI_API_KEY")
 if not openai_api_key:
     raise EnvironmentError("OPENAI_API_KEY not found in .env , please set in .env")
 
+DEFAULT_CHAT_MODEL = "gpt-4.1-2025-04-14"
+
 @timeit_log
 def get_openai_sdk():
     return OpenAI()
 
+@lru_cache(maxsize=1)
+def get_engine_sdk() -> OpenAI:
+    # one pooled client for the deviation hot path; retries are handled by
+    # _call_with_retries, so the SDK's own retry loop is switched off
+    return OpenAI(max_retries=0)
+
 @timeit_log
-def get_chat_model(model_name="gpt-4.1-2025-04-14", temperature=1):
+def get_chat_model(model_name=DEFAULT_CHAT_MODEL, temperature=1):
     return ChatOpenAI(model=model_name, 
                       temperature=temperature, 
                       api_key=openai_api_key,
@@ -52,6 +65,8 @@ class LLMUsageMeta(TypedDict, total=False):
     reasoning_effort: str
     verbosity: str
     latency_s: float
+    tiles: List[Dict[str, Any]]
+    preprocess: Dict[str, Any]
 
 def build_llm_metadata(resp: Any, latency_s: float) -> Dict[str, Any]:
     usage_obj = getattr(resp, "usage", None)
@@ -100,12 +115,22 @@ def build_llm_metadata(resp: Any, latency_s: float) -> Dict[str, Any]:
         "latency_s": round(latency_s, 4),
     }
 
+class InvalidOutputError(ValueError):
+    """A paid call whose reply failed schema validation or was refused; `raw` is what came back."""
+
+    def __init__(self, message: str, raw: str = ""):
+        super().__init__(message)
+        self.raw = raw
+
 def _is_retryable_error(e: Exception) -> bool:
     """
     Decide whether an exception is worth retrying.
     - Timeouts, connection errors, rate limits, 5xx -> retry
+    - invalid / refused structured output -> retry (sampling may succeed)
     - BadRequestError (invalid request / schema) -> usually NOT retryable
     """
+    if isinstance(e, InvalidOutputError):
+        return True
     if isinstance(e, openai.BadRequestError):
         return False
 
@@ -133,7 +158,8 @@ def _call_with_retries(
 
     for attempt in range(1, max_retries + 1):
         try:
-            return func()
+            with span("llm_attempt", context=context or "call", attempt=attempt):
+                return func()
         except Exception as e:
             elapsed = time.perf_counter() - start_all
 
@@ -173,3 +199,250 @@ def _call_with_retries(
             )
             time.sleep(delay)
     raise RuntimeError(f"{context or 'call'}: retry loop exited unexpectedly")
+
+# ------------- HEDGED REQUESTS ------------------------------
+class HedgeStats(TypedDict):
+    calls: int
+    hedged: int
+    hedge_wins: int
+    hedge_rate: float
+    budget_skips: int
+    saved_s: float
+    extra_tokens: int
+    threshold_s: float | None
+
+class HedgePolicy:
+    """
+    Tail-latency hedging for idempotent LLM calls: a call still running after
+    the `percentile` latency of the last `window` calls gets a duplicate, and
+    the first reply wins. At most `max_hedge_ratio` of all calls are hedged.
+
+    A started HTTP request cannot be cancelled from the sync SDK, so the
+    loser is abandoned; its tokens are still billed and counted in
+    extra_tokens, and when the hedge wins, the time until the primary would
+    have answered is counted in saved_s.
+    """
+
+    def __init__(
+        self,
+        *,
+        percentile: float = 0.9,
+        window: int = 50,
+        min_samples: int = 8,
+        min_delay_s: float = 2.0,
+        max_hedge_ratio: float = 0.1,
+        max_workers: int = 8,
+    ):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay_s = min_delay_s
+        self.max_hedge_ratio = max_hedge_ratio
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self._calls = self._hedged = self._hedge_wins = self._budget_skips = 0
+        self._saved_s = 0.0
+        self._extra_tokens = 0
+
+    def threshold_s(self) -> float | None:
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return max(self.min_delay_s, ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))])
+
+    def run(self, func: Callable[[], T], context: str = "") -> T:
+        start = time.perf_counter()
+        threshold = self.threshold_s()
+        with self._lock:
+            self._calls += 1
+        if threshold is None:
+            # still learning the latency profile
+            return self._record(func(), start)
+
+        primary = self._pool.submit(func)
+        if wait([primary], timeout=threshold).done:
+            return self._record(primary.result(), start)
+
+        with self._lock:
+            allowed = self._hedged < self.max_hedge_ratio * self._calls
+            if allowed:
+                self._hedged += 1
+            else:
+                self._budget_skips += 1
+        if not allowed:
+            return self._record(primary.result(), start)
+
+        logger.info("[%s] no reply after %.2fs, sending hedge request", context or "call", threshold)
+        hedge = self._pool.submit(func)
+        winner, error, pending = None, None, {primary, hedge}
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    winner = fut
+                    break
+                error = error or fut.exception()
+        if winner is None:
+            raise error
+
+        won_at = time.perf_counter()
+        hedge_won = winner is hedge
+        loser = primary if hedge_won else hedge
+        if hedge_won:
+            with self._lock:
+                self._hedge_wins += 1
+        if not loser.cancel():
+            loser.add_done_callback(lambda f: self._settle_loser(f, won_at, hedge_won))
+        return self._record(winner.result(), start)
+
+    def stats(self) -> HedgeStats:
+        threshold = self.threshold_s()
+        with self._lock:
+            return {
+                "calls": self._calls,
+                "hedged": self._hedged,
+                "hedge_wins": self._hedge_wins,
+                "hedge_rate": round(self._hedged / self._calls, 4) if self._calls else 0.0,
+                "budget_skips": self._budget_skips,
+                "saved_s": round(self._saved_s, 3),
+                "extra_tokens": self._extra_tokens,
+                "threshold_s": round(threshold, 3) if threshold is not None else None,
+            }
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _record(self, result: T, start: float) -> T:
+        with self._lock:
+            self._latencies.append(time.perf_counter() - start)
+        return result
+
+    def _settle_loser(self, fut: Future, won_at: float, hedge_won: bool) -> None:
+        if fut.cancelled() or fut.exception() is not None:
+            return
+        usage = getattr(fut.result(), "usage", None)
+        with self._lock:
+            self._extra_tokens += int(getattr(usage, "total_tokens", 0) or 0)
+            if hedge_won:
+                self._saved_s += time.perf_counter() - won_at
+
+# ------------- DEVIATION CALL ENGINE ------------------------
+class ChatCallResult(TypedDict):
+    text: str
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    latency_s: float
+
+def call_chat_completion(
+    prompt: str,
+    *,
+    model: str = DEFAULT_CHAT_MODEL,
+    temperature: float = 1,
+    timeout_s: float = 180.0,
+    max_retries: int = 3,
+    max_total_s: float = 600.0,
+    context: str = "",
+    client: OpenAI | None = None,
+    hedge: HedgePolicy | None = None,
+) -> ChatCallResult:
+    """
+    Single-message chat completion on the OpenAI SDK: same prompt text the
+    LangChain chain sends, explicit per-request timeout, the shared retry
+    policy and usage read straight from the response. With `hedge`, each
+    attempt goes through the hedging policy.
+    """
+    client = client or get_engine_sdk()
+
+    def _create():
+        return client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            timeout=timeout_s,
+        )
+
+    start_t = time.perf_counter()
+    with span("llm_call", model=model, context=context or "chat") as s:
+        resp = _call_with_retries(
+            (lambda: hedge.run(_create, context or "chat")) if hedge else _create,
+            max_retries=max_retries,
+            max_total_s=max_total_s,
+            context=context or "chat",
+        )
+        s.set(total_tokens=resp.usage.total_tokens if resp.usage else 0)
+    latency_s = time.perf_counter() - start_t
+
+    usage = resp.usage
+    return {
+        "text": resp.choices[0].message.content or "",
+        "model": resp.model or model,
+        "prompt_tokens": usage.prompt_tokens if usage else 0,
+        "completion_tokens": usage.completion_tokens if usage else 0,
+        "total_tokens": usage.total_tokens if usage else 0,
+        "latency_s": round(latency_s, 4),
+    }
+
+class StructuredCallResult(ChatCallResult):
+    parsed: Any
+
+def call_structured_completion(
+    prompt: str,
+    text_format: type,
+    *,
+    model: str = DEFAULT_CHAT_MODEL,
+    temperature: float = 1,
+    timeout_s: float = 180.0,
+    max_retries: int = 3,
+    max_total_s: float = 600.0,
+    context: str = "",
+    client: OpenAI | None = None,
+    hedge: HedgePolicy | None = None,
+) -> StructuredCallResult:
+    """
+    Schema-constrained call through the Responses API (same mechanism as the
+    P&ID extractor): the reply is validated against `text_format`, so a paid
+    call either yields a parsed object or raises. A reply that fails
+    validation, is truncated or refused is retried like a transport error
+    and finally raised as InvalidOutputError.
+    """
+    client = client or get_engine_sdk()
+
+    def _parse():
+        try:
+            resp = client.responses.parse(
+                model=model,
+                input=prompt,
+                text_format=text_format,
+                temperature=temperature,
+                timeout=timeout_s,
+            )
+        except (ValidationError, openai.LengthFinishReasonError, openai.ContentFilterFinishReasonError) as e:
+            raise InvalidOutputError(f"invalid structured output: {type(e).__name__}: {e}", raw=str(e)) from e
+        if resp.output_parsed is None:
+            raise InvalidOutputError("model returned no parsed output (refusal or empty)", raw=resp.output_text or "")
+        return resp
+
+    start_t = time.perf_counter()
+    with span("llm_call", model=model, context=context or "structured"):
+        resp = _call_with_retries(
+            (lambda: hedge.run(_parse, context or "structured")) if hedge else _parse,
+            max_retries=max_retries,
+            max_total_s=max_total_s,
+            context=context or "structured",
+        )
+    latency_s = time.perf_counter() - start_t
+
+    parsed = resp.output_parsed
+    meta = build_llm_metadata(resp, latency_s)
+    return {
+        "text": parsed.model_dump_json(),
+        "model": meta["model"] or model,
+        "prompt_tokens": meta["tokens"]["prompt"] or 0,
+        "completion_tokens": meta["tokens"]["completion"] or 0,
+        "total_tokens": meta["tokens"]["total"] or 0,
+        "latency_s": meta["latency_s"],
+        "parsed": parsed,
+    }
@@ -0,0 +1,198 @@
+from typing import Dict, List, TypedDict
+
+from module.fewshot_module import estimate_tokens
+from decorators import logger
+
+HAZOP_GUIDE_WORDS = [
+    "No", "More", "Less", "As well as", "Part of", "Reverse",
+    "Other than", "Early", "Late", "Before", "After", "No/Low"
+]
+
+HAZOP_PARAMETERS = [
+    "Flow", "Pressure", "Temperature", "Level", "Composition",
+    "Phase", "Utility", "Power", "Instrument", "Human Action",
+    "Maintenance", "Operation Timing", "Concentration"
+]
+
+# one worksheet row per cause for every deviation (role_and_rules_2)
+HAZOP_CAUSE_CHECKLIST = [
+    "Pressure instrument failure (gauge; transmitter; sensor)",
+    "Temperature instrument failure (thermometer; transmitter; sensor)",
+    "Level instrument failure (indicator; transmitter; sensor)",
+    "Flow instrument failure (meter; sensor; transmitter)",
+    "Incorrect instrument calibration or setpoint",
+    "Control valve malfunction (stuck; leakage; actuator failure)",
+    "Incorrect valve selection or specification",
+    "Proportional/regulating valve malfunction",
+    "Pneumatic valve failure or loss of actuator signal",
+    "Vent valve malfunction (fails closed/open during transfer or discharge)",
+    "Pipeline leakage (joint failure; crack; corrosion; gasket)",
+    "Pipeline blockage or obstruction (fouling; deposits; freezing; solids)",
+    "Incorrect installation or poor layout of piping/equipment",
+    "Vessel leakage or rupture (design or fatigue failure)",
+    "Pump mechanical failure (seal; impeller; shaft; cavitation)",
+    "Compressor or fan mechanical failure (motor; bearing; impeller)",
+    "Vacuum pump failure (cannot achieve required vacuum)",
+    "Refrigerant/utility line rupture or internal leak",
+    "Cylinder rupture or containment breach",
+    "Drain hole blockage or inadequate drainage",
+    "Equipment overheating (heater runaway; thermal stress)",
+    "Abnormal wear/erosion leading to loss of containment",
+    "Abnormal utility supply pressure (too high or too low)",
+    "Abnormal cryogenic source (LN2 evaporation; boil-off; loss of supply)",
+    "Abnormal water supply (insufficient cooling or cleaning water)",
+    "Abnormal gas supply (N₂; compressed air; other utility failure)",
+    "Power failure (loss of electricity to motors; fans; instruments)",
+    "Cooling system failure (no circulation; fouling; exchanger blocked)",
+    "Heating system failure (heater not starting or insufficient duty)",
+    "Heating system uncontrolled (heater operating without cutoff)",
+    "Utility connection leakage (joints; hoses; couplings)",
+    "Pressure regulator malfunction (failure of PRV or regulator valve)",
+    "Upstream overpressure (abnormal feed source pressure)",
+    "Downstream restriction (blockage; closed valve; isolation)",
+    "Reverse flow due to pressure imbalance or check valve failure",
+    "Reaction runaway / abnormal process temperature rise",
+    "Abnormal mixing ratio (incorrect blending; poor agitation)",
+    "Incorrect feed ratio or dosage deviation",
+    "Abnormal circulation imbalance (inlet > outlet; unequal flows)",
+    "Vessel operating empty or insufficient level (dry running)",
+    "Vessel operating overfilled (high level)",
+    "Internal decomposition of process medium (gas release; thermal breakdown)",
+    "Ambient high temperature (external fire; hot weather)",
+    "Ambient low temperature (cold weather; freezing)",
+    "External mechanical impact or vibration",
+    "Abnormal source contamination (impurities; off-spec feed)",
+    "Human error in operation (wrong valve; wrong sequence)",
+    "Incorrect operating sequence (early or late action)",
+    "Insufficient operating time (too short cycle; premature termination)",
+    "Excessive operating time (too long cycle, delayed termination)",
+]
+
+def format_cause_checklist(indexes: List[int] | None = None, indent: str = "") -> str:
+    # numbering always follows the full checklist, also for a subset
+    indexes = range(len(HAZOP_CAUSE_CHECKLIST)) if indexes is None else indexes
+    return "\n".join(f"{indent}{i + 1}.{HAZOP_CAUSE_CHECKLIST[i]}" for i in indexes)
+
+# medians of the gpt-4.1 runs in static/hazop/*/token_log.csv
+DEFAULT_COMPLETION_TOKENS = 4300
+DEFAULT_SECONDS_PER_CALL = 55.0
+
+class PlanItem(TypedDict):
+    line_id: str
+    parameter: str
+    guide_word: str
+    prompt_tokens: int
+
+class SkippedSelection(TypedDict):
+    selection: Dict[str, str]
+    reason: str
+
+class HazopPlan(TypedDict):
+    items: List[PlanItem]
+    skipped: List[SkippedSelection]
+    duplicates: int
+    estimated_prompt_tokens: int
+    estimated_completion_tokens: int
+    estimated_total_tokens: int
+    estimated_seconds: float
+
+def index_query_infos(query_infos: List[dict]) -> Dict[str, dict]:
+    info_by_line: Dict[str, dict] = {info["line_id"]: info for info in query_infos}
+    # line_id selections still resolve when grouped, onto their study node
+    for info in query_infos:
+        for member in info.get("line_ids", []):
+            info_by_line.setdefault(member, info)
+    return info_by_line
+
+def _info_tokens(info: dict) -> int:
+    text = " ".join(
+        str(info.get(k, "")) for k in ("line_label", "node", "valves", "instruments", "context", "neighborhood")
+    )
+    return estimate_tokens(text)
+
+def plan_selections(
+    selections: List[Dict[str, str]],
+    query_infos: List[dict],
+    *,
+    base_prompt_tokens: int = 0,
+    example_tokens: int = 0,
+    completion_tokens_per_call: int = DEFAULT_COMPLETION_TOKENS,
+    seconds_per_call: float = DEFAULT_SECONDS_PER_CALL,
+    concurrency: int = 1,
+) -> HazopPlan:
+    """
+    Validate, deduplicate and order selections before any LLM call.
+
+    Items are grouped by line (in drawing order), then guide word, then
+    parameter -- the order these fields appear in the prompt -- so consecutive
+    prompts of a line share the rules + line data prefix, which the
+    provider's prompt cache can reuse.
+    """
+    info_by_line = index_query_infos(query_infos)
+    line_rank = {info["line_id"]: i for i, info in enumerate(query_infos)}
+    param_rank = {p: i for i, p in enumerate(HAZOP_PARAMETERS)}
+    gw_rank = {g: i for i, g in enumerate(HAZOP_GUIDE_WORDS)}
+
+    skipped: List[SkippedSelection] = []
+    seen = set()
+    duplicates = 0
+    items: List[PlanItem] = []
+
+    for sel in selections:
+        line_id = (sel.get("line_id") or "").strip()
+        param = (sel.get("parameter") or "").strip()
+        guide_word = (sel.get("guide_word") or "").strip()
+
+        if not line_id or not param or not guide_word:
+            skipped.append({"selection": sel, "reason": "missing line_id, parameter or guide_word"})
+            continue
+        if param not in param_rank:
+            skipped.append({"selection": sel, "reason": f"unknown parameter '{param}'"})
+            continue
+        if guide_word not in gw_rank:
+            skipped.append({"selection": sel, "reason": f"unknown guide word '{guide_word}'"})
+            continue
+
+        info = info_by_line.get(line_id)
+        if not info:
+            skipped.append({"selection": sel, "reason": f"line_id {line_id} not found in pid_data"})
+            continue
+
+        key = (info["line_id"], param, guide_word)
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+
+        items.append({
+            "line_id": info["line_id"],
+            "parameter": param,
+            "guide_word": guide_word,
+            "prompt_tokens": base_prompt_tokens + example_tokens + _info_tokens(info),
+        })
+
+    items.sort(key=lambda it: (
+        line_rank[it["line_id"]],
+        gw_rank[it["guide_word"]],
+        param_rank[it["parameter"]],
+    ))
+
+    prompt_total = sum(it["prompt_tokens"] for it in items)
+    completion_total = completion_tokens_per_call * len(items)
+    plan: HazopPlan = {
+        "items": items,
+        "skipped": skipped,
+        "duplicates": duplicates,
+        "estimated_prompt_tokens": prompt_total,
+        "estimated_completion_tokens": completion_total,
+        "estimated_total_tokens": prompt_total + completion_total,
+        "estimated_seconds": round(seconds_per_call * len(items) / max(1, concurrency), 1),
+    }
+
+    for s in skipped:
+        logger.warning(f"[Plan] skip {s['selection']}: {s['reason']}")
+    logger.info(
+        f"[Plan] {len(items)} deviations ({duplicates} duplicates, {len(skipped)} skipped), "
+        f"~{plan['estimated_total_tokens']} tokens, ~{plan['estimated_seconds']}s"
+    )
+    return plan
@@ -0,0 +1,264 @@
+import io, math, time
+from pathlib import Path
+from typing import Any, List, Mapping, Tuple, TypedDict
+
+from module.tile_module import UploadSource, source_name
+from decorators import logger, timeit_log
+
+class PreprocessOptions(TypedDict, total=False):
+    dpi: int           # rasterize PDF pages / resample scans to this DPI (0 = keep vector PDF as is)
+    max_side: int      # downscale rasters whose longest side is larger (px, 0 = off)
+    grayscale: bool
+    threshold: int     # 1-254 binarizes after grayscale (0 = off)
+    crop: bool         # trim the blank border around the drawing
+    crop_margin: int   # px of border kept around the content
+    format: str        # "png" | "jpeg"
+
+# binarized 150 dpi, capped at the 2048 px the provider keeps in high detail:
+# h2o2.pdf 108 KB -> 23 KB (gray PNG at the same size grows it to 193 KB)
+DEFAULT_PREPROCESS: PreprocessOptions = {
+    "dpi": 150,
+    "max_side": 2048,
+    "grayscale": True,
+    "threshold": 200,
+    "crop": True,
+    "crop_margin": 16,
+    "format": "png",
+}
+
+# pixels lighter than this count as paper when cropping
+_BLANK_LEVEL = 245
+# the provider rasterizes uploaded PDF pages itself at an unknown resolution;
+# past 2048 px only the page aspect matters for the estimate
+_PROVIDER_PDF_DPI = 300
+
+class PreprocessFileReport(TypedDict):
+    source: str
+    outputs: List[str]
+    steps: List[str]
+    bytes_before: int
+    bytes_after: int
+    pixels_before: List[Tuple[int, int]]
+    pixels_after: List[Tuple[int, int]]
+    est_image_tokens_before: int
+    est_image_tokens_after: int
+
+class PreprocessReport(TypedDict):
+    options: PreprocessOptions
+    files: List[PreprocessFileReport]
+    bytes_before: int
+    bytes_after: int
+    est_image_tokens_before: int
+    est_image_tokens_after: int
+    latency_s: float
+
+def _pil():
+    try:
+        from PIL import Image
+    except ImportError as e:
+        raise ImportError("Drawing preprocessing requires 'pillow' (pip install pillow)") from e
+    return Image
+
+def _pymupdf():
+    try:
+        import pymupdf
+    except ImportError as e:
+        raise ImportError("Rasterizing PDFs requires 'pymupdf' (pip install pymupdf)") from e
+    return pymupdf
+
+# ------------- OPTIONS ---------------------------------------
+def _as_bool(v: Any) -> bool:
+    return str(v).strip().lower() in ("1", "true", "yes", "on")
+
+def preprocess_options_from_form(form: Mapping[str, Any]) -> PreprocessOptions | None:
+    """
+    Per-request settings: preprocess=1 enables DEFAULT_PREPROCESS, any of
+    dpi / max_side / grayscale / threshold / crop / crop_margin / format override it.
+    """
+    if not _as_bool(form.get("preprocess", "")):
+        return None
+    opts: PreprocessOptions = dict(DEFAULT_PREPROCESS)
+    for key in ("dpi", "max_side", "threshold", "crop_margin"):
+        if str(form.get(key, "")).strip():
+            opts[key] = max(0, int(form[key]))
+    for key in ("grayscale", "crop"):
+        if str(form.get(key, "")).strip():
+            opts[key] = _as_bool(form[key])
+    fmt = str(form.get("format", "")).strip().lower()
+    if fmt:
+        if fmt not in ("png", "jpeg"):
+            raise ValueError(f"Unsupported preprocess format: {fmt}")
+        opts["format"] = fmt
+    return opts
+
+# ------------- TOKEN ESTIMATE --------------------------------
+def estimate_image_tokens(width: int, height: int) -> int:
+    """High-detail vision cost: fit in 2048², shortest side to 768, 170 per 512px tile + 85."""
+    if width <= 0 or height <= 0:
+        return 0
+    w, h = float(width), float(height)
+    scale = min(1.0, 2048 / max(w, h))
+    w, h = w * scale, h * scale
+    scale = min(1.0, 768 / min(w, h))
+    w, h = w * scale, h * scale
+    return 85 + 170 * math.ceil(w / 512) * math.ceil(h / 512)
+
+# ------------- PIPELINE --------------------------------------
+def _process_image(img, opts: PreprocessOptions, source_dpi: float | None, steps: List[str]):
+    Image = _pil()
+    target_dpi = opts.get("dpi") or 0
+
+    if img.mode not in ("L", "RGB"):
+        img = img.convert("RGB")
+    if opts.get("grayscale") or opts.get("threshold"):
+        img = img.convert("L")
+        steps.append("grayscale")
+
+    if opts.get("crop"):
+        gray = img if img.mode == "L" else img.convert("L")
+        bbox = gray.point(lambda v: 255 if v < _BLANK_LEVEL else 0).getbbox()
+        if bbox:
+            m = opts.get("crop_margin", 0)
+            bbox = (max(0, bbox[0] - m), max(0, bbox[1] - m), min(img.width, bbox[2] + m), min(img.height, bbox[3] + m))
+            if bbox != (0, 0, img.width, img.height):
+                img = img.crop(bbox)
+                steps.append("crop")
+
+    scale = 1.0
+    if source_dpi and target_dpi and source_dpi > target_dpi:
+        scale = target_dpi / source_dpi
+    max_side = opts.get("max_side") or 0
+    if max_side and max(img.size) * scale > max_side:
+        scale = max_side / max(img.size)
+    if scale < 1.0:
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+        steps.append(f"resize x{scale:.2f}")
+
+    threshold = opts.get("threshold") or 0
+    if threshold:
+        img = img.point(lambda v: 255 if v >= threshold else 0).convert("1", dither=Image.Dither.NONE)
+        steps.append(f"threshold {threshold}")
+    return img
+
+def _encode(img, fmt: str) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "jpeg":
+        img = img.convert("L") if img.mode == "1" else img
+        img.save(buf, format="JPEG", quality=85, optimize=True)
+    else:
+        img.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+def _read_bytes(source: UploadSource) -> bytes:
+    if isinstance(source, tuple):
+        stream = source[1]
+        stream.seek(0)
+        return stream.read()
+    return Path(source).read_bytes()
+
+def _passthrough_report(name: Path, raw: bytes, pixels: List[Tuple[int, int]], step: str) -> PreprocessFileReport:
+    tokens = sum(estimate_image_tokens(*p) for p in pixels)
+    return {
+        "source": str(name), "outputs": [str(name)], "steps": [step],
+        "bytes_before": len(raw), "bytes_after": len(raw),
+        "pixels_before": pixels, "pixels_after": pixels,
+        "est_image_tokens_before": tokens, "est_image_tokens_after": tokens,
+    }
+
+def _preprocess_one(source: UploadSource, opts: PreprocessOptions) -> Tuple[List[UploadSource], PreprocessFileReport]:
+    Image = _pil()
+    name = Path(source_name(source))
+    raw = _read_bytes(source)
+    fmt = opts.get("format", "png")
+    ext = ".jpg" if fmt == "jpeg" else ".png"
+    steps: List[str] = []
+    pixels_before: List[Tuple[int, int]] = []
+    images = []
+
+    if name.suffix.lower() == ".pdf":
+        dpi = opts.get("dpi") or 0
+        pymupdf = _pymupdf()
+        doc = pymupdf.open(stream=raw, filetype="pdf")
+        try:
+            for page in doc:
+                zoom = _PROVIDER_PDF_DPI / 72
+                pixels_before.append((round(page.rect.width * zoom), round(page.rect.height * zoom)))
+                if not dpi:
+                    continue
+                cs = pymupdf.csGRAY if opts.get("grayscale") or opts.get("threshold") else pymupdf.csRGB
+                pix = page.get_pixmap(dpi=dpi, colorspace=cs, alpha=False)
+                mode = "L" if pix.n == 1 else "RGB"
+                images.append((f"{name.stem}_p{page.number + 1}{ext}", Image.frombytes(mode, (pix.width, pix.height), pix.samples), None))
+        finally:
+            doc.close()
+        if dpi:
+            steps.append(f"rasterize {dpi}dpi")
+    else:
+        img = Image.open(io.BytesIO(raw))
+        img.load()
+        pixels_before.append(img.size)
+        source_dpi = (img.info.get("dpi") or (None,))[0]
+        images.append((f"{name.stem}{ext}", img, float(source_dpi) if source_dpi else None))
+
+    if not images:
+        # vector PDF kept as is
+        return [source], _passthrough_report(name, raw, pixels_before, "passthrough")
+
+    outputs = []
+    pixels_after: List[Tuple[int, int]] = []
+    bytes_after = 0
+    for i, (out_name, img, source_dpi) in enumerate(images):
+        img = _process_image(img, opts, source_dpi, steps if i == 0 else [])
+        data = _encode(img, fmt)
+        bytes_after += len(data)
+        pixels_after.append(img.size)
+        outputs.append((out_name, io.BytesIO(data)))
+
+    if name.suffix.lower() == ".pdf" and bytes_after > len(raw):
+        # rasterizing would make the upload bigger: send the vector PDF instead
+        return [source], _passthrough_report(name, raw, pixels_before, f"passthrough (raster {bytes_after} bytes)")
+
+    report = {
+        "source": str(name),
+        "outputs": [o[0] for o in outputs],
+        "steps": steps,
+        "bytes_before": len(raw),
+        "bytes_after": bytes_after,
+        "pixels_before": pixels_before,
+        "pixels_after": pixels_after,
+        "est_image_tokens_before": sum(estimate_image_tokens(*p) for p in pixels_before),
+        "est_image_tokens_after": sum(estimate_image_tokens(*p) for p in pixels_after),
+    }
+    return outputs, report
+
+@timeit_log
+def preprocess_sources(sources: List[UploadSource], options: PreprocessOptions) -> Tuple[List[UploadSource], PreprocessReport]:
+    """
+    Rasterize / clean drawings in memory before upload. Each PDF page becomes
+    one image (the PDF text layer is dropped), outputs are (name, BytesIO)
+    sources ready for _upload_vision_file or split_into_tiles.
+    """
+    start_t = time.perf_counter()
+    opts: PreprocessOptions = {**DEFAULT_PREPROCESS, **options}
+    out: List[UploadSource] = []
+    files: List[PreprocessFileReport] = []
+    for source in sources:
+        processed, report = _preprocess_one(source, opts)
+        out.extend(processed)
+        files.append(report)
+
+    summary: PreprocessReport = {
+        "options": opts,
+        "files": files,
+        "bytes_before": sum(f["bytes_before"] for f in files),
+        "bytes_after": sum(f["bytes_after"] for f in files),
+        "est_image_tokens_before": sum(f["est_image_tokens_before"] for f in files),
+        "est_image_tokens_after": sum(f["est_image_tokens_after"] for f in files),
+        "latency_s": round(time.perf_counter() - start_t, 4),
+    }
+    logger.info(
+        f"[Preprocess] {len(sources)} file(s) -> {len(out)} upload(s): "
+        f"{summary['bytes_before']} -> {summary['bytes_after']} bytes, "
+        f"est. image tokens {summary['est_image_tokens_before']} -> {summary['est_image_tokens_after']}"
+    )
+    return out, summary
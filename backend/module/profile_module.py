@@ -0,0 +1,173 @@
+import cProfile, io, os, pstats, sys, threading, time
+from collections import Counter
+from datetime import datetime
+from typing import Any, List, TypedDict
+
+from decorators import logger
+
+PROFILES_DIR = "profiles"
+PROFILE_SUFFIXES = (".prof", ".txt", ".folded")
+PROFILE_MODES = ("cprofile", "sample")
+
+class ProfileInfo(TypedDict):
+    id: str          # path relative to the static root, used by the download route
+    name: str
+    size: int
+    created: str
+
+def profile_mode(*values: Any) -> str | None:
+    """
+    First truthy value of a header / form field / socket flag:
+    "sample" -> sampling profiler, "1" / "true" / "cprofile" -> cProfile.
+    """
+    for v in values:
+        v = str(v or "").strip().lower()
+        if v == "sample":
+            return "sample"
+        if v in ("1", "true", "yes", "on", "cprofile"):
+            return "cprofile"
+    return None
+
+# ------------- SAMPLER ---------------------------------------
+class _StackSampler(threading.Thread):
+    # cProfile only sees the thread that enabled it; sampling every thread
+    # also covers the upload / tile / hedge thread pools
+    def __init__(self, interval_s: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval_s = interval_s
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_evt = threading.Event()
+
+    def run(self) -> None:
+        names = {}
+        while not self._stop_evt.wait(self.interval_s):
+            self.samples += 1
+            for t in threading.enumerate():
+                names[t.ident] = t.name
+            for tid, frame in sys._current_frames().items():
+                if tid == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(tid, str(tid)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self._stop_evt.set()
+        self.join()
+
+# ------------- PROFILER --------------------------------------
+class Profiler:
+    """
+    Opt-in profile of one request handler or background job, written to
+    <out_dir>/profiles/<label>-<timestamp>.*:
+    - cprofile: .prof (pstats / snakeviz) + .txt top functions by cumulative time
+    - sample:   .folded (flamegraph.pl / speedscope) + .txt hottest stacks
+    """
+
+    def __init__(self, out_dir: str, label: str, mode: str = "cprofile", interval_s: float = 0.005):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode '{mode}' (expected 'cprofile' or 'sample')")
+        self.dir = os.path.join(out_dir, PROFILES_DIR)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")[:-3]
+        safe_label = "".join(c if c.isalnum() or c in "-_" else "_" for c in label)
+        self.base = os.path.join(self.dir, f"{safe_label}-{stamp}")
+        self.mode = mode
+        self.interval_s = interval_s
+        self.files: List[str] = []
+        self._prof: cProfile.Profile | None = None
+        self._sampler: _StackSampler | None = None
+        self._start = 0.0
+
+    def start(self) -> "Profiler":
+        self._start = time.perf_counter()
+        if self.mode == "sample":
+            self._sampler = _StackSampler(self.interval_s)
+            self._sampler.start()
+        else:
+            self._prof = cProfile.Profile()
+            self._prof.enable()
+        return self
+
+    def stop(self) -> List[str]:
+        elapsed = time.perf_counter() - self._start
+        os.makedirs(self.dir, exist_ok=True)
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._write_samples(elapsed)
+        elif self._prof is not None:
+            self._prof.disable()
+            self._write_cprofile(elapsed)
+        logger.info(f"[Profile] {self.mode} {elapsed:.2f}s -> {self.files}")
+        return self.files
+
+    def __enter__(self) -> "Profiler":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _write_cprofile(self, elapsed: float) -> None:
+        self._prof.dump_stats(f"{self.base}.prof")
+        buf = io.StringIO()
+        buf.write(f"wall time {elapsed:.3f}s (thread that started the profile only)\n\n")
+        pstats.Stats(self._prof, stream=buf).sort_stats("cumulative").print_stats(60)
+        with open(f"{self.base}.txt", "w", encoding="utf-8") as f:
+            f.write(buf.getvalue())
+        self.files = [f"{self.base}.prof", f"{self.base}.txt"]
+
+    def _write_samples(self, elapsed: float) -> None:
+        stacks = self._sampler.stacks
+        with open(f"{self.base}.folded", "w", encoding="utf-8") as f:
+            for stack, n in stacks.most_common():
+                f.write(f"{stack} {n}\n")
+        # leaf frames by sample count ≈ where the threads actually spend time
+        leaves: Counter = Counter()
+        for stack, n in stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += n
+        total = sum(stacks.values()) or 1
+        with open(f"{self.base}.txt", "w", encoding="utf-8") as f:
+            f.write(f"wall time {elapsed:.3f}s, {self._sampler.samples} samples every {self.interval_s * 1000:.0f}ms, all threads\n\n")
+            f.write("self samples  share  frame\n")
+            for frame, n in leaves.most_common(40):
+                f.write(f"{n:12d}  {n / total:5.1%}  {frame}\n")
+        self.files = [f"{self.base}.folded", f"{self.base}.txt"]
+
+# ------------- LIST / DOWNLOAD -------------------------------
+def list_profiles(root: str) -> List[ProfileInfo]:
+    out: List[ProfileInfo] = []
+    for dirpath, _, filenames in os.walk(root):
+        if os.path.basename(dirpath) != PROFILES_DIR:
+            continue
+        for name in filenames:
+            if not name.endswith(PROFILE_SUFFIXES):
+                continue
+            path = os.path.join(dirpath, name)
+            st = os.stat(path)
+            out.append({
+                "id": os.path.relpath(path, root).replace(os.sep, "/"),
+                "name": name,
+                "size": st.st_size,
+                "created": datetime.fromtimestamp(st.st_mtime).isoformat(timespec="seconds"),
+            })
+    return sorted(out, key=lambda p: p["created"], reverse=True)
+
+def resolve_profile(root: str, profile_id: str) -> str:
+    """Map a profile id back to a file, refusing anything outside a profiles/ folder under root."""
+    root_abs = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root_abs, profile_id))
+    if (
+        not path.startswith(root_abs + os.sep)
+        or os.path.basename(os.path.dirname(path)) != PROFILES_DIR
+        or not path.endswith(PROFILE_SUFFIXES)
+        or not os.path.isfile(path)
+    ):
+        raise FileNotFoundError(f"Profile not found: {profile_id}")
+    return path
+
+def profile_ids(root: str, files: List[str]) -> List[str]:
+    return [os.path.relpath(f, root).replace(os.sep, "/") for f in files]
@@ -0,0 +1,130 @@
+import threading, time
+from typing import Any, Callable, Dict, List
+
+from decorators import logger
+
+Emit = Callable[..., Any]
+
+class ProgressPublisher:
+    """
+    Coalesces per-deviation progress into time-windowed batches for one client.
+
+    - at most one batch per `interval_s` (configurable rate),
+    - each batch carries the items since the last one plus run counters
+      (done / total / tokens / elapsed / ETA),
+    - per-client backpressure: while the previous batch is unacknowledged,
+      new items keep coalescing instead of queueing more emits; a missing ack
+      is given up on after `ack_timeout_s` so a dead client cannot stall the run,
+    - every item is delivered: a batch carries at most `max_items_per_batch`
+      items and the rest follow in the next batches.
+    """
+
+    def __init__(
+        self,
+        emit: Emit,
+        *,
+        event: str = "hazop_progress",
+        total: int = 0,
+        interval_s: float = 0.5,
+        ack_timeout_s: float = 10.0,
+        max_items_per_batch: int = 200,
+    ):
+        self._emit = emit
+        self.event = event
+        self.total = total
+        self.interval_s = interval_s
+        self.ack_timeout_s = ack_timeout_s
+        self.max_items_per_batch = max_items_per_batch
+
+        self._lock = threading.Lock()
+        self._pending: List[Dict[str, Any]] = []
+        self.done = 0
+        self.tokens = 0
+        self.batches = 0
+        self._started = time.monotonic()
+        self._last_emit = 0.0
+        self._in_flight_since: float | None = None
+        self._timer: threading.Timer | None = None
+
+    # ------------- PUBLIC ------------------------------------
+    def update(self, item: Dict[str, Any], tokens_used: int = 0) -> None:
+        with self._lock:
+            self.done += 1
+            self.tokens += int(tokens_used or 0)
+            self._pending.append(item)
+        self._maybe_flush()
+
+    def flush(self) -> None:
+        """Send everything pending now, regardless of rate and acks (end of run)."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        while self._maybe_flush(force=True):
+            pass
+
+    def counters(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self._started
+        # the plan total is an estimate of updates; never report done > total
+        self.total = max(self.total, self.done)
+        remaining = self.total - self.done
+        eta = round(elapsed / self.done * remaining, 1) if self.done else None
+        return {
+            "done": self.done,
+            "total": self.total,
+            "tokens": self.tokens,
+            "elapsed_s": round(elapsed, 1),
+            "eta_s": eta,
+        }
+
+    # ------------- INTERNALS ---------------------------------
+    def _ack(self, *_args) -> None:
+        with self._lock:
+            self._in_flight_since = None
+        self._maybe_flush()
+
+    def _retry_later(self, delay: float) -> None:
+        # called with the lock held; items held back by rate/backpressure go
+        # out without waiting for the next deviation to finish
+        if self._timer is None:
+            self._timer = threading.Timer(max(0.01, delay), self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+        self._maybe_flush()
+
+    def _maybe_flush(self, force: bool = False) -> bool:
+        """Emit one batch if rate and backpressure allow; True when items are still pending."""
+        with self._lock:
+            now = time.monotonic()
+            if not self._pending and not force:
+                return False
+            if not force:
+                if now - self._last_emit < self.interval_s:
+                    self._retry_later(self.interval_s - (now - self._last_emit))
+                    return True
+                if self._in_flight_since is not None:
+                    if now - self._in_flight_since < self.ack_timeout_s:
+                        self._retry_later(self.ack_timeout_s - (now - self._in_flight_since))
+                        return True
+                    logger.warning(f"[Progress] no ack for {self.ack_timeout_s}s, sending anyway")
+
+            items = self._pending[:self.max_items_per_batch]
+            del self._pending[:self.max_items_per_batch]
+            payload = {**self.counters(), "items": items}
+            if items:
+                # last item stays at top level for single-item consumers
+                payload.update(items[-1])
+            self._last_emit = now
+            self._in_flight_since = now
+            self.batches += 1
+            more = bool(self._pending)
+            if more and not force:
+                # backlog of a slow client: the rest follows after the ack / interval
+                self._retry_later(self.interval_s)
+
+        self._emit(self.event, payload, callback=self._ack)
+        return more
@@ -0,0 +1,177 @@
+import json, re
+from typing import Dict, List, Tuple, TypedDict
+
+from module.compact_module import COMPACT_FIELDS, encode_compact_rows
+from module.fewshot_module import estimate_tokens
+from module.plan_module import HAZOP_CAUSE_CHECKLIST, format_cause_checklist
+from module.schema_json import HAZOP_HEADERS, HazopRow
+
+CAUSE_COL = HAZOP_HEADERS.index("Cause")
+# S/L columns the risk fields are derived from; must be 1-5 integers
+_SL_COLS = [HAZOP_HEADERS.index(c) for c in (
+    "S Before Safeguards", "L Before Safeguards", "S", "L",
+    "S After Recommendation", "L After Recommendation",
+)]
+_WORD_RE = re.compile(r"[a-z0-9₂]+")
+_STOP = {"or", "of", "and", "the", "to", "due", "in", "a", "an", "on", "at", "for", "during"}
+
+class CauseCoverage(TypedDict):
+    rows: List[list]              # valid rows, checklist order, off-checklist rows last
+    causes: List[int]             # checklist index of each matched row (the first len(causes) rows)
+    missing: List[int]            # 0-based checklist indexes with no valid row
+    invalid: int                  # parsed rows rejected by validation
+    unmatched: int                # valid rows whose cause is not on the checklist
+
+# ------------- CAUSE MATCHING --------------------------------
+def _words(text: str) -> set:
+    return {w for w in _WORD_RE.findall(str(text).lower()) if w not in _STOP}
+
+def _head(cause: str) -> str:
+    # "Pump mechanical failure (seal; impeller)" -> "Pump mechanical failure"
+    return cause.split("(")[0].strip()
+
+_CHECKLIST_HEADS = [_words(_head(c)) for c in HAZOP_CAUSE_CHECKLIST]
+
+def checklist_cause(cause: str, min_score: float = 0.75) -> int | None:
+    """Checklist index whose head words the cause text best covers, None when off-checklist."""
+    words = _words(cause)
+    scores = [len(words & head) / len(head) if head else 0.0 for head in _CHECKLIST_HEADS]
+    best = max(range(len(scores)), key=scores.__getitem__)
+    return best if scores[best] >= min_score else None
+
+def _is_valid_row(row: list) -> bool:
+    if len(row) != len(HAZOP_HEADERS) or not str(row[CAUSE_COL]).strip():
+        return False
+    return all(isinstance(row[i], int) and 1 <= row[i] <= 5 for i in _SL_COLS)
+
+def match_causes(rows: List[list], min_score: float = 0.75) -> CauseCoverage:
+    """
+    Assign parsed rows to checklist causes (one row per cause).
+
+    The model mostly echoes the checklist text; a row matches a cause when it
+    contains at least `min_score` of the cause's head words. Pairs are taken
+    best-first so a near-duplicate cause cannot steal another cause's slot.
+    """
+    valid = [r for r in rows if _is_valid_row(r)]
+    scored: List[Tuple[float, int, int]] = []
+    for ri, row in enumerate(valid):
+        words = _words(row[CAUSE_COL])
+        for ci, head in enumerate(_CHECKLIST_HEADS):
+            score = len(words & head) / len(head) if head else 0.0
+            if score >= min_score:
+                scored.append((score, ri, ci))
+
+    by_cause: Dict[int, list] = {}
+    used_rows = set()
+    for score, ri, ci in sorted(scored, key=lambda t: (-t[0], t[2], t[1])):
+        if ci in by_cause or ri in used_rows:
+            continue
+        by_cause[ci] = valid[ri]
+        used_rows.add(ri)
+
+    return {
+        "rows": [by_cause[ci] for ci in sorted(by_cause)]
+                + [r for ri, r in enumerate(valid) if ri not in used_rows],
+        "causes": sorted(by_cause),
+        "missing": [ci for ci in range(len(HAZOP_CAUSE_CHECKLIST)) if ci not in by_cause],
+        "invalid": len(rows) - len(valid),
+        "unmatched": len(valid) - len(used_rows),
+    }
+
+# ------------- REPAIR PROMPT ---------------------------------
+def _context_rows(rows: List[list], token_budget: int, compact: bool = False) -> List[str]:
+    out: List[str] = []
+    used = 0
+    lines = encode_compact_rows(rows).splitlines() if compact else [",".join(str(v) for v in r) for r in rows]
+    for line in lines:
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            break
+        out.append(line)
+        used += cost
+    return out
+
+def build_repair_prompt(
+    input_data: dict,
+    missing: List[int],
+    valid_rows: List[list],
+    *,
+    output_format: str = "csv",
+    context_token_budget: int = 1500,
+) -> str:
+    """
+    Short follow-up prompt asking only for the missing checklist causes, with
+    the rows already accepted for this deviation as consistency context.
+    """
+    causes = [HAZOP_CAUSE_CHECKLIST[ci] for ci in missing]
+    context = _context_rows(valid_rows, context_token_budget, compact=output_format == "compact")
+    cause_ref = "using the cause text verbatim"
+
+    if output_format == "structured":
+        fmt = "Return one object per listed cause in the `rows` array of the response schema."
+    elif output_format == "compact":
+        cause_ref = "referenced by its checklist number"
+        fmt = (
+            f"Return one D|<Deviation> line, then one line per cause with {COMPACT_FIELDS} pipe-separated fields:\n"
+            "Cause No|Consequence|S|L|Safeguards|S|L|Recommendations|S|L|Resp\n"
+            "No RR or categories (computed locally). Resp E/M/O. No Markdown, no headers, no comments."
+        )
+    else:
+        fmt = (
+            "Return ONLY CSV rows with 22 comma-separated fields in this order:\n"
+            + ", ".join(HAZOP_HEADERS)
+            + "\nNo Markdown, no headers, no comments. Use \";\" inside a field, never \",\"."
+        )
+
+    return "\n".join([
+        "You are completing a partially generated HAZOP worksheet (IEC 61882, Open-PHA columns).",
+        "",
+        f"Line ID: {input_data.get('line_id', '')}",
+        f"Node: {input_data.get('node', '')}",
+        f"Valves: {input_data.get('valves', '')}",
+        f"Instruments: {input_data.get('instruments', '')}",
+        f"Context: {input_data.get('context', '')}",
+        f"Process Description: {input_data.get('process_description', '')}",
+        f"Guide Word: {input_data.get('guide_word', '')}",
+        f"Parameter: {input_data.get('parameter', '')}",
+        "",
+        "Rows already accepted for this deviation (keep Node/Deviation wording and risk scale consistent):",
+        *(context or ["(none)"]),
+        "",
+        f"Write exactly {len(causes)} new row(s), one per cause below, {cause_ref}:",
+        format_cause_checklist(missing),
+        "",
+        "S and L are integers 1-5. RR = RL(S,L) from Risk Matrix S5:5,5,4,3,2; S4:5,4,4,3,2; "
+        "S3:4,4,3,3,2; S2:3,3,3,2,1; S1:2,2,2,1,1 (L5..L1). Risk Category: RL1-2 Low; RL3-4 Medium; RL5 High.",
+        "Responsibility is Engineering, Maintenance or Operations. Use \"N/A\" for non-applicable text fields.",
+        fmt,
+    ])
+
+# ------------- MERGE -----------------------------------------
+def _closest_cause(row: list) -> int | None:
+    words = _words(row[CAUSE_COL])
+    scores = [len(words & head) / len(head) if head else 0.0 for head in _CHECKLIST_HEADS]
+    best = max(range(len(scores)), key=scores.__getitem__)
+    return best if scores[best] > 0 else None
+
+def merge_repaired_rows(rows: List[list], repaired: List[list]) -> List[list]:
+    """
+    Rows of a deviation after a repair call. Causes the original output
+    already covered keep their row; the repair fills the rest. An original
+    row that matched no cause (a malformed cause) is dropped once the cause
+    it most resembles has been regenerated, so it does not appear twice.
+    """
+    before, fix = match_causes(rows), match_causes(repaired)
+    kept = dict(zip(before["causes"], before["rows"]))
+    for ci, row in zip(fix["causes"], fix["rows"]):
+        kept.setdefault(ci, row)
+    leftovers = before["rows"][len(before["causes"]):] + fix["rows"][len(fix["causes"]):]
+    return [kept[ci] for ci in sorted(kept)] + [r for r in leftovers if _closest_cause(r) not in kept]
+
+def format_rows_output(rows: List[list], output_format: str = "csv") -> str:
+    """A row set in the deviation's output format; llm_response_log keeps it so carry-over re-parses exactly these rows."""
+    if output_format == "structured":
+        return json.dumps({"rows": [dict(zip(HazopRow.model_fields, r)) for r in rows]}, ensure_ascii=False)
+    if output_format == "compact":
+        return encode_compact_rows(rows)
+    return "\n".join(",".join(str(v) for v in r) for r in rows)
@@ -0,0 +1,205 @@
+import base64, json, os, sqlite3
+from typing import Any, Dict, List, Tuple, TypedDict
+
+from module.schema_json import HazopRow
+from module.runs_module import PARSED_ROWS, folder_lock
+from module.sink_module import atomic_replace, iter_xlsx_rows
+from decorators import logger, timeit_log
+
+# SQLite index over a folder's consolidated parsed_rows.xlsx, rebuilt when
+# that file changes (merge_runs rewrites it after every run)
+INDEX_FILE = "results.sqlite"
+# HazopRow field order == HAZOP_HEADERS order; snake_case avoids the duplicate "Overall Risk"
+RESULT_COLUMNS: List[str] = list(HazopRow.model_fields)
+NUMERIC_COLUMNS = {c for c, f in HazopRow.model_fields.items() if f.annotation is int}
+
+# sort key -> (column, descending); rows without a number sort last
+SORTS: Dict[str, Tuple[str, bool]] = {
+    "rr": ("rr", False), "-rr": ("rr", True),
+    "rr_before": ("rr_before_safeguards", False), "-rr_before": ("rr_before_safeguards", True),
+    "rr_after": ("rr_after_recommendation", False), "-rr_after": ("rr_after_recommendation", True),
+}
+MAX_PAGE_SIZE = 500
+
+def _sort_key(column: str) -> str:
+    # NULL sorts below every number (last when descending); the same expression
+    # is indexed, so ORDER BY and the keyset comparison can use the index
+    return f"COALESCE({column}, -1e308)"
+
+class ResultFilters(TypedDict, total=False):
+    line: str                      # substring of Node (the line / study node label)
+    parameter: List[str]
+    guide_word: List[str]
+    risk: List[str]                # Mitigated Risk Category
+    unmitigated_risk: List[str]    # Unmitigated Risk Category
+
+class ResultPage(TypedDict):
+    total: int
+    count: int
+    rows: List[Dict[str, Any]]
+    next_cursor: str | None
+    index_rows: int
+
+# ------------- INDEX -----------------------------------------
+def _source_signature(path: str) -> str:
+    st = os.stat(path)
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+def _coerce(column: str, value: Any) -> Any:
+    if value is None or value == "":
+        return None
+    if column in NUMERIC_COLUMNS:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    return str(value)
+
+def _pad(row: list) -> list:
+    # hand-edited or truncated worksheet rows can be shorter than the header
+    return row + [None] * (len(RESULT_COLUMNS) - len(row))
+
+@timeit_log
+def build_results_index(base_dir: str) -> str:
+    """(Re)build base_dir/results.sqlite from parsed_rows.xlsx; returns the index path."""
+    source = os.path.join(base_dir, PARSED_ROWS)
+    index_path = os.path.join(base_dir, INDEX_FILE)
+    signature = _source_signature(source)
+
+    cols = ", ".join(f"{c} {'REAL' if c in NUMERIC_COLUMNS else 'TEXT'}" for c in RESULT_COLUMNS)
+    with atomic_replace(index_path) as tmp:
+        conn = sqlite3.connect(tmp)
+        try:
+            conn.execute(f"CREATE TABLE results (id INTEGER PRIMARY KEY, {cols})")
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            placeholders = ", ".join("?" for _ in RESULT_COLUMNS)
+            conn.executemany(
+                f"INSERT INTO results ({', '.join(RESULT_COLUMNS)}) VALUES ({placeholders})",
+                ([_coerce(c, v) for c, v in zip(RESULT_COLUMNS, _pad(row))] for row in iter_xlsx_rows(source)),
+            )
+            # equality filters lead, the sort key + id close every index so
+            # a filtered, sorted page is a range scan instead of a sort
+            for sort_col in ("rr", "rr_before_safeguards", "rr_after_recommendation"):
+                conn.execute(f"CREATE INDEX ix_{sort_col} ON results ({_sort_key(sort_col)}, id)")
+            rr = _sort_key("rr")
+            conn.execute(f"CREATE INDEX ix_param_gw_rr ON results (parameter, guide_word, {rr}, id)")
+            conn.execute(f"CREATE INDEX ix_risk_rr ON results (mitigated_risk_category, {rr}, id)")
+            conn.execute(f"CREATE INDEX ix_unmitigated_rr ON results (unmitigated_risk_category, {rr}, id)")
+            conn.execute("ANALYZE")
+            conn.execute("CREATE INDEX ix_node ON results (node)")
+            conn.execute("INSERT INTO meta VALUES ('source_signature', ?)", (signature,))
+            conn.commit()
+            n = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        finally:
+            conn.close()
+    logger.info(f"[Results] indexed {n} rows of {source}")
+    return index_path
+
+def _index_is_current(index_path: str, source: str) -> bool:
+    if not os.path.exists(index_path):
+        return False
+    try:
+        conn = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'source_signature'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError:
+        return False
+    return bool(row) and row[0] == _source_signature(source)
+
+def ensure_results_index(base_dir: str) -> str:
+    source = os.path.join(base_dir, PARSED_ROWS)
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"No results in {base_dir}")
+    index_path = os.path.join(base_dir, INDEX_FILE)
+    if _index_is_current(index_path, source):
+        return index_path
+    # the folder lock keeps the rebuild away from a concurrent merge_runs
+    with folder_lock(base_dir):
+        if not _index_is_current(index_path, source):
+            build_results_index(base_dir)
+    return index_path
+
+# ------------- QUERY -----------------------------------------
+def encode_cursor(sort_value: float | None, row_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort_value, row_id]).encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[float | None, int]:
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (None if sort_value is None else float(sort_value)), int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+def _where(filters: ResultFilters) -> Tuple[List[str], List[Any]]:
+    clauses: List[str] = []
+    params: List[Any] = []
+    if filters.get("line"):
+        clauses.append("node LIKE ? ESCAPE '\\'")
+        escaped = filters["line"].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params.append(f"%{escaped}%")
+    for key, column in (
+        ("parameter", "parameter"),
+        ("guide_word", "guide_word"),
+        ("risk", "mitigated_risk_category"),
+        ("unmitigated_risk", "unmitigated_risk_category"),
+    ):
+        values = filters.get(key) or []
+        if values:
+            clauses.append(f"{column} IN ({', '.join('?' for _ in values)})")
+            params.extend(values)
+    return clauses, params
+
+def query_results(
+    base_dir: str,
+    filters: ResultFilters | None = None,
+    *,
+    sort: str = "-rr",
+    limit: int = 50,
+    cursor: str | None = None,
+) -> ResultPage:
+    """
+    One page of a folder's HAZOP rows. Pages are keyset-paginated on
+    (sort column, id): `next_cursor` resumes after the last row, so deep pages
+    cost the same as the first and do not shift when rows are appended.
+    """
+    if sort not in SORTS:
+        raise ValueError(f"Unknown sort '{sort}' (expected one of {', '.join(SORTS)})")
+    column, desc = SORTS[sort]
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    clauses, params = _where(filters or {})
+
+    key = _sort_key(column)
+    order = "DESC" if desc else "ASC"
+    page_clauses, page_params = list(clauses), list(params)
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        page_clauses.append(f"({key}, id) {'<' if desc else '>'} (?, ?)")
+        page_params.extend([-1e308 if sort_value is None else sort_value, row_id])
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    page_where = f"WHERE {' AND '.join(page_clauses)}" if page_clauses else ""
+
+    conn = sqlite3.connect(f"file:{ensure_results_index(base_dir)}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        total = conn.execute(f"SELECT COUNT(*) FROM results {where}", params).fetchone()[0]
+        index_rows = conn.execute("SELECT MAX(id) FROM results").fetchone()[0] or 0
+        rows = conn.execute(
+            f"SELECT * FROM results {page_where} ORDER BY {key} {order}, id {order} LIMIT ?",
+            page_params + [limit + 1],
+        ).fetchall()
+    finally:
+        conn.close()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1][column], rows[-1]["id"]) if more else None
+    return {
+        "total": total,
+        "count": len(rows),
+        "rows": [dict(r) for r in rows],
+        "next_cursor": next_cursor,
+        "index_rows": index_rows,
+    }
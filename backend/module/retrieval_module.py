@@ -0,0 +1,253 @@
+import hashlib, json, os, re, threading
+from typing import Dict, Iterable, List, Protocol, Sequence, Tuple, TypedDict
+
+import numpy as np
+
+from module.runs_module import folder_lock
+from module.fewshot_module import estimate_tokens
+from decorators import logger, timeit_log
+
+EMBEDDINGS_ROOT = os.path.join("static", "embeddings")
+VECTORS_FILE = "vectors.f32"
+CHUNKS_FILE = "chunks.jsonl"
+META_FILE = "index.json"
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?;])\s+|\n{2,}")
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+class Chunk(TypedDict):
+    hash: str
+    doc_id: str
+    text: str
+
+# ------------- CHUNKING --------------------------------------
+def chunk_text(text: str, max_tokens: int = 120, overlap_sentences: int = 1) -> List[str]:
+    """Sentence-packed chunks of ~max_tokens; the last sentence(s) of a chunk open the next one."""
+    sentences = [s.strip() for s in _SENTENCE_RE.split(text or "") if s and s.strip()]
+    chunks: List[str] = []
+    current: List[str] = []
+    for sentence in sentences:
+        if current and estimate_tokens(" ".join(current + [sentence])) > max_tokens:
+            chunks.append(" ".join(current))
+            current = current[-overlap_sentences:] if overlap_sentences else []
+        current.append(sentence)
+    if current and (not chunks or current != chunks[-1:]):
+        chunks.append(" ".join(current))
+    return chunks
+
+def document_id(kind: str, text: str) -> str:
+    return f"{kind}:{hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]}"
+
+# ------------- EMBEDDERS -------------------------------------
+class Embedder(Protocol):
+    name: str
+    def embed(self, texts: Sequence[str]) -> np.ndarray: ...
+
+class HashingEmbedder:
+    """
+    Deterministic local stand-in: signed feature hashing of words and word
+    bigrams, L2-normalised. No network, same vectors on every machine, so
+    retrieval can be exercised without an API key.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            words = _TOKEN_RE.findall(text.lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+                out[i, h % self.dim] += 1.0 if (h >> 63) else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.where(norms == 0, 1.0, norms)
+
+class OpenAIEmbedder:
+    """OpenAI embeddings through llm_module.get_embedding_model."""
+
+    def __init__(self, model_name: str = "text-embedding-3-small", batch_size: int = 256):
+        from module.llm_module import get_embedding_model
+        self.model = get_embedding_model(model_name)
+        self.name = f"openai-{model_name}"
+        self.batch_size = batch_size
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self.model.embed_documents(list(texts[start:start + self.batch_size])))
+        out = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.where(norms == 0, 1.0, norms)
+
+def get_embedder(kind: str = "openai") -> Embedder:
+    if kind == "local":
+        return HashingEmbedder()
+    if kind == "openai":
+        return OpenAIEmbedder()
+    raise ValueError(f"Unknown embedder '{kind}' (expected 'openai' or 'local')")
+
+# ------------- PERSISTENT INDEX ------------------------------
+class EmbeddingIndex:
+    """
+    Append-only vector store under <root>/<embedder name>/:
+    vectors.f32 (float32 rows, memory-mapped for search), chunks.jsonl
+    (one line per row) and index.json (embedder, dim). Chunks are keyed by
+    the hash of their text, so text embedded once -- by any run or
+    document -- is never sent to the embedder again.
+    """
+
+    def __init__(self, embedder: Embedder, root: str = EMBEDDINGS_ROOT):
+        self.embedder = embedder
+        safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in embedder.name)
+        self.dir = os.path.join(root, safe)
+        os.makedirs(self.dir, exist_ok=True)
+        self.vectors_path = os.path.join(self.dir, VECTORS_FILE)
+        self.chunks_path = os.path.join(self.dir, CHUNKS_FILE)
+        self.meta_path = os.path.join(self.dir, META_FILE)
+        self._lock = threading.Lock()
+        self.chunks: List[Chunk] = []
+        self.row_by_hash: Dict[str, int] = {}
+        self.rows_by_doc: Dict[str, List[int]] = {}
+        self.dim = 0
+        self._chunks_size = -1
+        self._vectors: np.memmap | None = None
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def _load(self) -> None:
+        self.chunks, self.row_by_hash, self.rows_by_doc = [], {}, {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+        if os.path.exists(self.chunks_path):
+            with open(self.chunks_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self._register(json.loads(line))
+            self._chunks_size = os.path.getsize(self.chunks_path)
+        self._map_vectors()
+
+    def _register(self, chunk: Chunk) -> None:
+        row = len(self.chunks)
+        self.chunks.append(chunk)
+        self.row_by_hash.setdefault(chunk["hash"], row)
+        self.rows_by_doc.setdefault(chunk["doc_id"], []).append(row)
+
+    def _map_vectors(self) -> None:
+        n = len(self.chunks)
+        if not n or not self.dim:
+            self._vectors = None
+            return
+        # rows past the last chunk line (interrupted append) are not mapped
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+
+    def _refresh(self) -> None:
+        # another process may have appended since we loaded
+        size = os.path.getsize(self.chunks_path) if os.path.exists(self.chunks_path) else -1
+        if size != self._chunks_size:
+            self._load()
+
+    @timeit_log
+    def add_document(self, doc_id: str, texts: Iterable[str]) -> int:
+        """Register the chunks of one document; only unseen text is embedded. Returns rows embedded."""
+        texts = list(dict.fromkeys(texts))
+        with self._lock, folder_lock(self.dir):
+            self._refresh()
+            if doc_id in self.rows_by_doc:
+                return 0
+            hashes = [hashlib.sha256(t.encode("utf-8")).hexdigest() for t in texts]
+            pending = [i for i, h in enumerate(hashes) if h not in self.row_by_hash]
+            if not texts:
+                return 0
+
+            embedded = self.embedder.embed([texts[i] for i in pending]) if pending else None
+            if embedded is not None and not self.dim:
+                self.dim = int(embedded.shape[1])
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"embedder": self.embedder.name, "dim": self.dim}, f)
+            # text already embedded under another document: copy its vector, no API call
+            vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+            for j, i in enumerate(pending):
+                vectors[i] = embedded[j]
+            for i, h in enumerate(hashes):
+                if h in self.row_by_hash:
+                    vectors[i] = self._vectors[self.row_by_hash[h]]
+
+            # vectors first, then chunk lines: a crash leaves unmapped vector
+            # bytes, never a chunk without a vector
+            self._truncate_orphan_vectors()
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            rows: List[Chunk] = [{"hash": h, "doc_id": doc_id, "text": t} for h, t in zip(hashes, texts)]
+            with open(self.chunks_path, "a", encoding="utf-8") as f:
+                for c in rows:
+                    f.write(json.dumps(c, ensure_ascii=False) + "\n")
+            for c in rows:
+                self._register(c)
+            self._chunks_size = os.path.getsize(self.chunks_path)
+            self._map_vectors()
+
+        logger.info(
+            f"[Retrieval] {doc_id}: {len(texts)} chunk(s), embedded {len(pending)}, "
+            f"reused {len(texts) - len(pending)} ({self.embedder.name})"
+        )
+        return len(pending)
+
+    def _truncate_orphan_vectors(self) -> None:
+        expected = len(self.chunks) * self.dim * 4
+        if os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) > expected:
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(expected)
+
+    def search(self, query: str, top_k: int = 4, doc_ids: Sequence[str] | None = None) -> List[Tuple[float, int]]:
+        """(cosine score, row) of the top_k rows of doc_ids (all rows when None)."""
+        if self._vectors is None:
+            return []
+        if doc_ids is None:
+            rows = np.arange(len(self.chunks))
+        else:
+            rows = np.asarray([r for d in doc_ids for r in self.rows_by_doc.get(d, [])], dtype=np.int64)
+        if not len(rows):
+            return []
+        q = self.embedder.embed([query])[0]
+        scores = np.asarray(self._vectors[rows]) @ q
+        k = min(top_k, len(rows))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.lexsort((rows[best], -scores[best]))]
+        return [(float(scores[i]), int(rows[i])) for i in best]
+
+# ------------- PER-RUN RETRIEVER -----------------------------
+class ProcessRetriever:
+    """
+    Chunks and indexes the process description (plus optional reference
+    documents such as spec sheets) of one run, then returns only the top_k
+    chunks relevant to a deviation, in document order.
+    """
+
+    def __init__(
+        self,
+        index: EmbeddingIndex,
+        *,
+        top_k: int = 4,
+        chunk_tokens: int = 120,
+    ):
+        self.index = index
+        self.top_k = top_k
+        self.chunk_tokens = chunk_tokens
+        self.doc_ids: List[str] = []
+
+    def add(self, kind: str, text: str) -> str:
+        doc_id = document_id(kind, text)
+        self.index.add_document(doc_id, chunk_text(text, self.chunk_tokens))
+        if doc_id not in self.doc_ids:
+            self.doc_ids.append(doc_id)
+        return doc_id
+
+    def context_for(self, query: str) -> str:
+        # rows are appended in chunk order, so sorting by row restores reading order
+        hits = sorted(row for _, row in self.index.search(query, self.top_k, self.doc_ids))
+        return "\n".join(self.index.chunks[row]["text"] for row in hits)
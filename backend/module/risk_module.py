@@ -0,0 +1,102 @@
+from typing import Dict, List, Tuple, TypedDict
+
+import numpy as np
+import pandas as pd
+
+from module.schema_json import HAZOP_HEADERS
+
+# RL(S, L), row = S1..S5, column = L1..L5
+# (role_and_rules_2 lists the same matrix as S5:5,5,4,3,2 ... with L5..L1)
+RISK_MATRIX = np.array([
+    [1, 1, 2, 2, 2],  # S1
+    [1, 2, 3, 3, 3],  # S2
+    [2, 3, 3, 4, 4],  # S3
+    [2, 3, 4, 4, 5],  # S4
+    [2, 3, 4, 5, 5],  # S5
+])
+# index = RL; 0 marks an unusable S/L pair
+CATEGORY_BY_RL = np.array(["N/A", "Low", "Low", "Medium", "Medium", "High"], dtype=object)
+
+class RiskStage(TypedDict):
+    name: str
+    s: int
+    l: int
+    rr: int
+    category: int | None
+    overall: int | None
+
+def _col(name: str, nth: int = 0) -> int:
+    # positional, "Overall Risk" appears twice in HAZOP_HEADERS
+    return [i for i, h in enumerate(HAZOP_HEADERS) if h == name][nth]
+
+RISK_STAGES: List[RiskStage] = [
+    {"name": "unmitigated", "s": _col("S Before Safeguards"), "l": _col("L Before Safeguards"),
+     "rr": _col("RR Before Safeguards"), "category": _col("Unmitigated Risk Category"), "overall": _col("Overall Risk", 0)},
+    {"name": "mitigated", "s": _col("S"), "l": _col("L"),
+     "rr": _col("RR"), "category": _col("Mitigated Risk Category"), "overall": _col("Overall Risk", 1)},
+    {"name": "after_recommendation", "s": _col("S After Recommendation"), "l": _col("L After Recommendation"),
+     "rr": _col("RR After Recommendation"), "category": None, "overall": None},
+]
+
+class RiskReport(TypedDict):
+    rows: int
+    invalid_sl: Dict[str, int]
+    rr_mismatch: Dict[str, int]
+    category_mismatch: Dict[str, int]
+    flagged_rows: int
+
+# ------------- RISK MATRIX -----------------------------------
+def risk_levels(s, l) -> np.ndarray:
+    """Vectorized RL lookup; 0 where S or L is missing or outside 1-5."""
+    s = pd.to_numeric(pd.Series(np.asarray(s, dtype=object)), errors="coerce").to_numpy(dtype=float)
+    l = pd.to_numeric(pd.Series(np.asarray(l, dtype=object)), errors="coerce").to_numpy(dtype=float)
+    valid = (s >= 1) & (s <= 5) & (l >= 1) & (l <= 5) & (s % 1 == 0) & (l % 1 == 0)
+    rl = np.zeros(len(s), dtype=np.int64)
+    rl[valid] = RISK_MATRIX[s[valid].astype(np.int64) - 1, l[valid].astype(np.int64) - 1]
+    return rl
+
+def risk_categories(rl: np.ndarray) -> np.ndarray:
+    return CATEGORY_BY_RL[np.asarray(rl, dtype=np.int64)]
+
+@np.errstate(invalid="ignore")
+def derive_risk_columns(df: pd.DataFrame, *, correct: bool = True) -> Tuple[pd.DataFrame, RiskReport, np.ndarray]:
+    """
+    Recompute RR, risk categories and Overall Risk from S/L for a whole
+    worksheet (HAZOP_HEADERS column order) and compare with what the model wrote.
+
+    Returns the (corrected) frame, mismatch counts per stage and a boolean
+    mask of flagged rows. Rows with unusable S/L are flagged, never rewritten.
+    """
+    out = df.copy() if correct else df
+    flagged = np.zeros(len(df), dtype=bool)
+    report: RiskReport = {"rows": len(df), "invalid_sl": {}, "rr_mismatch": {}, "category_mismatch": {}, "flagged_rows": 0}
+
+    for stage in RISK_STAGES:
+        rl = risk_levels(df.iloc[:, stage["s"]], df.iloc[:, stage["l"]])
+        valid = rl > 0
+        cats = risk_categories(rl)
+
+        rr_model = pd.to_numeric(df.iloc[:, stage["rr"]], errors="coerce").to_numpy(dtype=float)
+        rr_bad = valid & (rr_model != rl)
+        cat_bad = np.zeros(len(df), dtype=bool)
+        if stage["category"] is not None:
+            cat_model = df.iloc[:, stage["category"]].astype(str).str.strip().to_numpy(dtype=object)
+            cat_bad = valid & (cat_model != cats)
+            if stage["overall"] is not None:
+                overall_model = df.iloc[:, stage["overall"]].astype(str).str.strip().to_numpy(dtype=object)
+                cat_bad |= valid & (overall_model != cats)
+
+        report["invalid_sl"][stage["name"]] = int((~valid).sum())
+        report["rr_mismatch"][stage["name"]] = int(rr_bad.sum())
+        report["category_mismatch"][stage["name"]] = int(cat_bad.sum())
+        flagged |= ~valid | rr_bad | cat_bad
+
+        if correct:
+            rr_new = np.where(valid, rl, out.iloc[:, stage["rr"]].to_numpy(dtype=object))
+            out.isetitem(stage["rr"], rr_new)
+            for idx in (stage["category"], stage["overall"]):
+                if idx is not None:
+                    out.isetitem(idx, np.where(valid, cats, out.iloc[:, idx].to_numpy(dtype=object)))
+
+    report["flagged_rows"] = int(flagged.sum())
+    return out, report, flagged
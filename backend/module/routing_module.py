@@ -0,0 +1,127 @@
+import os
+from typing import Dict, List, TypedDict
+
+import pandas as pd
+
+from module.llm_module import DEFAULT_CHAT_MODEL
+from decorators import logger
+
+FAST_CHAT_MODEL = "gpt-4.1-mini-2025-04-14"
+
+class RouteRule(TypedDict, total=False):
+    name: str
+    model: str
+    parameters: List[str]    # empty / missing = any
+    guide_words: List[str]   # empty / missing = any
+    max_complexity: int      # valves + instruments (+ extra lines of a study node)
+
+class RouteDecision(TypedDict):
+    model: str
+    rule: str
+    complexity: int
+
+# first matching rule wins; nothing matched -> the router's default model
+DEFAULT_ROUTE_RULES: List[RouteRule] = [
+    {
+        "name": "support-systems",
+        "model": FAST_CHAT_MODEL,
+        "parameters": ["Utility", "Power", "Maintenance", "Human Action", "Operation Timing"],
+        "max_complexity": 4,
+    },
+    {
+        "name": "simple-line",
+        "model": FAST_CHAT_MODEL,
+        "guide_words": ["Early", "Late", "Before", "After"],
+        "max_complexity": 2,
+    },
+]
+
+def line_complexity(info: dict) -> int:
+    return (
+        len(info.get("valves") or [])
+        + len(info.get("instruments") or [])
+        + max(0, len(info.get("line_ids") or []) - 1)
+    )
+
+class ModelRouter:
+    """
+    Picks the model for one deviation from ordered rules (parameter, guide
+    word, line complexity). Output that fails validation on a routed model is
+    re-run on `escalation_model` by run_hazop_agent.
+    """
+
+    def __init__(
+        self,
+        rules: List[RouteRule] | None = None,
+        *,
+        default_model: str = DEFAULT_CHAT_MODEL,
+        escalation_model: str = DEFAULT_CHAT_MODEL,
+        max_missing_causes: int = 10,
+    ):
+        self.rules = DEFAULT_ROUTE_RULES if rules is None else rules
+        self.default_model = default_model
+        self.escalation_model = escalation_model
+        # more missing checklist causes than this counts as failed validation
+        self.max_missing_causes = max_missing_causes
+
+    def route(self, info: dict, parameter: str, guide_word: str) -> RouteDecision:
+        complexity = line_complexity(info)
+        for rule in self.rules:
+            if rule.get("parameters") and parameter not in rule["parameters"]:
+                continue
+            if rule.get("guide_words") and guide_word not in rule["guide_words"]:
+                continue
+            if "max_complexity" in rule and complexity > rule["max_complexity"]:
+                continue
+            return {"model": rule["model"], "rule": rule.get("name", rule["model"]), "complexity": complexity}
+        return {"model": self.default_model, "rule": "default", "complexity": complexity}
+
+    def can_escalate(self, model: str) -> bool:
+        return model != self.escalation_model
+
+# ------------- REPORT ----------------------------------------
+class ModelUsage(TypedDict):
+    model: str
+    calls: int
+    tokens: int
+    token_share: float
+    mean_latency_s: float | None
+    escalated_from: int
+
+def summarize_model_usage(token_log_path: str) -> List[ModelUsage]:
+    """Per-model calls, token share and mean latency from token_log.csv."""
+    if not os.path.exists(token_log_path):
+        return []
+    df = pd.read_csv(token_log_path)
+    if df.empty or "Model" not in df.columns:
+        return []
+    df = df[df["Model"] != "carry-over"]
+    for col in ("LatencyS", "EscalationTokens"):
+        if col not in df.columns:
+            df[col] = None
+    routed = df["RoutedModel"] if "RoutedModel" in df.columns else df["Model"]
+    escalated = df["Escalated"].fillna(False).astype(bool) if "Escalated" in df.columns else pd.Series(False, index=df.index)
+
+    discarded = pd.to_numeric(df["EscalationTokens"], errors="coerce").fillna(0)
+    total = pd.to_numeric(df["TotalTokens"], errors="coerce").fillna(0)
+    # the discarded first attempt is billed to the model it was routed to
+    tokens = (total - discarded).groupby(df["Model"]).sum().add(discarded[escalated].groupby(routed[escalated]).sum(), fill_value=0)
+    latency = pd.to_numeric(df.loc[~escalated, "LatencyS"], errors="coerce").groupby(df.loc[~escalated, "Model"]).mean()
+    calls = df.groupby("Model").size().add(escalated[escalated].groupby(routed[escalated]).size(), fill_value=0)
+    escalations = escalated[escalated].groupby(routed[escalated]).size()
+
+    grand = float(tokens.sum()) or 1.0
+    report: List[ModelUsage] = []
+    for model in tokens.index:
+        lat = latency.get(model)
+        report.append({
+            "model": str(model),
+            "calls": int(calls.get(model, 0)),
+            "tokens": int(tokens[model]),
+            "token_share": round(float(tokens[model]) / grand, 4),
+            "mean_latency_s": None if lat is None or pd.isna(lat) else round(float(lat), 3),
+            "escalated_from": int(escalations.get(model, 0)),
+        })
+    report.sort(key=lambda r: -r["tokens"])
+    logger.info(f"[Routing] model usage: {report}")
+    return report
@@ -0,0 +1,262 @@
+import json, os, shutil, threading, time, uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, TypedDict
+
+import pandas as pd
+
+from module.sink_module import atomic_replace, iter_xlsx_rows, write_xlsx_rows
+from decorators import logger, timeit_log
+
+# Layout of one output folder (static/hazop/<output_folder>/):
+#   runs/<run_id>/run.json       manifest (status, workbooks, timestamps)
+#   runs/<run_id>/...            that run's workbook, parsed_rows.xlsx and logs
+#   <workbook>.xlsx, parsed_rows.xlsx, *_log.csv
+#                                consolidated outputs, rebuilt by merge_runs
+RUNS_DIR = "runs"
+MANIFEST = "run.json"
+LOCK_FILE = ".lock"
+PARSED_ROWS = "parsed_rows.xlsx"
+LOG_FILES = ["token_log.csv", "error_log.csv", "llm_response_log.csv"]
+
+class RunInfo(TypedDict):
+    run_id: str
+    seq: int                 # start order within the folder (started is per second)
+    dir: str
+    status: str              # running | complete | failed | superseded
+    workbooks: List[str]
+    started: str
+    finished: str | None
+    resumed_from: str | None  # run whose finished deviations were carried into this one
+
+class RunPaths(TypedDict):
+    excel_path: str
+    parsed_excel_path: str
+    token_log_path: str
+    error_log_path: str
+    llm_response_log_path: str
+
+class MergeReport(TypedDict):
+    runs: List[str]
+    skipped_running: List[str]
+    rows: Dict[str, int]
+
+# ------------- LOCKING ---------------------------------------
+_thread_locks: Dict[str, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+@contextmanager
+def folder_lock(folder: str, *, timeout_s: float = 60.0, stale_s: float = 600.0) -> Iterator[None]:
+    """
+    Exclusive lock on an output folder: a thread lock for this process plus
+    an O_EXCL lock file for other processes. A lock file older than
+    `stale_s` is treated as left over from a crashed process and removed.
+    """
+    key = os.path.abspath(folder)
+    with _registry_lock:
+        tlock = _thread_locks.setdefault(key, threading.Lock())
+    if not tlock.acquire(timeout=timeout_s):
+        raise TimeoutError(f"Timed out waiting for folder lock on {folder}")
+
+    lock_path = os.path.join(folder, LOCK_FILE)
+    deadline = time.monotonic() + timeout_s
+    try:
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode())
+                os.close(fd)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > stale_s:
+                        logger.warning(f"[Runs] removing stale lock {lock_path}")
+                        os.remove(lock_path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Timed out waiting for folder lock on {folder}")
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+    finally:
+        tlock.release()
+
+# ------------- RUNS ------------------------------------------
+def _write_manifest(run: RunInfo, run_dir: str | None = None) -> None:
+    path = os.path.join(run_dir or run["dir"], MANIFEST)
+    with atomic_replace(path) as tmp:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=2)
+
+def _read_manifest(run_dir: str) -> RunInfo | None:
+    try:
+        with open(os.path.join(run_dir, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _is_mergeable(path: str) -> bool:
+    # merge_runs must be able to read every adopted file; Excel "~$" owner
+    # files and anything else that is not a readable workbook / CSV stay put
+    name = os.path.basename(path)
+    if name.startswith("~$") or not os.path.isfile(path):
+        return False
+    try:
+        if name.endswith(".xlsx"):
+            for _ in iter_xlsx_rows(path):
+                break
+        elif os.path.getsize(path) > 0:
+            pd.read_csv(path)
+    except Exception as e:
+        logger.warning(f"[Runs] not adopting {path}: {type(e).__name__}: {e}")
+        return False
+    return True
+
+def _adopt_legacy_outputs(base_dir: str, runs_dir: str) -> None:
+    """
+    Outputs written before per-run folders existed become run 'legacy', so
+    the first merge keeps them. Files are validated, copied into a staging
+    folder and only then published by renaming it to runs/; the originals
+    stay in place until merge_runs rewrites them.
+    """
+    names = sorted(
+        n for n in os.listdir(base_dir)
+        if (n.endswith(".xlsx") or n in LOG_FILES) and _is_mergeable(os.path.join(base_dir, n))
+    )
+    staging = f"{runs_dir}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    if names:
+        legacy_dir = os.path.join(staging, "legacy")
+        os.makedirs(legacy_dir)
+        for n in names:
+            shutil.copy2(os.path.join(base_dir, n), os.path.join(legacy_dir, n))
+        _write_manifest({
+            "run_id": "legacy",
+            "seq": 0,
+            "dir": os.path.join(runs_dir, "legacy"),
+            "status": "complete",
+            "workbooks": [n for n in names if n.endswith(".xlsx") and n != PARSED_ROWS],
+            "started": datetime.fromtimestamp(0).isoformat(timespec="seconds"),
+            "finished": datetime.now().isoformat(timespec="seconds"),
+        }, legacy_dir)
+    os.replace(staging, runs_dir)
+    if names:
+        logger.info(f"[Runs] adopted {len(names)} existing output file(s) in {base_dir} as run 'legacy'")
+
+def start_run(base_dir: str, file_name: str, *, resumed_from: str | None = None) -> RunInfo:
+    """Create an isolated run folder under base_dir/runs; nothing shared is written until merge_runs."""
+    os.makedirs(base_dir, exist_ok=True)
+    runs_dir = os.path.join(base_dir, RUNS_DIR)
+    # under the lock so concurrent starts get distinct, increasing sequence numbers
+    with folder_lock(base_dir):
+        if not os.path.isdir(runs_dir):
+            _adopt_legacy_outputs(base_dir, runs_dir)
+        seq = max((r.get("seq") or 0 for r in list_runs(base_dir)), default=0) + 1
+
+        run_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        run_dir = os.path.join(runs_dir, run_id)
+        os.makedirs(run_dir)
+        run: RunInfo = {
+            "run_id": run_id,
+            "seq": seq,
+            "dir": run_dir,
+            "status": "running",
+            "workbooks": [file_name],
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "finished": None,
+            "resumed_from": resumed_from,
+        }
+        _write_manifest(run)
+    logger.info(f"[Runs] started {run_id} in {base_dir}")
+    return run
+
+def run_paths(run: RunInfo) -> RunPaths:
+    d = run["dir"]
+    return {
+        "excel_path": os.path.join(d, run["workbooks"][0]),
+        "parsed_excel_path": os.path.join(d, PARSED_ROWS),
+        "token_log_path": os.path.join(d, "token_log.csv"),
+        "error_log_path": os.path.join(d, "error_log.csv"),
+        "llm_response_log_path": os.path.join(d, "llm_response_log.csv"),
+    }
+
+def finish_run(run: RunInfo, status: str = "complete") -> None:
+    run["status"] = status
+    run["finished"] = datetime.now().isoformat(timespec="seconds")
+    _write_manifest(run)
+
+def supersede_resumed(base_dir: str, run: RunInfo) -> List[str]:
+    """
+    After `run` completes, mark every unfinished run whose rows reached it
+    through carry-over (its resume chain) as superseded.
+    """
+    by_id = {r["run_id"]: r for r in list_runs(base_dir)}
+    superseded: List[str] = []
+    previous = by_id.get(run.get("resumed_from") or "")
+    while previous and previous["status"] in ("running", "failed") and previous["run_id"] not in superseded:
+        finish_run(previous, "superseded")
+        superseded.append(previous["run_id"])
+        previous = by_id.get(previous.get("resumed_from") or "")
+    return superseded
+
+def list_runs(base_dir: str) -> List[RunInfo]:
+    runs_dir = os.path.join(base_dir, RUNS_DIR)
+    if not os.path.isdir(runs_dir):
+        return []
+    runs = [m for m in (_read_manifest(os.path.join(runs_dir, d)) for d in os.listdir(runs_dir)) if m]
+    # manifests written before seq existed sort by start time among themselves
+    return sorted(runs, key=lambda r: (r.get("seq") or 0, r["started"], r["run_id"]))
+
+# ------------- MERGE -----------------------------------------
+def _merge_csv(paths: List[str], target: str) -> int:
+    frames = [pd.read_csv(p) for p in paths if os.path.exists(p) and os.path.getsize(p) > 0]
+    if not frames:
+        return 0
+    df = pd.concat(frames, ignore_index=True)
+    with atomic_replace(target) as tmp:
+        df.to_csv(tmp, index=False)
+    return len(df)
+
+@timeit_log
+def merge_runs(base_dir: str) -> MergeReport:
+    """
+    Rebuild the folder's consolidated outputs from every finished run, in
+    start order, under the folder lock. Rebuilding (instead of appending)
+    keeps the merge idempotent; runs still in progress, and runs whose
+    outputs were carried into a later finished run (superseded, or resumed
+    by a run that failed in turn), are left out.
+    """
+    with folder_lock(base_dir):
+        runs = list_runs(base_dir)
+        finished = [r for r in runs if r["status"] in ("complete", "failed")]
+        carried = {r.get("resumed_from") for r in finished}
+        done = [r for r in finished if r["run_id"] not in carried]
+        report: MergeReport = {
+            "runs": [r["run_id"] for r in done],
+            "skipped_running": [r["run_id"] for r in runs if r["status"] == "running"],
+            "rows": {},
+        }
+
+        workbooks = sorted({w for r in done for w in r["workbooks"]})
+        for name in workbooks + [PARSED_ROWS]:
+            sources = [
+                iter_xlsx_rows(os.path.join(r["dir"], name))
+                for r in done
+                if os.path.exists(os.path.join(r["dir"], name))
+            ]
+            if sources:
+                report["rows"][name] = write_xlsx_rows(os.path.join(base_dir, name), sources)
+
+        for name in LOG_FILES:
+            report["rows"][name] = _merge_csv([os.path.join(r["dir"], name) for r in done], os.path.join(base_dir, name))
+
+    logger.info(f"[Runs] merged {len(done)} run(s) into {base_dir}: {report['rows']}")
+    return report
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import List, Literal, Optional
 from pydantic import BaseModel, Field
 
 class Equipment(BaseModel):
@@ -47,3 +47,49 @@ class PIDResponse(BaseModel):
     @staticmethod
     def schema_name() -> str: 
         return "PIDResponse"
+
+# ------------- HAZOP WORKSHEET ROWS --------------------------
+HAZOP_HEADERS = [
+    "Node", "Guide Word", "Parameter", "Deviation", "Cause", "Consequence",
+    "Unmitigated Risk Category", "S Before Safeguards", "L Before Safeguards",
+    "RR Before Safeguards", "Overall Risk", "Safeguards", "Mitigated Risk Category",
+    "S", "L", "RR", "Overall Risk", "Recommendations", "S After Recommendation",
+    "L After Recommendation", "RR After Recommendation", "Responsibility"
+]
+
+RiskCategory = Literal["Low", "Medium", "High", "N/A"]
+
+class HazopRow(BaseModel):
+    node: str
+    guide_word: str
+    parameter: str
+    deviation: str
+    cause: str
+    consequence: str
+    unmitigated_risk_category: RiskCategory
+    s_before_safeguards: int
+    l_before_safeguards: int
+    rr_before_safeguards: int
+    overall_risk_unmitigated: str
+    safeguards: str
+    mitigated_risk_category: RiskCategory
+    s: int
+    l: int
+    rr: int
+    overall_risk_mitigated: str
+    recommendations: str
+    s_after_recommendation: int
+    l_after_recommendation: int
+    rr_after_recommendation: int
+    responsibility: Literal["Engineering", "Maintenance", "Operations"]
+
+    def to_row(self) -> list:
+        # field order == HAZOP_HEADERS order
+        return [getattr(self, name) for name in type(self).model_fields]
+
+class HazopRowsResponse(BaseModel):
+    rows: List[HazopRow]
+
+    @staticmethod
+    def schema_name() -> str:
+        return "HazopRowsResponse"
@@ -0,0 +1,212 @@
+import csv, os, threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List
+
+import pandas as pd
+
+from module.schema_json import HAZOP_HEADERS
+from decorators import logger
+
+TOKEN_LOG_COLUMNS = [
+    "Timestamp", "LineID", "Parameter", "GuideWord", "Model", "PromptTokens", "CompletionTokens", "TotalTokens",
+    "ExampleTokens", "ParsedRows", "RepairCalls", "RiskFlagged",
+    "LatencyS", "RoutedModel", "Route", "Escalated", "EscalationTokens",
+]
+ERROR_LOG_COLUMNS = ["Timestamp", "LineID", "Parameter", "GuideWord", "RawOutput", "Reason"]
+RESPONSE_LOG_COLUMNS = ["Timestamp", "LineID", "Parameter", "GuideWord", "RawOutput"]
+
+@contextmanager
+def atomic_replace(path: str) -> Iterator[str]:
+    """
+    Yields a temp path next to `path` (same suffix, so pandas picks the
+    right engine); it replaces `path` only if the write finished.
+    """
+    p = Path(path)
+    tmp = str(p.with_name(f"{p.stem}.{os.getpid()}-{threading.get_ident()}.tmp{p.suffix}"))
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+class HazopRunSink:
+    """Where run_hazop_agent puts its per-deviation results and logs."""
+
+    def __init__(self, *, excel_path: str, parsed_excel_path: str, token_log_path: str,
+                 error_log_path: str, llm_response_log_path: str):
+        self.excel_path = excel_path
+        self.parsed_excel_path = parsed_excel_path
+        self.token_log_path = token_log_path
+        self.error_log_path = error_log_path
+        self.llm_response_log_path = llm_response_log_path
+
+    def log_error(self, entry: dict) -> None: ...
+    def log_response(self, entry: dict) -> None: ...
+    def log_tokens(self, entry: dict) -> None: ...
+    def add_rows(self, df_rows: pd.DataFrame) -> None: ...
+    def close(self) -> None: ...
+
+# ------------- IN-MEMORY (ORIGINAL) --------------------------
+class DataFrameRunSink(HazopRunSink):
+    """
+    Original behaviour: whole-run DataFrames, every file rewritten (atomically)
+    after each deviation. Simple and always consistent on disk, but O(n²) over a run.
+    """
+
+    def __init__(self, **paths):
+        super().__init__(**paths)
+        self.df = pd.read_excel(self.excel_path) if os.path.exists(self.excel_path) else pd.DataFrame(columns=HAZOP_HEADERS)
+        self.token_df = _read_csv_or_empty(self.token_log_path, TOKEN_LOG_COLUMNS)
+        self.error_df = _read_csv_or_empty(self.error_log_path, ERROR_LOG_COLUMNS)
+        self.llm_response_df = _read_csv_or_empty(self.llm_response_log_path, RESPONSE_LOG_COLUMNS)
+
+    def log_error(self, entry: dict) -> None:
+        self.error_df = pd.concat([self.error_df, pd.DataFrame([entry])], ignore_index=True)
+        with atomic_replace(self.error_log_path) as tmp:
+            self.error_df.to_csv(tmp, index=False)
+
+    def log_response(self, entry: dict) -> None:
+        self.llm_response_df = pd.concat([self.llm_response_df, pd.DataFrame([entry])], ignore_index=True)
+        with atomic_replace(self.llm_response_log_path) as tmp:
+            self.llm_response_df.to_csv(tmp, index=False)
+
+    def log_tokens(self, entry: dict) -> None:
+        self.token_df = pd.concat([self.token_df, pd.DataFrame([entry])], ignore_index=True)
+        with atomic_replace(self.token_log_path) as tmp:
+            self.token_df.to_csv(tmp, index=False)
+
+    def add_rows(self, df_rows: pd.DataFrame) -> None:
+        # --- merge into parsed_excel_path ---
+        if os.path.exists(self.parsed_excel_path):
+            df_existing = pd.read_excel(self.parsed_excel_path)
+            df_existing = df_existing.loc[:, ~df_existing.columns.duplicated()]
+            df_existing = df_existing.reindex(columns=HAZOP_HEADERS)
+            df_rows = df_rows.reindex(columns=HAZOP_HEADERS)
+            df_combined = pd.concat([df_existing, df_rows], ignore_index=True)
+        else:
+            df_combined = df_rows.reindex(columns=HAZOP_HEADERS)
+        with atomic_replace(self.parsed_excel_path) as tmp:
+            df_combined.to_excel(tmp, index=False)
+
+        # --- main HAZOP output ---
+        self.df = pd.concat([self.df, df_rows], ignore_index=True)
+        with atomic_replace(self.excel_path) as tmp:
+            self.df.to_excel(tmp, index=False)
+
+    def close(self) -> None:
+        pass
+
+def _read_csv_or_empty(path: str, columns: List[str]) -> pd.DataFrame:
+    return pd.read_csv(path) if os.path.exists(path) else pd.DataFrame(columns=columns)
+
+# ------------- STREAMING -------------------------------------
+class _CsvAppender:
+    """Append-only CSV log; header written once, row flushed immediately."""
+
+    def __init__(self, path: str, columns: List[str]):
+        self.columns = columns
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new_file:
+            # resume: rows must line up with the header already in the file
+            with open(path, newline="", encoding="utf-8") as f:
+                self.columns = next(csv.reader(f), []) or columns
+        self._f = open(path, "a", newline="", encoding="utf-8")
+        self._w = csv.writer(self._f)
+        if new_file:
+            self._w.writerow(self.columns)
+            self._f.flush()
+
+    def write(self, entry: dict) -> None:
+        self.write_rows([["" if entry.get(c) is None else entry.get(c) for c in self.columns]])
+
+    def write_rows(self, rows) -> None:
+        self._w.writerows(rows)
+        self._f.flush()
+
+    def close(self) -> None:
+        self._f.close()
+
+def _cell(v: str):
+    # csv round-trip turns ints into text; restore them for Excel
+    return int(v) if v.isdigit() else v
+
+def iter_xlsx_rows(path: str) -> Iterator[list]:
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        next(rows, None)  # header
+        for r in rows:
+            yield list(r)[:len(HAZOP_HEADERS)]
+    finally:
+        wb.close()
+
+def _iter_spool_rows(path: str) -> Iterator[list]:
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for r in reader:
+            yield [_cell(v) for v in r]
+
+def write_xlsx_rows(path: str, sources: List[Iterator[list]]) -> int:
+    """Write HAZOP_HEADERS + the rows of every source with openpyxl write-only mode, atomically."""
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(HAZOP_HEADERS)
+    n = 0
+    for source in sources:
+        for row in source:
+            ws.append(row)
+            n += 1
+    with atomic_replace(path) as tmp:
+        wb.save(tmp)
+    return n
+
+class StreamingRunSink(HazopRunSink):
+    """
+    Constant-memory sink: logs and worksheet rows are appended to CSV as each
+    deviation finishes (rows to "<excel stem>.rows.csv" next to the workbook),
+    and the Excel files are written once on close with openpyxl write-only
+    mode, streaming any rows already in them.
+    """
+
+    def __init__(self, **paths):
+        super().__init__(**paths)
+        self.spool_path = str(Path(self.excel_path).with_suffix(".rows.csv"))
+        self._tokens = _CsvAppender(self.token_log_path, TOKEN_LOG_COLUMNS)
+        self._errors = _CsvAppender(self.error_log_path, ERROR_LOG_COLUMNS)
+        self._responses = _CsvAppender(self.llm_response_log_path, RESPONSE_LOG_COLUMNS)
+        self._rows = _CsvAppender(self.spool_path, HAZOP_HEADERS)
+        self._closed = False
+
+    def log_error(self, entry: dict) -> None:
+        self._errors.write(entry)
+
+    def log_response(self, entry: dict) -> None:
+        self._responses.write(entry)
+
+    def log_tokens(self, entry: dict) -> None:
+        self._tokens.write(entry)
+
+    def add_rows(self, df_rows: pd.DataFrame) -> None:
+        self._rows.write_rows(
+            ["" if pd.isna(v) else v for v in row]
+            for row in df_rows.itertuples(index=False, name=None)
+        )
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        for appender in (self._tokens, self._errors, self._responses, self._rows):
+            appender.close()
+
+        for target in (self.excel_path, self.parsed_excel_path):
+            sources = [iter_xlsx_rows(target)] if os.path.exists(target) else []
+            sources.append(_iter_spool_rows(self.spool_path))
+            n = write_xlsx_rows(target, sources)
+            logger.info(f"[Stream] wrote {n} rows to {target}")
+        os.remove(self.spool_path)
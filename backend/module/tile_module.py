@@ -0,0 +1,354 @@
+import re
+from collections import Counter
+from pathlib import Path
+from typing import IO, Dict, List, Tuple, TypedDict
+
+from module.schema_json import PIDResponse
+from decorators import logger, timeit_log
+
+PathLike = str | Path
+# a file on disk, or an upload kept in memory / spooled as (filename, binary stream)
+UploadSource = PathLike | Tuple[str, IO[bytes]]
+
+def source_name(source: UploadSource) -> str:
+    return str(source[0]) if isinstance(source, tuple) else str(source)
+
+class Tile(TypedDict):
+    tile_id: str
+    source: str
+    page: int
+    region: Tuple[int, int]
+    path: str
+
+# ------------- SPLIT -----------------------------------------
+MAX_GRID = 8
+
+def parse_grid(raw: str) -> Tuple[int, int]:
+    """"2x3" -> (2, 3); a bare "2" means 2x1. Raises ValueError on anything else."""
+    rows, _, cols = str(raw).strip().lower().partition("x")
+    try:
+        grid = (int(rows or 1), int(cols or 1))
+    except ValueError:
+        raise ValueError(f"Invalid grid '{raw}' (expected ROWSxCOLS, e.g. 2x2)")
+    if not all(1 <= n <= MAX_GRID for n in grid):
+        raise ValueError(f"Invalid grid '{raw}' (rows and columns must be 1-{MAX_GRID})")
+    return grid
+
+def _pdf_reader_writer():
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except ImportError as e:
+        raise ImportError("Tiled extraction of PDFs requires 'pypdf' (pip install pypdf)") from e
+    return PdfReader, PdfWriter
+
+def _split_image(image_path: Path, out_dir: Path, file_idx: int, source: str, grid: Tuple[int, int], overlap: float) -> List[Tile]:
+    try:
+        from PIL import Image
+    except ImportError as e:
+        raise ImportError("Tiled extraction of images requires 'pillow' (pip install pillow)") from e
+
+    rows, cols = grid
+    tiles: List[Tile] = []
+    with Image.open(image_path) as img:
+        w, h = img.width / cols, img.height / rows
+        ox, oy = w * overlap, h * overlap
+        for r in range(rows):
+            for c in range(cols):
+                box = (
+                    max(0, round(c * w - ox)), max(0, round(r * h - oy)),
+                    min(img.width, round((c + 1) * w + ox)), min(img.height, round((r + 1) * h + oy)),
+                )
+                tile_id = f"F{file_idx}-R{r + 1}C{c + 1}"
+                tile_path = out_dir / f"{image_path.stem}_{tile_id}.png"
+                img.crop(box).save(tile_path, format="PNG")
+                tiles.append({"tile_id": tile_id, "source": source, "page": 1, "region": (r, c), "path": str(tile_path)})
+    return tiles
+
+@timeit_log
+def split_into_tiles(
+    file_paths: List[UploadSource],
+    out_dir: PathLike,
+    *,
+    grid: Tuple[int, int] = (1, 1),
+    overlap: float = 0.05,
+) -> List[Tile]:
+    """
+    One tile per PDF page, or per page region when grid=(rows, cols) > (1, 1).
+    Regions are cropped with pypdf (vector content kept, no rasterization) and
+    overlap slightly so lines crossing a seam appear on both sides.
+    Images are cut into the same grid as raster tiles (pillow), or passed
+    through as a single tile for grid (1, 1); uploads are written to out_dir.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rows, cols = grid
+    tiles: List[Tile] = []
+
+    for file_idx, src in enumerate(file_paths, start=1):
+        fp = Path(source_name(src))
+        stream = src[1] if isinstance(src, tuple) else None
+        if fp.suffix.lower() != ".pdf":
+            image_path = fp
+            if stream is not None:
+                image_path = out_dir / f"F{file_idx}_{fp.name}"
+                stream.seek(0)
+                image_path.write_bytes(stream.read())
+            if rows > 1 or cols > 1:
+                tiles.extend(_split_image(image_path, out_dir, file_idx, str(fp), grid, overlap))
+                continue
+            tiles.append({
+                "tile_id": f"F{file_idx}",
+                "source": str(fp),
+                "page": 1,
+                "region": (0, 0),
+                "path": str(image_path),
+            })
+            continue
+
+        PdfReader, PdfWriter = _pdf_reader_writer()
+        if stream is not None:
+            stream.seek(0)
+        reader = PdfReader(stream if stream is not None else str(fp))
+        for page_no, page in enumerate(reader.pages, start=1):
+            x0, y0, x1, y1 = (float(v) for v in page.mediabox)
+            w, h = (x1 - x0) / cols, (y1 - y0) / rows
+            ox, oy = w * overlap, h * overlap
+
+            for r in range(rows):
+                for c in range(cols):
+                    writer = PdfWriter()
+                    writer.add_page(page)
+                    tile_page = writer.pages[0]
+                    if rows > 1 or cols > 1:
+                        # pdf y axis grows upwards; row 0 is the top band
+                        left = max(x0, x0 + c * w - ox)
+                        right = min(x1, x0 + (c + 1) * w + ox)
+                        top = min(y1, y1 - r * h + oy)
+                        bottom = max(y0, y1 - (r + 1) * h - oy)
+                        tile_page.mediabox.lower_left = (left, bottom)
+                        tile_page.mediabox.upper_right = (right, top)
+                        tile_page.cropbox = tile_page.mediabox
+
+                    suffix = f"-R{r + 1}C{c + 1}" if rows > 1 or cols > 1 else ""
+                    tile_id = f"F{file_idx}P{page_no}{suffix}"
+                    tile_path = out_dir / f"{fp.stem}_{tile_id}.pdf"
+                    with tile_path.open("wb") as f:
+                        writer.write(f)
+
+                    tiles.append({
+                        "tile_id": tile_id,
+                        "source": str(fp),
+                        "page": page_no,
+                        "region": (r, c),
+                        "path": str(tile_path),
+                    })
+
+    logger.info(f"[Tiles] {len(file_paths)} file(s) split into {len(tiles)} tile(s)")
+    return tiles
+
+# ------------- MERGE -----------------------------------------
+# assigned IDs from the extraction prompt (V1, L3, E2, HX1, TI1 ...) are only
+# unique within one tile; plant tags (V-101, P-225A, LIC-225) are global
+_AUTO_ID_RE = re.compile(r"^[A-Za-z]{1,3}\d{1,3}$")
+_TAG_RE = re.compile(r"\b[A-Z]{1,4}[\s\-]?\d{2,4}[A-Z]?\b")
+_OFF_PAGE_RE = re.compile(r"sheet|dwg|drawing|off[\s\-]?page|continu|\bopc\b|p&id", re.IGNORECASE)
+
+def _norm(raw: str) -> str:
+    return re.sub(r"[\s_\-]+", "", str(raw)).upper()
+
+def _is_auto_id(raw: str) -> bool:
+    return bool(_AUTO_ID_RE.match(str(raw).strip()))
+
+def _signature(raw_id: str, label: str | None, kind: str | None) -> tuple | None:
+    """
+    What identifies an entity across tiles: a plant tag in its id or label,
+    else its label plus type. None when there is nothing to go on.
+    """
+    if not _is_auto_id(raw_id):
+        return ("tag", _norm(raw_id))
+    tags = _TAG_RE.findall(label or "")
+    if len(tags) == 1:
+        return ("tag", _norm(tags[0]))
+    if label and kind:
+        return ("label", _norm(label), _norm(kind))
+    return None
+
+class _IdResolver:
+    """
+    Maps (tile, raw id) of one entity kind to a single document-wide id.
+    Plant tags are global. A prompt-assigned id is matched by signature to
+    an entity already seen on another tile (overlap regions, repeated pages);
+    otherwise it keeps its id, namespaced per tile (F1P2-V1) when the id is
+    already taken by a different entity.
+    """
+
+    def __init__(self, tiles_items: Dict[str, List[Tuple[str, tuple | None]]]):
+        self.canonical: Dict[str, str] = {}
+        self.ids: Dict[Tuple[str, str], str] = {}
+        by_signature: Dict[tuple, Tuple[str, str]] = {}   # signature -> (first tile, id)
+        taken: Dict[str, tuple] = {}                      # id -> (tile, signature) of its entity
+        self.reconciled = 0
+
+        for tile_id, items in tiles_items.items():
+            # a signature shared by two ids of one tile identifies neither
+            counts = Counter(sig for raw, sig in {(_norm(raw), sig) for raw, sig in items} if sig)
+            for raw, full_sig in items:
+                sig = full_sig if counts[full_sig] == 1 else None
+                key = _norm(raw)
+                self.canonical.setdefault(key, str(raw).strip())
+                if (tile_id, key) in self.ids:
+                    continue
+                match = by_signature.get(sig) if sig else None
+                if match and match[0] != tile_id:
+                    self.ids[(tile_id, key)] = match[1]
+                    self.reconciled += 1
+                    continue
+                resolved = self.canonical[key]
+                owner = taken.get(key)
+                if _is_auto_id(raw) and owner and owner[0] != tile_id:
+                    if full_sig and owner[1] == full_sig:
+                        # same id and same label/type on another tile: one entity
+                        self.reconciled += 1
+                    else:
+                        resolved = f"{tile_id}-{resolved}"
+                taken.setdefault(_norm(resolved), (tile_id, full_sig))
+                self.ids[(tile_id, key)] = resolved
+                if sig:
+                    by_signature.setdefault(sig, (tile_id, resolved))
+
+    def resolve(self, tile_id: str, raw: str | None) -> str | None:
+        if not raw:
+            return raw
+        key = _norm(raw)
+        return self.ids.get((tile_id, key), self.canonical.get(key, str(raw).strip()))
+
+def _merge_fields(target: dict, incoming: dict) -> None:
+    for k, v in incoming.items():
+        if v and not target.get(k):
+            target[k] = v
+        elif k == "context" and v and v not in (target.get(k) or ""):
+            target[k] = f"{target[k]}; {v}"
+
+def merge_pid_responses(parts: List[Tuple[str, PIDResponse]]) -> PIDResponse:
+    """
+    Merge per-tile extractions into one document:
+    - tagged equipment/valves/instruments are matched by normalized tag
+      ("R 101" == "R-101"); prompt-assigned ids are matched across tiles by
+      the tag in their label, or label + type (a valve's location and type),
+      and namespaced per tile (F1P2-V1) only when they still collide,
+    - boundary endpoints that name equipment found on another sheet
+      ("Overhead product to C-230") are rewired to that equipment id, and
+      matching off-page connector names are unified so sheets join up,
+    - line ids are namespaced on collision; a line structurally identical to
+      one already drawn on an earlier tile is dropped, parallel lines within
+      one tile are kept.
+    """
+    dumped = [(tile_id, p.model_dump(by_alias=True)) for tile_id, p in parts]
+
+    eq_res = _IdResolver({
+        t: [(e["id"], _signature(e["id"], e.get("name"), e.get("type"))) for e in d["equipment"]] for t, d in dumped
+    })
+    valve_res = _IdResolver({
+        t: [(v["id"], _signature(v["id"], v.get("location"), v.get("type"))) for v in d["valves"]] for t, d in dumped
+    })
+    inst_res = _IdResolver({
+        t: [(i["id"], _signature(i["id"], i.get("location"), i.get("function"))) for i in d["instruments"]] for t, d in dumped
+    })
+    # lines are matched by structure (endpoints, valves, instruments) below
+    line_res = _IdResolver({t: [(c["line_id"], None) for c in d["connections"]] for t, d in dumped})
+
+    equipment: Dict[str, dict] = {}
+    equipment_tiles: Dict[str, set] = {}
+    valves: Dict[str, dict] = {}
+    instruments: Dict[str, dict] = {}
+    for tile_id, d in dumped:
+        for e in d["equipment"]:
+            e = {**e, "id": eq_res.resolve(tile_id, e["id"])}
+            _merge_fields(equipment.setdefault(e["id"], dict(e)), e)
+            equipment_tiles.setdefault(e["id"], set()).add(tile_id)
+        for v in d["valves"]:
+            v = {**v, "id": valve_res.resolve(tile_id, v["id"])}
+            _merge_fields(valves.setdefault(v["id"], dict(v)), v)
+        for i in d["instruments"]:
+            i = {**i, "id": inst_res.resolve(tile_id, i["id"])}
+            _merge_fields(instruments.setdefault(i["id"], dict(i)), i)
+
+    tagged_equipment = {_norm(eid): eid for eid in equipment if not _is_auto_id(eid)}
+    boundary_names: Dict[str, str] = {}
+
+    def resolve_endpoint(tile_id: str, raw: str | None) -> str | None:
+        if not raw:
+            return raw
+        if _norm(raw) in eq_res.canonical:
+            return eq_res.resolve(tile_id, raw)
+        # off-page connector pointing at a tagged item drawn on another sheet
+        mentioned = [] if not _OFF_PAGE_RE.search(raw) else [
+            tagged_equipment[_norm(t)] for t in _TAG_RE.findall(raw)
+            if _norm(t) in tagged_equipment
+            and tile_id not in equipment_tiles[tagged_equipment[_norm(t)]]
+        ]
+        if len(mentioned) == 1:
+            return mentioned[0]
+        # identical connector / boundary labels across sheets become one node
+        return boundary_names.setdefault(_norm(raw), raw.strip())
+
+    connections: List[dict] = []
+    seen_lines = set()
+    # structure -> most lines with that structure on any one tile so far
+    line_structures: Counter = Counter()
+    utility_lines: List[dict] = []
+    seen_utils = set()
+    system_inputs: List[str] = []
+    system_outputs: List[str] = []
+    process_description = ""
+
+    for tile_id, d in dumped:
+        process_description = process_description or d.get("process_description", "")
+        system_inputs.extend(x for x in d["system_inputs"] if x not in system_inputs)
+        system_outputs.extend(x for x in d["system_outputs"] if x not in system_outputs)
+
+        # parallel lines inside one tile are real; only structures already
+        # drawn on an earlier tile (overlap, repeated page) are dropped
+        claimed, drawn = Counter(line_structures), Counter()
+        for c in d["connections"]:
+            conn = {
+                **c,
+                "line_id": line_res.resolve(tile_id, c["line_id"]),
+                "from_id": resolve_endpoint(tile_id, c["from_id"]),
+                "to_id": resolve_endpoint(tile_id, c["to_id"]),
+                "valves": [valve_res.resolve(tile_id, v) for v in c.get("valves", [])],
+                "instruments": [inst_res.resolve(tile_id, i) for i in c.get("instruments", [])],
+            }
+            key = (conn["from_id"], conn["to_id"], tuple(sorted(conn["valves"])), tuple(sorted(conn["instruments"])))
+            drawn[key] += 1
+            if conn["line_id"] in seen_lines or drawn[key] <= claimed[key]:
+                continue
+            seen_lines.add(conn["line_id"])
+            connections.append(conn)
+        line_structures |= drawn
+
+        for u in d["utility_lines"]:
+            util = {**u, "valves": [valve_res.resolve(tile_id, v) for v in u.get("valves", [])]}
+            key = (_norm(util["utility_type"]), tuple(util["valves"]), util["flow_direction"])
+            if key in seen_utils:
+                continue
+            seen_utils.add(key)
+            utility_lines.append(util)
+
+    merged = PIDResponse(
+        process_description=process_description,
+        system_inputs=system_inputs,
+        system_outputs=system_outputs,
+        equipment=list(equipment.values()),
+        valves=list(valves.values()),
+        instruments=list(instruments.values()),
+        utility_lines=utility_lines,
+        connections=connections,
+    )
+    reconciled = eq_res.reconciled + valve_res.reconciled + inst_res.reconciled
+    logger.info(
+        f"[Tiles] merged {len(parts)} tile(s), {reconciled} repeated item(s) reconciled: {len(merged.equipment)} equipment, "
+        f"{len(merged.valves)} valves, {len(merged.instruments)} instruments, "
+        f"{len(merged.connections)} connections"
+    )
+    return merged
@@ -0,0 +1,222 @@
+import argparse, json, os, sys, threading, time, uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import wraps
+from typing import Any, Dict, Iterator, List, Tuple
+
+from decorators import logger
+
+TRACE_FILE = "trace.jsonl"
+
+# ------------- TRACER ----------------------------------------
+class Tracer:
+    """
+    Appends finished spans as JSON lines to one file (per run folder). Every
+    record carries the tracer's attrs (e.g. Socket.IO sid, run_id) so spans
+    can be correlated with the session that started them.
+    """
+
+    def __init__(self, path: str, **attrs: Any):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.attrs = attrs
+        self._lock = threading.Lock()
+        self._f = open(path, "a", encoding="utf-8")
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps({"trace_id": self.trace_id, **self.attrs, **record}, default=str)
+        with self._lock:
+            if not self._f.closed:
+                self._f.write(line + "\n")
+                self._f.flush()
+
+    @contextmanager
+    def activate(self) -> Iterator["Tracer"]:
+        token = _active.set((self, None))
+        try:
+            yield self
+        finally:
+            _active.reset(token)
+
+    def close(self) -> None:
+        with self._lock:
+            self._f.close()
+
+# (tracer, current span id); None = tracing off, span() is a no-op
+_active: ContextVar[Tuple[Tracer, str | None] | None] = ContextVar("trace_active", default=None)
+
+class Span:
+    __slots__ = ("tracer", "name", "span_id", "parent_id", "attrs", "start", "_t0")
+
+    def __init__(self, tracer: Tracer, name: str, parent_id: str | None, attrs: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def end(self) -> None:
+        self.tracer.write({
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "duration_s": round(time.perf_counter() - self._t0, 6),
+            "thread": threading.current_thread().name,
+            "attrs": self.attrs,
+        })
+
+class _NoopSpan:
+    def set(self, **attrs: Any) -> None:
+        pass
+
+_NOOP = _NoopSpan()
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Span | _NoopSpan]:
+    """Child of the current span; spans must not stay open across a generator yield."""
+    cur = _active.get()
+    if cur is None:
+        yield _NOOP
+        return
+    tracer, parent_id = cur
+    s = Span(tracer, name, parent_id, attrs)
+    token = _active.set((tracer, s.span_id))
+    try:
+        yield s
+    except BaseException as e:
+        s.attrs["error"] = repr(e)
+        raise
+    finally:
+        _active.reset(token)
+        s.end()
+
+def record_span(name: str, start: float, duration_s: float, **attrs: Any) -> None:
+    """Record an interval measured elsewhere (e.g. queue wait) under the current span."""
+    cur = _active.get()
+    if cur is None:
+        return
+    tracer, parent_id = cur
+    tracer.write({
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent_id,
+        "name": name,
+        "start": round(start, 6),
+        "duration_s": round(duration_s, 6),
+        "thread": threading.current_thread().name,
+        "attrs": attrs,
+    })
+
+def traced(name: str):
+    """Decorator: run the function inside span(name)."""
+    def deco(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return deco
+
+def traced_submit(pool, fn, *args, **kwargs):
+    # executor threads do not inherit contextvars; carry the current span over
+    return pool.submit(copy_context().run, fn, *args, **kwargs)
+
+# ------------- SUMMARY ---------------------------------------
+def load_spans(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def _end(s: Dict[str, Any]) -> float:
+    return s["start"] + s["duration_s"]
+
+def critical_path(spans: List[Dict[str, Any]]) -> List[Tuple[int, Dict[str, Any]]]:
+    """
+    (depth, span) chain from the longest root: inside each span, walk back
+    from the child that finished last to the latest child that ended before
+    it started, and so on, expanding every step the same way.
+    """
+    children: Dict[str | None, List[dict]] = defaultdict(list)
+    ids = {s["span_id"] for s in spans}
+    for s in spans:
+        children[s["parent_id"] if s["parent_id"] in ids else None].append(s)
+    if not children[None]:
+        return []
+
+    def expand(s: Dict[str, Any], depth: int) -> List[Tuple[int, Dict[str, Any]]]:
+        kids = sorted(children.get(s["span_id"], []), key=_end)
+        chain: List[dict] = []
+        while kids:
+            last = kids.pop()
+            chain.append(last)
+            kids = [k for k in kids if _end(k) <= last["start"] + 1e-6]
+        out = [(depth, s)]
+        for k in reversed(chain):
+            out.extend(expand(k, depth + 1))
+        return out
+
+    return expand(max(children[None], key=lambda s: s["duration_s"]), 0)
+
+def _label(s: Dict[str, Any]) -> str:
+    a = s.get("attrs") or {}
+    keys = [a[k] for k in ("line_id", "parameter", "guide_word", "target") if a.get(k)]
+    extra = f" [{':'.join(map(str, keys))}]" if keys else ""
+    return f"{s['name']}{extra}"
+
+def _table(by_name: Dict[str, List[float]]) -> List[str]:
+    out = [f"{'span':<20} {'count':>6} {'total s':>10} {'p50 s':>8} {'p95 s':>8} {'max s':>8}"]
+    for name, ds in sorted(by_name.items(), key=lambda kv: -sum(kv[1])):
+        ds = sorted(ds)
+        p = lambda q: ds[min(len(ds) - 1, int(q * len(ds)))]
+        out.append(f"{name:<20} {len(ds):>6} {sum(ds):>10.3f} {p(0.5):>8.3f} {p(0.95):>8.3f} {ds[-1]:>8.3f}")
+    return out
+
+def summarize(path: str, top: int = 10) -> str:
+    spans = load_spans(path)
+    out = [f"{path}: {len(spans)} spans"]
+
+    # a full run's critical path has one step per deviation: show the steps
+    # that cost the most and where the path's time goes by span name
+    cp = critical_path(spans)
+    if cp:
+        root = cp[0][1]
+        out.append(f"\nCritical path: {_label(root)} {root['duration_s']:.3f}s, {len(cp) - 1} steps")
+        for depth, s in sorted(cp[1:], key=lambda ds: -ds[1]["duration_s"])[:top]:
+            out.append(f"  {'  ' * (depth - 1)}{_label(s):<50} {s['duration_s']:9.3f}s")
+        cp_by_name: Dict[str, List[float]] = defaultdict(list)
+        for _, s in cp[1:]:
+            cp_by_name[s["name"]].append(s["duration_s"])
+        out.extend("  " + line for line in _table(cp_by_name))
+
+    roots = {s["span_id"] for s in spans if not s["parent_id"]}
+    ranked = sorted((s for s in spans if s["span_id"] not in roots), key=lambda s: -s["duration_s"])
+    out.append(f"\nSlowest {top} spans:")
+    for s in ranked[:top]:
+        out.append(f"  {_label(s):<50} {s['duration_s']:9.3f}s  ({s.get('thread', '')})")
+
+    by_name: Dict[str, List[float]] = defaultdict(list)
+    for s in spans:
+        by_name[s["name"]].append(s["duration_s"])
+    out.append("\nAll spans:")
+    out.extend(_table(by_name))
+    return "\n".join(out)
+
+def main(argv: List[str] | None = None) -> None:
+    """python -m module.trace_module static/hazop/<folder>/runs/<run_id>/trace.jsonl"""
+    ap = argparse.ArgumentParser(description="Critical path and slowest spans of a trace.jsonl")
+    ap.add_argument("path")
+    ap.add_argument("--top", type=int, default=10)
+    args = ap.parse_args(argv)
+    if not os.path.exists(args.path):
+        logger.error(f"Trace not found: {args.path}")
+        sys.exit(1)
+    print(summarize(args.path, args.top))
+
+if __name__ == "__main__":
+    main()
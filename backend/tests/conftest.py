@@ -0,0 +1,16 @@
+import os, sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+# modules import each other flat from backend/ (as app.py does)
+sys.path.insert(0, str(BACKEND_DIR))
+# llm_module refuses to import without a key; no test calls the API
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+@pytest.fixture
+def backend_cwd(monkeypatch):
+    # prompts and example files are read relative to backend/
+    monkeypatch.chdir(BACKEND_DIR)
+    return BACKEND_DIR
@@ -0,0 +1,103 @@
+import argparse, os, shutil
+
+import pandas as pd
+import pytest
+
+import cli
+from module.runs_module import finish_run, list_runs, start_run
+from module.schema_json import HAZOP_HEADERS
+from module.sink_module import iter_xlsx_rows, write_xlsx_rows
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch, backend_cwd):
+    drawing = tmp_path / "in" / "c4-009.json"
+    drawing.parent.mkdir()
+    shutil.copy(backend_cwd / "static" / "data" / "c4-009.json", drawing)
+    # prompt templates are read from static/file relative to the cwd
+    (tmp_path / "static").mkdir()
+    (tmp_path / "static" / "file").symlink_to(backend_cwd / "static" / "file")
+    monkeypatch.chdir(tmp_path)
+    args = argparse.Namespace(
+        output_folder="batch", selections=None, group_study_nodes=False, engine="sdk", output_mode="csv",
+        streaming=False, hedge=False, routing=False, process_others=False, grid=None, preprocess=False,
+        re_extract=False, log_every=10,
+    )
+    base_dir = str(tmp_path / "static" / "hazop" / "batch" / "c4-009")
+    return drawing, args, base_dir
+
+def _nodes(path: str) -> list:
+    return [r[0] for r in iter_xlsx_rows(path)]
+
+def _statuses(base_dir: str) -> dict:
+    return {r["run_id"]: r["status"] for r in list_runs(base_dir)}
+
+def _writing_agent(new_rows: list, fail: bool):
+    # carries the previous run's rows over, like plan_carry_over, then adds its own
+    def run_hazop_agent(**kwargs):
+        rows = []
+        previous = kwargs["previous_output_folder"]
+        if previous and os.path.exists(os.path.join(previous, "llm_response_log.csv")):
+            rows = pd.read_csv(os.path.join(previous, "llm_response_log.csv"))["Node"].tolist()
+        for node in rows:
+            yield node, 0
+        for node in new_rows:
+            rows.append(node)
+            _write(kwargs, rows)
+            yield node, 100
+        if fail:
+            raise RuntimeError("provider down")
+    return run_hazop_agent
+
+def _write(paths: dict, nodes: list) -> None:
+    rows = [[n] + ["N/A"] * (len(HAZOP_HEADERS) - 1) for n in nodes]
+    write_xlsx_rows(paths["excel_path"], [iter(rows)])
+    write_xlsx_rows(paths["parsed_excel_path"], [iter(rows)])
+    pd.DataFrame({"Node": nodes}).to_csv(paths["llm_response_log_path"], index=False)
+
+def test_resume_supersedes_only_the_carried_over_run_after_success(workspace, monkeypatch):
+    drawing, args, base_dir = workspace
+    older, newer = start_run(base_dir, "hazop-c4-009.xlsx"), start_run(base_dir, "hazop-c4-009.xlsx")
+    finish_run(older, "failed")
+    finish_run(newer, "failed")
+    # newer has logged responses, so it is the carry-over source
+    _write(cli.run_paths(newer), ["A", "B"])
+
+    monkeypatch.setattr(cli, "run_hazop_agent", _writing_agent(["C"], fail=True))
+    report = cli.run_drawing("c4-009", drawing, args)
+    assert report["status"] == "failed"
+    statuses = _statuses(base_dir)
+    assert statuses[older["run_id"]] == "failed" and statuses[newer["run_id"]] == "failed"
+
+    monkeypatch.setattr(cli, "run_hazop_agent", _writing_agent(["D"], fail=False))
+    report = cli.run_drawing("c4-009", drawing, args)
+    assert report["status"] == "complete" and report["carried_over"] == 3
+    statuses = _statuses(base_dir)
+    assert statuses[newer["run_id"]] == "superseded"
+    assert statuses[older["run_id"]] == "failed"
+    assert statuses[report["run_id"]] == "complete"
+
+    # a completed drawing is skipped on the next pass
+    assert cli.run_drawing("c4-009", drawing, args)["status"] == "skipped"
+
+def test_resume_after_two_failures_merges_each_row_once(workspace, monkeypatch):
+    drawing, args, base_dir = workspace
+    workbook = os.path.join(base_dir, "hazop-c4-009.xlsx")
+
+    monkeypatch.setattr(cli, "run_hazop_agent", _writing_agent(["A", "B"], fail=True))
+    first = cli.run_drawing("c4-009", drawing, args)
+    assert first["status"] == "failed"
+    assert _nodes(workbook) == ["A", "B"]
+
+    monkeypatch.setattr(cli, "run_hazop_agent", _writing_agent(["C"], fail=True))
+    second = cli.run_drawing("c4-009", drawing, args)
+    assert second["status"] == "failed"
+    # the partial resume holds A, B; the run it resumed is left out of the merge
+    assert _nodes(workbook) == ["A", "B", "C"]
+
+    monkeypatch.setattr(cli, "run_hazop_agent", _writing_agent(["D"], fail=False))
+    third = cli.run_drawing("c4-009", drawing, args)
+    assert third["status"] == "complete" and third["carried_over"] == 3
+    assert _nodes(workbook) == ["A", "B", "C", "D"]
+    statuses = _statuses(base_dir)
+    assert statuses[first["run_id"]] == statuses[second["run_id"]] == "superseded"
+    assert statuses[third["run_id"]] == "complete"
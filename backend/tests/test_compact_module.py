@@ -0,0 +1,55 @@
+import re
+
+import pandas as pd
+
+from module.compact_module import encode_compact_rows, expand_compact_rows, is_compact_output
+from module.fewshot_module import estimate_tokens
+from module.plan_module import HAZOP_CAUSE_CHECKLIST
+from module.risk_module import derive_risk_columns
+
+NODE, GUIDE_WORD, PARAMETER = "R-101 → S-101", "More", "Pressure"
+
+def _full_rows(n: int = 5) -> list:
+    rows = []
+    for i in range(n):
+        s, l = i % 5 + 1, (i * 2) % 5 + 1
+        rows.append([
+            NODE, GUIDE_WORD, PARAMETER, "High Pressure", HAZOP_CAUSE_CHECKLIST[i], f"Consequence {i}",
+            "", s, l, None, "",
+            "PSV; alarm", "", max(s - 1, 1), l, None, "",
+            "Add interlock", 1, 1, None, ["Engineering", "Maintenance", "Operations"][i % 3],
+        ])
+    # RR / categories as the local matrix derives them
+    out, _, _ = derive_risk_columns(pd.DataFrame(rows))
+    return out.values.tolist()
+
+def test_compact_round_trip():
+    rows = _full_rows()
+    text = encode_compact_rows(rows)
+    assert is_compact_output(text)
+    assert text.splitlines()[0] == "D|High Pressure"
+    assert expand_compact_rows(text, node=NODE, guide_word=GUIDE_WORD, parameter=PARAMETER) == rows
+
+def test_expand_skips_malformed_lines():
+    text = "\n".join([
+        "D|High Pressure",
+        "1|Overpressure|3|3|PSV|2|2|Add vent|1|1|E",
+        "2|too|few|fields",
+        "99|Out of range|3|3|PSV|2|2|Add vent|1|1|E",
+        "x|Not a number|3|3|PSV|2|2|Add vent|1|1|E",
+        "3|Bad S|9|3|PSV|2|2|Add vent|1|1|O",
+    ])
+    rows = expand_compact_rows(text, node=NODE, guide_word=GUIDE_WORD, parameter=PARAMETER)
+    assert [r[4] for r in rows] == [HAZOP_CAUSE_CHECKLIST[0], HAZOP_CAUSE_CHECKLIST[2]]
+    assert rows[0][9] == 3 and rows[0][6] == "Medium"
+    assert rows[1][9] == "N/A" and rows[1][6] == "N/A" and rows[1][21] == "Operations"
+
+def test_compact_prompt_has_no_rr_instructions(backend_cwd):
+    from module.agent_module import get_hazop_fewshot_prompt
+
+    csv_prompt = get_hazop_fewshot_prompt(output_format="csv")
+    compact_prompt = get_hazop_fewshot_prompt(output_format="compact")
+    rr_lines = [l for l in compact_prompt.prefix.splitlines() if re.search(r"\bRR\b|\bRL\b|Risk Category", l)]
+    assert [l.strip() for l in rr_lines] == ["Do NOT write RR or risk categories; they are computed from S and L."]
+    assert "Severity S: S5" in compact_prompt.prefix
+    assert estimate_tokens(compact_prompt.prefix + compact_prompt.suffix) < estimate_tokens(csv_prompt.prefix + csv_prompt.suffix)
@@ -0,0 +1,46 @@
+import pandas as pd
+
+from module.diff_module import diff_pid, match_unchanged_inputs, plan_carry_over
+
+def _info(line_id, **overrides):
+    info = {
+        "line_id": line_id, "line_label": line_id, "node": "D-1 → P-1",
+        "valves": ["V-1"], "instruments": [], "context": "suction",
+        "neighborhood": "N/A", "process_description": "",
+    }
+    info.update(overrides)
+    return info
+
+def test_diff_pid_reports_added_removed_and_modified():
+    old = {
+        "process_description": "a",
+        "connections": [{"line_id": "L1", "from_id": "A", "to_id": "B"}, {"line_id": "L2", "from_id": "B", "to_id": "C"}],
+        "equipment": [{"id": "A", "type": "drum"}],
+    }
+    new = {
+        "process_description": "a",
+        "connections": [{"line_id": "L1", "from_id": "A", "to_id": "X"}, {"line_id": "L3", "from_id": "X", "to_id": "C"}],
+        "equipment": [{"id": "A", "type": "drum"}],
+    }
+    diff = diff_pid({"pid_data": old}, new)
+
+    assert diff["connections"] == {"added": ["L3"], "removed": ["L2"], "modified": {"L1": ["to_id"]}}
+    assert diff["equipment"] == {"added": [], "removed": [], "modified": {}}
+    assert diff["process_description_changed"] is False
+
+def test_renamed_identical_line_matches_and_changed_line_does_not():
+    old = [_info("L1"), _info("L2", context="discharge")]
+    new = [_info("L10"), _info("L2", context="discharge, rerouted")]
+    assert match_unchanged_inputs(old, new) == {"L10": "L1"}
+
+def test_plan_carry_over_rekeys_previous_outputs(tmp_path):
+    pd.DataFrame([
+        {"LineID": "L1", "Parameter": "Flow", "GuideWord": "No", "RawOutput": "first"},
+        {"LineID": "L1", "Parameter": "Flow", "GuideWord": "No", "RawOutput": "retry"},
+        {"LineID": "L2", "Parameter": "Flow", "GuideWord": "No", "RawOutput": "stale"},
+    ]).to_csv(tmp_path / "llm_response_log.csv", index=False)
+
+    old = [_info("L1"), _info("L2", context="discharge")]
+    new = [_info("L10"), _info("L2", context="discharge, rerouted")]
+    assert plan_carry_over(old, new, tmp_path) == {("L10", "Flow", "No"): "retry"}
+    assert plan_carry_over(old, new, tmp_path / "missing") == {}
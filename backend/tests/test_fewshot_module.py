@@ -0,0 +1,57 @@
+from module.fewshot_module import (
+    HazopExampleIndex, RelevantHazopExampleSelector, build_example_index, is_accepted_row, load_history_rows,
+)
+from module.plan_module import HAZOP_CAUSE_CHECKLIST
+from module.schema_json import HAZOP_HEADERS
+from module.sink_module import write_xlsx_rows
+
+def _row(guide_word="No", parameter="Flow", cause=HAZOP_CAUSE_CHECKLIST[0], s=3, l=3) -> list:
+    row = ["N/A"] * len(HAZOP_HEADERS)
+    row[:6] = ["L1: D-1 → P-1", guide_word, parameter, f"{guide_word} {parameter}", cause, "Loss of feed"]
+    for i in (7, 13, 18):
+        row[i] = s
+    for i in (8, 14, 19):
+        row[i] = l
+    return row
+
+def test_only_well_formed_checklist_rows_are_accepted():
+    assert is_accepted_row([str(v) for v in _row()])
+    assert not is_accepted_row([str(v) for v in _row(cause="L9")])                  # misparsed
+    assert not is_accepted_row([str(v) for v in _row(cause="Pump failure")])        # off-checklist
+    assert not is_accepted_row([str(v) for v in _row(s=6)])
+    assert not is_accepted_row([str(v) for v in _row(l="High")])
+    assert not is_accepted_row([str(v) for v in _row(guide_word="Others", parameter="Process")])
+
+def test_history_keeps_only_accepted_rows(tmp_path, monkeypatch):
+    (tmp_path / "static" / "hazop" / "run").mkdir(parents=True)
+    write_xlsx_rows(
+        str(tmp_path / "static" / "hazop" / "run" / "parsed_rows.xlsx"),
+        [iter([_row(), _row(cause="L9"), _row(s=0)])],
+    )
+    monkeypatch.chdir(tmp_path)
+    rows = load_history_rows()
+    assert [r[4] for r in rows] == [HAZOP_CAUSE_CHECKLIST[0]]
+
+def _selector(rows, **kwargs) -> RelevantHazopExampleSelector:
+    return RelevantHazopExampleSelector(HazopExampleIndex([[str(v) for v in r] for r in rows]), **kwargs)
+
+def test_selector_ranks_matching_deviation_first():
+    rows = [
+        _row("More", "Temperature", HAZOP_CAUSE_CHECKLIST[1]),
+        _row("No", "Flow", HAZOP_CAUSE_CHECKLIST[3]),
+        _row("Less", "Pressure", HAZOP_CAUSE_CHECKLIST[0]),
+        _row("No", "Flow", HAZOP_CAUSE_CHECKLIST[11]),
+    ]
+    selector = _selector(rows, max_rows=2)
+    example = selector.select_examples({"guide_word": "No", "parameter": "Flow", "context": ""})[0]
+    table = [line.split(",") for line in example["table"].splitlines()]
+    assert [(r[1], r[2]) for r in table] == [("No", "Flow"), ("No", "Flow")]
+    assert selector.last_selection["rows"] == 2
+
+def test_selector_falls_back_to_static_sample_rows(backend_cwd):
+    index = build_example_index(history_pattern=None)
+    assert len(index) > 0
+    selector = RelevantHazopExampleSelector(index, max_rows=3)
+    # no term of the query occurs in the sample rows
+    example = selector.select_examples({"guide_word": "Zzz", "parameter": "Qqq", "context": ""})[0]
+    assert example["table"].splitlines() == [",".join(r[:22]) for r in index.rows[:3]]
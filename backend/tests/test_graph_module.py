@@ -0,0 +1,69 @@
+from module.graph_module import build_pid_graph, partition_study_nodes, unwrap_pid_data
+
+def _pid():
+    return {
+        "process_description": "Feed drum to reactor",
+        "equipment": [
+            {"id": "D-1", "type": "drum"},
+            {"id": "R-1", "type": "reactor"},
+        ],
+        "valves": [],
+        "instruments": [{"id": "FT-1", "function": "flow transmitter"}],
+        "connections": [
+            {"line_id": "L1", "from_id": "Feed", "to_id": "D-1", "instruments": ["FT-1"]},
+            {"line_id": "L2", "from_id": "D-1", "to_id": "R-1", "instruments": ["FT-1"]},
+            {"line_id": "L3", "from_id": "D-1", "to_id": "Flare"},
+            {"line_id": "L4", "from_id": "R-1", "to_id": "Product"},
+        ],
+    }
+
+def test_unwrap_accepts_file_and_openai_wrappers():
+    pid = _pid()
+    assert unwrap_pid_data({"pid_data": pid, "metadata": {}}) is pid
+    assert unwrap_pid_data({"choices": [{"message": {"parsed": pid}}]}) is pid
+
+def test_line_neighbourhood():
+    graph = build_pid_graph(_pid())
+    ctx = graph.line_context("L2")
+
+    assert ctx["upstream_lines"] == ["L1"]
+    assert ctx["downstream_lines"] == ["L4"]
+    assert ctx["parallel_lines"] == ["L3"]
+    assert ctx["upstream_equipment"] == ["D-1"]
+    assert ctx["downstream_equipment"] == ["R-1"]
+    assert ctx["shared_instruments"] == {"FT-1": ["L1"]}
+    assert "FT-1 (flow transmitter; also on L1)" in graph.describe_neighborhood("L2")
+
+def _trains():
+    # drum -> pump A / pump B (parallel, shared suction valve), then a straight
+    # run through a cooler, and a Phase-2 line that must stay on its own
+    return {
+        "equipment": [
+            {"id": "D-1", "type": "drum"},
+            {"id": "P-1A", "type": "pump"},
+            {"id": "P-1B", "type": "pump"},
+            {"id": "E-1", "type": "heat exchanger"},
+        ],
+        "valves": [], "instruments": [],
+        "connections": [
+            {"line_id": "L1", "from_id": "D-1", "to_id": "P-1A", "valves": ["V-1"], "context": "suction (Phase-1)"},
+            {"line_id": "L2", "from_id": "D-1", "to_id": "P-1B", "valves": ["V-1"], "context": "suction (Phase-1)"},
+            {"line_id": "L3", "from_id": "P-1A", "to_id": "E-1", "instruments": ["TI-1"]},
+            {"line_id": "L4", "from_id": "E-1", "to_id": "Product", "instruments": ["TI-1"]},
+            {"line_id": "L5", "from_id": "D-1", "to_id": "P-1A", "valves": ["V-1"], "context": "startup (phase-2)"},
+        ],
+    }
+
+def test_partition_groups_parallel_and_straight_runs_by_phase():
+    nodes = partition_study_nodes(build_pid_graph(_trains()))
+
+    assert [n["line_ids"] for n in nodes] == [["L1", "L2"], ["L3", "L4"], ["L5"]]
+    assert nodes[0]["node"] == "D-1 → P-1A / P-1B"
+    assert nodes[1]["node"] == "P-1A → Product (via E-1)"
+    assert [n["phase"] for n in nodes] == ["Phase-1", None, "Phase-2"]
+    assert nodes[0]["valves"] == ["V-1"]
+
+def test_partition_splits_oversized_groups():
+    nodes = partition_study_nodes(build_pid_graph(_trains()), max_lines_per_node=1)
+    assert [n["line_ids"] for n in nodes] == [["L1"], ["L2"], ["L3"], ["L4"], ["L5"]]
+    assert [n["node_id"] for n in nodes] == ["N1", "N2", "N3", "N4", "N5"]
@@ -0,0 +1,77 @@
+import json
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+from pydantic import BaseModel
+
+from module import agent_module, llm_module
+from module.llm_module import InvalidOutputError, call_structured_completion
+
+class _Answer(BaseModel):
+    value: int
+
+class _FakeResponses:
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    def parse(self, **kwargs):
+        self.calls += 1
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+def _response(parsed, text=""):
+    return SimpleNamespace(
+        output_parsed=parsed, output_text=text, model="m",
+        usage={"input_tokens": 1, "output_tokens": 2, "total_tokens": 3},
+    )
+
+def _validation_error():
+    try:
+        _Answer.model_validate_json('{"value": "x"}')
+    except Exception as e:
+        return e
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(llm_module.time, "sleep", lambda s: None)
+
+def test_invalid_structured_output_is_retried():
+    responses = _FakeResponses([_validation_error(), _response(_Answer(value=4))])
+    result = call_structured_completion("p", _Answer, client=SimpleNamespace(responses=responses))
+    assert result["parsed"].value == 4
+    assert responses.calls == 2
+
+def test_refusal_raises_invalid_output_after_retries():
+    responses = _FakeResponses([_response(None, "I can't help with that.")] * 3)
+    with pytest.raises(InvalidOutputError) as exc:
+        call_structured_completion("p", _Answer, client=SimpleNamespace(responses=responses), max_retries=3)
+    assert responses.calls == 3
+    assert exc.value.raw == "I can't help with that."
+
+def test_invalid_structured_deviation_is_logged(tmp_path, backend_cwd, monkeypatch):
+    def refuse(*args, **kwargs):
+        raise InvalidOutputError("model returned no parsed output (refusal or empty)", raw="refused")
+    monkeypatch.setattr(agent_module, "call_structured_completion", refuse)
+
+    with open("static/data/c4-009.json", encoding="utf-8") as f:
+        pid_data = agent_module.unwrap_pid_data(json.load(f))
+    line_id = agent_module.list_all_connections(pid_data)[0]["line_id"]
+    paths = {
+        "excel_path": str(tmp_path / "hazop.xlsx"),
+        "parsed_excel_path": str(tmp_path / "parsed_rows.xlsx"),
+        "token_log_path": str(tmp_path / "token_log.csv"),
+        "error_log_path": str(tmp_path / "error_log.csv"),
+        "llm_response_log_path": str(tmp_path / "llm_response_log.csv"),
+    }
+    list(agent_module.run_hazop_agent(
+        pid_data=pid_data, **paths, output_mode="structured", example_token_budget=None,
+        selections=[{"line_id": line_id, "parameter": "Flow", "guide_word": "No"}],
+    ))
+
+    errors = pd.read_csv(paths["error_log_path"])
+    assert errors[["LineID", "Parameter", "GuideWord", "RawOutput"]].values.tolist() == [[line_id, "Flow", "No", "refused"]]
+    assert errors["Reason"].str.startswith("Invalid structured output").all()
@@ -0,0 +1,37 @@
+from module.plan_module import plan_selections
+
+INFOS = [
+    {"line_id": "L1", "node": "A → B", "valves": [], "instruments": [], "context": "", "neighborhood": "", "process_description": ""},
+    {"line_id": "N2", "line_ids": ["L2", "L3"], "node": "B → C", "valves": [], "instruments": [], "context": "", "neighborhood": "", "process_description": ""},
+]
+
+def _sel(line_id, parameter, guide_word):
+    return {"line_id": line_id, "parameter": parameter, "guide_word": guide_word}
+
+def test_items_follow_prompt_field_order():
+    plan = plan_selections([
+        _sel("N2", "Flow", "No"),
+        _sel("L1", "Pressure", "No"),
+        _sel("L1", "Flow", "More"),
+        _sel("L1", "Flow", "No"),
+    ], INFOS)
+    # line (drawing order), then guide word, then parameter, as rendered in the prompt
+    assert [(i["line_id"], i["guide_word"], i["parameter"]) for i in plan["items"]] == [
+        ("L1", "No", "Flow"), ("L1", "No", "Pressure"), ("L1", "More", "Flow"), ("N2", "No", "Flow"),
+    ]
+
+def test_invalid_and_duplicate_selections():
+    plan = plan_selections([
+        _sel("L1", "Flow", "No"),
+        _sel("L1", "Flow", "No"),
+        _sel("L2", "Flow", "No"),          # member line of study node N2
+        _sel("L3", "Flow", "No"),          # same study node, same deviation
+        _sel("L9", "Flow", "No"),
+        _sel("L1", "Colour", "No"),
+        _sel("L1", "Flow", ""),
+    ], INFOS)
+    assert [(i["line_id"], i["parameter"]) for i in plan["items"]] == [("L1", "Flow"), ("N2", "Flow")]
+    assert plan["duplicates"] == 2
+    assert [s["reason"] for s in plan["skipped"]] == [
+        "line_id L9 not found in pid_data", "unknown parameter 'Colour'", "missing line_id, parameter or guide_word",
+    ]
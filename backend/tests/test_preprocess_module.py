@@ -0,0 +1,13 @@
+from module.preprocess_module import DEFAULT_PREPROCESS, preprocess_sources
+
+def test_default_shrinks_the_upload(backend_cwd):
+    out, report = preprocess_sources(["static/image/h2o2.pdf"], DEFAULT_PREPROCESS)
+    assert [name for name, _ in out] == ["h2o2_p1.png"]
+    assert report["bytes_after"] < report["bytes_before"]
+    assert report["est_image_tokens_after"] <= report["est_image_tokens_before"]
+
+def test_vector_pdf_passes_through_when_raster_is_larger(backend_cwd):
+    out, report = preprocess_sources(["static/image/h2o2.pdf"], {"dpi": 150, "threshold": 0})
+    assert out == ["static/image/h2o2.pdf"]
+    assert report["bytes_after"] == report["bytes_before"]
+    assert report["files"][0]["steps"][0].startswith("passthrough")
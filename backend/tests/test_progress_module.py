@@ -0,0 +1,35 @@
+from module.progress_module import ProgressPublisher
+
+class _Client:
+    """Records emits; acks only when told to (a slow client)."""
+
+    def __init__(self):
+        self.payloads = []
+        self.callbacks = []
+
+    def __call__(self, event, payload, callback=None):
+        self.payloads.append(payload)
+        self.callbacks.append(callback)
+
+def test_slow_client_gets_every_item_in_bounded_batches():
+    client = _Client()
+    progress = ProgressPublisher(client, total=500, interval_s=60, ack_timeout_s=60, max_items_per_batch=200)
+    for i in range(500):
+        progress.update({"line_id": f"L{i}"}, tokens_used=1)
+    progress.flush()
+
+    items = [it["line_id"] for p in client.payloads for it in p["items"]]
+    assert items == [f"L{i}" for i in range(500)]
+    assert max(len(p["items"]) for p in client.payloads) == 200
+    assert client.payloads[-1]["done"] == 500 and client.payloads[-1]["tokens"] == 500
+
+def test_done_never_exceeds_total():
+    client = _Client()
+    progress = ProgressPublisher(client, total=2, interval_s=0)
+    for i in range(3):
+        progress.update({"line_id": f"L{i}"})
+        client.callbacks[-1]()
+    progress.flush()
+    for p in client.payloads:
+        assert p["done"] <= p["total"]
+        assert p["eta_s"] is None or p["eta_s"] >= 0
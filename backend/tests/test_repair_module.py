@@ -0,0 +1,45 @@
+import pandas as pd
+
+from module.compact_module import expand_compact_rows
+from module.plan_module import HAZOP_CAUSE_CHECKLIST
+from module.repair_module import CAUSE_COL, format_rows_output, match_causes, merge_repaired_rows
+from module.risk_module import derive_risk_columns
+from module.schema_json import HazopRowsResponse
+
+NODE, GUIDE_WORD, PARAMETER = "R-101 → S-101", "No", "Flow"
+
+def _row(cause: str, s: int = 3) -> list:
+    row = [
+        NODE, GUIDE_WORD, PARAMETER, "No Flow", cause, "Loss of feed",
+        "", s, 3, 0, "", "Low flow alarm", "", 2, 2, 0, "", "Add check valve", 1, 1, 0, "Operations",
+    ]
+    out, _, _ = derive_risk_columns(pd.DataFrame([row]))
+    return out.values.tolist()[0]
+
+def _causes(rows: list) -> list:
+    return [r[CAUSE_COL] for r in rows]
+
+def test_match_causes_reports_missing_and_invalid():
+    rows = [_row(c) for c in HAZOP_CAUSE_CHECKLIST[:3]] + [_row("Something unrelated"), _row(HAZOP_CAUSE_CHECKLIST[4], s=9)]
+    coverage = match_causes(rows)
+    assert coverage["causes"] == [0, 1, 2]
+    assert coverage["invalid"] == 1 and coverage["unmatched"] == 1
+    assert coverage["missing"] == list(range(3, len(HAZOP_CAUSE_CHECKLIST)))
+    assert _causes(coverage["rows"])[-1] == "Something unrelated"
+
+def test_repaired_cause_replaces_its_malformed_original():
+    malformed = "Pump failure in unexpected wording"          # resembles cause 15, matches none
+    original = [_row(HAZOP_CAUSE_CHECKLIST[0]), _row(malformed), _row("Meteor strike")]
+    repaired = [_row(HAZOP_CAUSE_CHECKLIST[14]), _row(HAZOP_CAUSE_CHECKLIST[0])]
+
+    merged = merge_repaired_rows(original, repaired)
+    assert _causes(merged) == [HAZOP_CAUSE_CHECKLIST[0], HAZOP_CAUSE_CHECKLIST[14], "Meteor strike"]
+    assert merged[0] is original[0]                             # covered causes keep the original row
+
+def test_repaired_rows_round_trip_through_the_log_format():
+    rows = [_row(c) for c in HAZOP_CAUSE_CHECKLIST[:2]]
+    compact = format_rows_output(rows, "compact")
+    assert expand_compact_rows(compact, node=NODE, guide_word=GUIDE_WORD, parameter=PARAMETER) == rows
+    structured = format_rows_output(rows, "structured")
+    assert [r.to_row() for r in HazopRowsResponse.model_validate_json(structured).rows] == rows
+    assert format_rows_output(rows).splitlines()[1].split(",")[CAUSE_COL] == HAZOP_CAUSE_CHECKLIST[1]
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from module.results_module import INDEX_FILE, PARSED_ROWS, query_results
+from module.sink_module import write_xlsx_rows
+
+def _row(node, guide_word, parameter, rr, risk="Medium"):
+    row = [None] * 22
+    row[:4] = [node, guide_word, parameter, f"{guide_word} {parameter}"]
+    row[12], row[15] = risk, rr
+    return row
+
+ROWS = [
+    _row("L1: D-1 → P-1", "No", "Flow", 4),
+    _row("L1: D-1 → P-1", "More", "Pressure", 16, "High"),
+    _row("L2: P-1 → E-1", "No", "Flow", 9),
+    _row("L2: P-1 → E-1", "Less", "Flow", None),
+    _row("L3: E-1 → Product", "More", "Temperature", 9),
+    _row("L3_A: E-1 → Drain", "No", "Flow", 2, "Low"),
+]
+
+@pytest.fixture
+def results_dir(tmp_path):
+    write_xlsx_rows(str(tmp_path / PARSED_ROWS), [iter(ROWS)])
+    return str(tmp_path)
+
+def test_filters_and_sort(results_dir):
+    page = query_results(results_dir, {"parameter": ["Flow"], "guide_word": ["No"]}, sort="-rr")
+    assert page["total"] == 3
+    assert [r["rr"] for r in page["rows"]] == [9, 4, 2]
+
+    page = query_results(results_dir, {"risk": ["High", "Low"]}, sort="rr")
+    assert [r["rr"] for r in page["rows"]] == [2, 16]
+
+    # LIKE wildcards in the line filter are literal
+    assert [r["node"] for r in query_results(results_dir, {"line": "L3_"})["rows"]] == ["L3_A: E-1 → Drain"]
+
+@pytest.mark.parametrize("sort", ["-rr", "rr"])
+def test_cursor_pages_cover_every_row_once(results_dir, sort):
+    seen, cursor = [], None
+    while True:
+        page = query_results(results_dir, sort=sort, limit=2, cursor=cursor)
+        seen.extend(r["id"] for r in page["rows"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert sorted(seen) == list(range(1, len(ROWS) + 1))
+    # rows without a number sort last when descending, first when ascending
+    missing = ROWS.index(_row("L2: P-1 → E-1", "Less", "Flow", None)) + 1
+    assert seen[-1 if sort == "-rr" else 0] == missing
+
+def test_invalid_cursor_and_sort_are_rejected(results_dir):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        query_results(results_dir, cursor="not-a-cursor")
+    with pytest.raises(ValueError, match="Unknown sort"):
+        query_results(results_dir, sort="node")
+
+def test_index_is_rebuilt_when_results_change(results_dir):
+    assert query_results(results_dir)["total"] == len(ROWS)
+    assert os.path.exists(os.path.join(results_dir, INDEX_FILE))
+
+    write_xlsx_rows(os.path.join(results_dir, PARSED_ROWS), [iter(ROWS + [_row("L4: X → Y", "No", "Level", 1)])])
+    assert query_results(results_dir)["total"] == len(ROWS) + 1
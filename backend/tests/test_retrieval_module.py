@@ -0,0 +1,54 @@
+import numpy as np
+
+from module.retrieval_module import EmbeddingIndex, HashingEmbedder, ProcessRetriever, chunk_text
+
+DESCRIPTION = (
+    "Hydrogen peroxide is pumped from the storage tank to the reactor. "
+    "The reactor jacket is cooled with chilled water. "
+    "Off-gas from the reactor is vented through a caustic scrubber. "
+    "Product is transferred by pump to the loading station."
+)
+
+class CountingEmbedder(HashingEmbedder):
+    def __init__(self):
+        super().__init__(dim=64)
+        self.calls = []
+
+    def embed(self, texts):
+        self.calls.append(list(texts))
+        return super().embed(texts)
+
+def test_hashing_embedder_is_deterministic_and_normalised():
+    texts = ["reactor cooling water", "reactor cooling water", "scrubber vent", ""]
+    a, b = HashingEmbedder().embed(texts), HashingEmbedder().embed(texts)
+    assert np.array_equal(a, b)
+    assert np.allclose(np.linalg.norm(a[:3], axis=1), 1.0)
+    assert np.array_equal(a[0], a[1]) and not np.array_equal(a[0], a[2])
+    assert not a[3].any()
+
+def test_index_embeds_each_text_once_and_persists(tmp_path):
+    embedder = CountingEmbedder()
+    index = EmbeddingIndex(embedder, root=str(tmp_path))
+    assert index.add_document("doc:a", ["tank", "reactor"]) == 2
+    assert index.add_document("doc:a", ["tank", "reactor"]) == 0
+    # shared text is copied from the existing row, only the new text is embedded
+    assert index.add_document("doc:b", ["reactor", "scrubber"]) == 1
+    assert embedder.calls == [["tank", "reactor"], ["scrubber"]]
+
+    reloaded = EmbeddingIndex(CountingEmbedder(), root=str(tmp_path))
+    assert len(reloaded) == 4
+    assert reloaded.add_document("doc:b", ["reactor", "scrubber"]) == 0
+    score, row = reloaded.search("scrubber", top_k=1, doc_ids=["doc:b"])[0]
+    assert reloaded.chunks[row]["text"] == "scrubber" and score > 0.99
+
+def test_retriever_returns_relevant_chunks_in_document_order(tmp_path):
+    retriever = ProcessRetriever(EmbeddingIndex(HashingEmbedder(), root=str(tmp_path)), top_k=2, chunk_tokens=15)
+    retriever.add("process_description", DESCRIPTION)
+    chunks = chunk_text(DESCRIPTION, 15)
+    assert len(chunks) > 2
+
+    context = retriever.context_for("caustic scrubber off-gas vented")
+    assert "caustic scrubber" in context
+    lines = context.splitlines()
+    assert len(lines) == 2
+    assert [chunks.index(l) for l in lines] == sorted(chunks.index(l) for l in lines)
@@ -0,0 +1,70 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from module.risk_module import RISK_MATRIX, derive_risk_columns, risk_categories, risk_levels
+from module.schema_json import HAZOP_HEADERS
+
+def _prompt_matrix(prefix: str) -> dict:
+    # "S5:5,5,4,3,2; ..." lists each severity row from L5 down to L1
+    text = re.search(r"Risk Matrix RL\(S,L\): ([^.]*)\.", prefix).group(1)
+    rows = {}
+    for part in text.split(";"):
+        s, values = part.strip().split(":")
+        rows[int(s[1:])] = [int(v) for v in values.split(",")][::-1]
+    return rows
+
+def test_risk_matrix_matches_prompt(backend_cwd):
+    from module.agent_module import get_hazop_fewshot_prompt
+
+    for output_format in ("csv", "structured"):
+        rows = _prompt_matrix(get_hazop_fewshot_prompt(output_format=output_format).prefix)
+        assert sorted(rows) == [1, 2, 3, 4, 5]
+        for s, by_l in rows.items():
+            for l, rl in enumerate(by_l, start=1):
+                assert RISK_MATRIX[s - 1, l - 1] == rl, f"S{s}/L{l}"
+
+def test_others_prompt_uses_the_risk_matrix(backend_cwd):
+    from module.agent_module import get_hazop_other_prompt
+
+    prompt = get_hazop_other_prompt()
+    rows = _prompt_matrix(prompt.prefix)
+    assert all(RISK_MATRIX[s - 1, l - 1] == rl for s, by_l in rows.items() for l, rl in enumerate(by_l, start=1))
+    assert "Severity * Likelihood" not in prompt.prefix
+    # the example row must pass risk derivation untouched
+    example = prompt.examples[0]["table"].split(",")
+    _, report, flagged = derive_risk_columns(pd.DataFrame([example], columns=HAZOP_HEADERS), correct=False)
+    assert not flagged.any(), report
+
+def test_risk_levels_invalid_pairs_are_zero():
+    rl = risk_levels([3, 0, 6, "x", None, 2.5, "4"], [3, 3, 1, 1, 1, 1, "5"])
+    assert rl.tolist() == [3, 0, 0, 0, 0, 0, 5]
+    assert risk_categories(rl).tolist() == ["Medium", "N/A", "N/A", "N/A", "N/A", "N/A", "High"]
+
+def _row(**overrides) -> list:
+    row = dict(zip(range(len(HAZOP_HEADERS)), ["N/A"] * len(HAZOP_HEADERS)))
+    values = {
+        "S Before Safeguards": 3, "L Before Safeguards": 3, "RR Before Safeguards": 3,
+        "Unmitigated Risk Category": "Medium", "S": 2, "L": 2, "RR": 2, "Mitigated Risk Category": "Low",
+        "S After Recommendation": 1, "L After Recommendation": 1, "RR After Recommendation": 1,
+    }
+    values.update(overrides)
+    for name, value in values.items():
+        row[HAZOP_HEADERS.index(name)] = value
+    overall = [i for i, h in enumerate(HAZOP_HEADERS) if h == "Overall Risk"]
+    row[overall[0]], row[overall[1]] = values["Unmitigated Risk Category"], values["Mitigated Risk Category"]
+    return [row[i] for i in range(len(HAZOP_HEADERS))]
+
+def test_derive_risk_columns_keeps_correct_rows_and_fixes_wrong_ones():
+    df = pd.DataFrame([_row(), _row(RR=9, **{"Mitigated Risk Category": "High"}), _row(S="?")])
+    out, report, flagged = derive_risk_columns(df)
+
+    rr = HAZOP_HEADERS.index("RR")
+    assert out.iloc[0].tolist() == df.iloc[0].tolist()
+    assert out.iloc[1, rr] == 2 and out.iloc[1, HAZOP_HEADERS.index("Mitigated Risk Category")] == "Low"
+    assert out.iloc[2, rr] == 2          # unusable S/L: flagged, left as written
+    assert flagged.tolist() == [False, True, True]
+    assert report["rr_mismatch"]["mitigated"] == 1
+    assert report["invalid_sl"]["mitigated"] == 1
+    assert np.array_equal(df.iloc[:, rr].tolist(), [2, 9, 2])   # correct=True works on a copy
@@ -0,0 +1,75 @@
+import json, os
+from types import SimpleNamespace
+
+import pandas as pd
+
+from module.runs_module import PARSED_ROWS, finish_run, list_runs, merge_runs, run_paths, start_run
+from module.schema_json import HAZOP_HEADERS
+from module.sink_module import iter_xlsx_rows, write_xlsx_rows
+
+def _rows(tag: str, n: int) -> list:
+    return [[f"{tag}-{i}"] + ["N/A"] * (len(HAZOP_HEADERS) - 1) for i in range(n)]
+
+def _write_run(run, tag: str, n: int) -> None:
+    paths = run_paths(run)
+    write_xlsx_rows(paths["excel_path"], [iter(_rows(tag, n))])
+    write_xlsx_rows(paths["parsed_excel_path"], [iter(_rows(tag, n))])
+    pd.DataFrame({"tag": [tag] * n}).to_csv(paths["llm_response_log_path"], index=False)
+
+def _nodes(path: str) -> list:
+    return [r[0] for r in iter_xlsx_rows(path)]
+
+def test_legacy_outputs_are_adopted_without_lock_files(tmp_path):
+    base = str(tmp_path)
+    write_xlsx_rows(os.path.join(base, "hazop-a.xlsx"), [iter(_rows("old", 2))])
+    write_xlsx_rows(os.path.join(base, PARSED_ROWS), [iter(_rows("old", 2))])
+    pd.DataFrame({"tag": ["old", "old"]}).to_csv(os.path.join(base, "llm_response_log.csv"), index=False)
+    (tmp_path / "~$hazop-a.xlsx").write_bytes(b"\x05agent ")      # Excel owner file
+    (tmp_path / "broken.xlsx").write_text("not a zip")
+
+    run = start_run(base, "hazop-a.xlsx")
+    legacy = next(r for r in list_runs(base) if r["run_id"] == "legacy")
+    assert legacy["status"] == "complete"
+    assert legacy["workbooks"] == ["hazop-a.xlsx"]
+    assert sorted(os.listdir(legacy["dir"])) == ["hazop-a.xlsx", "llm_response_log.csv", PARSED_ROWS, "run.json"]
+    # originals stay readable until the first merge rewrites them
+    assert _nodes(os.path.join(base, PARSED_ROWS)) == ["old-0", "old-1"]
+    assert (tmp_path / "~$hazop-a.xlsx").exists() and (tmp_path / "broken.xlsx").exists()
+    assert not (tmp_path / "runs.tmp").exists()
+
+    _write_run(run, "new", 1)
+    finish_run(run)
+    report = merge_runs(base)
+    assert report["runs"] == ["legacy", run["run_id"]]
+    assert _nodes(os.path.join(base, PARSED_ROWS)) == ["old-0", "old-1", "new-0"]
+    assert _nodes(os.path.join(base, "hazop-a.xlsx")) == ["old-0", "old-1", "new-0"]
+    assert pd.read_csv(os.path.join(base, "llm_response_log.csv"))["tag"].tolist() == ["old", "old", "new"]
+
+def test_merge_skips_running_and_superseded_runs(tmp_path):
+    base = str(tmp_path)
+    superseded, complete, running = (start_run(base, "hazop-a.xlsx") for _ in range(3))
+    for run, tag in ((superseded, "s"), (complete, "c"), (running, "r")):
+        _write_run(run, tag, 1)
+    finish_run(superseded, "superseded")
+    finish_run(complete)
+
+    report = merge_runs(base)
+    assert report["runs"] == [complete["run_id"]]
+    assert report["skipped_running"] == [running["run_id"]]
+    assert _nodes(os.path.join(base, PARSED_ROWS)) == ["c-0"]
+    with open(os.path.join(complete["dir"], "run.json"), encoding="utf-8") as f:
+        assert json.load(f)["status"] == "complete"
+
+def test_runs_started_in_the_same_second_merge_in_start_order(tmp_path, monkeypatch):
+    base = str(tmp_path)
+    # random run id suffixes that sort against the start order
+    suffixes = iter(["ffffff", "888888", "000000"])
+    monkeypatch.setattr("module.runs_module.uuid.uuid4", lambda: SimpleNamespace(hex=next(suffixes)))
+    runs = [start_run(base, "hazop-a.xlsx") for _ in range(3)]
+    for run, tag in zip(runs, ("r1", "r2", "r3")):
+        _write_run(run, tag, 1)
+        finish_run(run)
+
+    assert [r["run_id"] for r in list_runs(base)] == [r["run_id"] for r in runs]
+    merge_runs(base)
+    assert _nodes(os.path.join(base, PARSED_ROWS)) == ["r1-0", "r2-0", "r3-0"]
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from module.graph_module import unwrap_pid_data
+from module.schema_json import PIDResponse
+from module.tile_module import merge_pid_responses, parse_grid
+
+def _pid(equipment, connections, valves=()) -> PIDResponse:
+    return PIDResponse(
+        process_description="", system_inputs=[], system_outputs=[],
+        equipment=[{"id": i, "name": n, "type": t} for i, n, t in equipment],
+        valves=[{"id": i, "type": t, "location": loc} for i, t, loc in valves],
+        instruments=[], utility_lines=[],
+        connections=[{"line_id": l, "from_id": a, "to_id": b, "valves": v} for l, a, b, v in connections],
+    )
+
+def test_identical_pages_merge_to_one_page(backend_cwd):
+    with open(backend_cwd / "static" / "data" / "h2o2.json", encoding="utf-8") as f:
+        page = PIDResponse(**unwrap_pid_data(json.load(f)))
+    merged = merge_pid_responses([("F1P1", page), ("F1P2", page)])
+    for field in ("equipment", "valves", "instruments", "connections"):
+        assert len(getattr(merged, field)) == len(getattr(page, field)), field
+
+def test_overlap_reconciles_by_label_and_namespaces_real_collisions():
+    left = _pid(
+        [("E1", "Reactor", "reactor"), ("E2", "Feed pump", "pump")],
+        [("L1", "E2", "E1", ["V1"])],
+        [("V1", "gate valve", "pump discharge to reactor")],
+    )
+    # the right tile numbers the shared pump E1 and reuses E2 for a new scrubber
+    right = _pid(
+        [("E1", "Feed pump", "pump"), ("E2", "Scrubber", "scrubber")],
+        [("L1", "E1", "E2", []), ("L2", "E1", "T1-X", ["V7"])],
+        [("V7", "gate valve", "pump discharge to reactor")],
+    )
+    merged = merge_pid_responses([("T1", left), ("T2", right)])
+
+    assert sorted(e.id for e in merged.equipment) == ["E1", "E2", "T2-E2"]
+    assert {e.id: e.name for e in merged.equipment}["T2-E2"] == "Scrubber"
+    assert [v.id for v in merged.valves] == ["V1"]
+    ends = {(c.line_id, c.from_id, c.to_id, tuple(c.valves)) for c in merged.connections}
+    assert ends == {("L1", "E2", "E1", ("V1",)), ("T2-L1", "E2", "T2-E2", ()), ("L2", "E2", "T1-X", ("V1",))}
+
+def test_plant_tags_match_across_tiles():
+    a = _pid([("R-101", "Reactor", "reactor")], [("L1", "R-101", "Vent", [])])
+    b = _pid([("R 101", "Reactor", "reactor")], [])                  # same tag, other spelling
+    c = _pid(                                                        # same tag, in the label only
+        [("E3", "Reactor R-101 jacket", "reactor"), ("E4", "Cooler", "heat exchanger")],
+        [("L1", "E3", "E4", [])],
+    )
+    merged = merge_pid_responses([("T1", a), ("T2", b), ("T3", c)])
+    assert sorted(e.id for e in merged.equipment) == ["E4", "R-101"]
+    assert [(c.from_id, c.to_id) for c in merged.connections] == [("R-101", "Vent"), ("R-101", "E4")]
+
+def test_parse_grid():
+    assert parse_grid("2x3") == (2, 3)
+    assert parse_grid(" 2X2 ") == (2, 2)
+    assert parse_grid("3") == (3, 1)
+    for raw in ("ax2", "2xb", "0x2", "2x99"):
+        with pytest.raises(ValueError):
+            parse_grid(raw)
+
+def test_parallel_lines_within_a_tile_are_kept():
+    tile = _pid(
+        [("V-101", "Feed vessel", "vessel"), ("P-101", "Feed pump", "pump")],
+        [("L1", "V-101", "P-101", []), ("L2", "V-101", "P-101", [])],
+    )
+    # the overlap tile shows one of the two lines again, numbered its own way
+    overlap = _pid(
+        [("V-101", "Feed vessel", "vessel"), ("P-101", "Feed pump", "pump")],
+        [("L7", "V-101", "P-101", [])],
+    )
+    merged = merge_pid_responses([("T1", tile), ("T2", overlap)])
+    assert [c.line_id for c in merged.connections] == ["L1", "L2"]
+
+    merged = merge_pid_responses([("T1", overlap), ("T2", tile)])
+    assert [c.line_id for c in merged.connections] == ["L7", "L2"]
@@ -20,6 +20,11 @@ def _slugify_filename(raw: str) -> str:
     s = re.sub(r"[^a-z0-9_\-]+", "", s)
     return s or "pid_result"
 
+def pid_json_path(image_path: PathLike, out_dir: str = "data", *, name: str | None = None, suffix: str = ".json") -> Path:
+    """Where save_pid_json writes the P&ID of image_path (name is slugified)."""
+    base = _slugify_filename(name) if name else Path(image_path).stem
+    return Path(out_dir) / f"{base}{suffix}"
+
 @timeit_log
 def save_pid_json(
     pid_data: PIDResponse,
@@ -31,15 +36,8 @@ def save_pid_json(
     suffix: str = ".json",
     indent: int = 2,
 ) -> Path:
-    img_path = Path(image_path)
-    out_path = Path(out_dir)
-    out_path.mkdir(parents=True, exist_ok=True)
-    if name:
-        base = _slugify_filename(name)
-    else:
-        base = img_path.stem
-
-    save_path = out_path / f"{base}{suffix}"
+    save_path = pid_json_path(image_path, out_dir, name=name, suffix=suffix)
+    save_path.parent.mkdir(parents=True, exist_ok=True)
     combined = {
         "pid_data": pid_data.model_dump(by_alias=True),
         "metadata": metadata,